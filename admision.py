@@ -0,0 +1,136 @@
+"""Control de admisión por ruta y por token de API.
+
+Cada regla se aplica a las rutas que empiezan con su prefijo y admite:
+  - "concurrencia": requests simultáneos en la ruta, sumando todos los tokens.
+    Si se llena, el servidor está saturado y se responde 503.
+  - "concurrencia_por_token": requests simultáneos de un mismo token (429).
+  - "por_minuto_por_token": ritmo de un mismo token, con ráfagas de hasta
+    "rafaga_por_token" (por defecto, 10 segundos de ritmo) (429).
+
+Lo que excede se rechaza al instante con Retry-After en vez de encolarse: un
+cliente que inunda generar_google_sheet no agota la cuota de Google que
+comparten todos. Los límites son por proceso; con varios workers de uvicorn
+el total es el de cada uno por la cantidad de workers.
+
+Sin ADMISION_LIMITES no hay límites. ADMISION_LIMITES=sugeridos activa
+LIMITES_SUGERIDOS; si no, va un JSON {prefijo: regla}. Ojo: los límites "por
+token" son por valor de x-api-token, y si todos los operadores comparten el
+mismo API_TOKEN funcionan como límites globales (p. ej. un solo
+/generar_excel/ a la vez en toda la app). Para que sean por cliente, darle a
+cada uno su token en API_TOKENS.
+"""
+import json
+import math
+import threading
+
+from google_api import TokenBucket
+
+
+LIMITES_SUGERIDOS = {
+    "/generar_google_sheet/": {"concurrencia": 8, "concurrencia_por_token": 2, "por_minuto_por_token": 30},
+    "/generar_excel/": {"concurrencia": 2, "concurrencia_por_token": 1, "por_minuto_por_token": 10},
+    "/agregar_prendas/": {"concurrencia": 4, "concurrencia_por_token": 2, "por_minuto_por_token": 60},
+    "/agregar_prenda/": {"concurrencia_por_token": 8, "por_minuto_por_token": 300},
+    "/listar_sheets/": {"por_minuto_por_token": 60},
+    "/leer_encabezados_sheet": {"por_minuto_por_token": 120},
+}
+
+
+class Rechazado(Exception):
+    """El request excede un límite; `status` es 429 (límite del token) o 503
+    (ruta saturada)."""
+
+    def __init__(self, status, retry_after, prefijo, motivo, msg):
+        super().__init__(msg)
+        self.status = status
+        self.prefijo = prefijo
+        self.retry_after = retry_after
+        self.motivo = motivo
+
+
+def cargar_limites(texto):
+    """Límites desde ADMISION_LIMITES: vacío es sin límites, "sugeridos" son
+    LIMITES_SUGERIDOS y cualquier otro valor es un JSON {prefijo: regla}."""
+    if not texto:
+        return {}
+    if texto.strip() == "sugeridos":
+        return LIMITES_SUGERIDOS
+    limites = json.loads(texto)
+    if not isinstance(limites, dict):
+        raise ValueError("ADMISION_LIMITES tiene que ser un objeto {prefijo: regla}")
+    return limites
+
+
+class ControlAdmision:
+    def __init__(self, limites=None, retry_after=5):
+        self.limites = limites or {}
+        self.retry_after = retry_after
+        # Prefijo más largo primero: /agregar_prendas/ antes que /agregar_prenda
+        self._prefijos = sorted(self.limites, key=len, reverse=True)
+        self._lock = threading.Lock()
+        self._en_curso = {}        # prefijo -> requests en curso
+        self._en_curso_token = {}  # (token, prefijo) -> requests en curso
+        self._buckets = {}         # (token, prefijo) -> TokenBucket
+        self.rechazos = {}         # motivo -> cantidad
+
+    def regla(self, path):
+        """Devuelve (prefijo, regla) de la ruta, o (None, None) si no tiene límites."""
+        for prefijo in self._prefijos:
+            if path.startswith(prefijo):
+                return prefijo, self.limites[prefijo]
+        return None, None
+
+    def _bucket(self, clave, regla):
+        bucket = self._buckets.get(clave)
+        if bucket is None:
+            tasa = regla["por_minuto_por_token"] / 60
+            capacidad = regla.get("rafaga_por_token") or max(1, math.ceil(tasa * 10))
+            bucket = self._buckets[clave] = TokenBucket(tasa, capacidad)
+        return bucket
+
+    def _rechazar(self, status, retry_after, prefijo, motivo, msg):
+        self.rechazos[motivo] = self.rechazos.get(motivo, 0) + 1
+        raise Rechazado(status, max(1, math.ceil(retry_after)), prefijo, motivo, msg)
+
+    def admitir(self, token, path):
+        """Ocupa un lugar para el request o lanza `Rechazado`. Devuelve el
+        prefijo a pasar a `liberar` al terminar (None si la ruta no tiene límites)."""
+        prefijo, regla = self.regla(path)
+        if regla is None:
+            return None
+        clave = (token, prefijo)
+        with self._lock:
+            maximo = regla.get("concurrencia")
+            if maximo is not None and self._en_curso.get(prefijo, 0) >= maximo:
+                self._rechazar(503, self.retry_after, prefijo, "concurrencia",
+                               "Servidor ocupado, reintentar más tarde")
+            maximo = regla.get("concurrencia_por_token")
+            if maximo is not None and self._en_curso_token.get(clave, 0) >= maximo:
+                self._rechazar(429, self.retry_after, prefijo, "concurrencia_por_token",
+                               f"Demasiados requests simultáneos a {prefijo}")
+            # El ritmo se descuenta último, para no gastarlo en un rechazo
+            if regla.get("por_minuto_por_token"):
+                espera = self._bucket(clave, regla).intentar()
+                if espera:
+                    self._rechazar(429, espera, prefijo, "por_minuto_por_token",
+                                   f"Demasiados requests a {prefijo}, reintentar en unos segundos")
+            self._en_curso[prefijo] = self._en_curso.get(prefijo, 0) + 1
+            self._en_curso_token[clave] = self._en_curso_token.get(clave, 0) + 1
+        return prefijo
+
+    def liberar(self, token, prefijo):
+        if prefijo is None:
+            return
+        clave = (token, prefijo)
+        with self._lock:
+            self._en_curso[prefijo] -= 1
+            self._en_curso_token[clave] -= 1
+            if not self._en_curso_token[clave]:
+                del self._en_curso_token[clave]
+
+    def estado(self):
+        with self._lock:
+            return {
+                "en_curso": dict(self._en_curso),
+                "rechazos": dict(self.rechazos),
+            }
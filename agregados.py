@@ -0,0 +1,111 @@
+"""Totales por talle de un pedido y su caché por planilla.
+
+Un agregado es un dict {"talles", "por_talle", "total", "prendas"} con
+`por_talle` alineado con `talles`. Los totales se calculan sobre la matriz de
+cantidades en una sola pasada por columnas (zip de las filas), sin bucles
+anidados por celda.
+"""
+import json
+import sqlite3
+import threading
+import time
+from itertools import islice, zip_longest
+
+
+def entero(valor):
+    """Cantidad de una celda: números y textos numéricos cuentan, el resto es 0."""
+    if isinstance(valor, bool) or valor is None or valor == "":
+        return 0
+    if isinstance(valor, int):
+        return valor
+    try:
+        return int(float(valor))
+    except (TypeError, ValueError):
+        return 0
+
+
+def agregado_vacio(talles):
+    return {"talles": list(talles), "por_talle": [0] * len(talles), "total": 0, "prendas": 0}
+
+
+def totales_por_talle(filas, talles):
+    """Agregado de una matriz de cantidades (una fila por prenda, una columna
+    por talle). Las filas cortas se completan con 0; el total general incluye
+    también las columnas que sobren respecto de `talles`."""
+    matriz = [list(map(entero, fila)) for fila in filas]
+    columnas = list(map(sum, zip_longest(*matriz, fillvalue=0)))
+    por_talle = (columnas + [0] * len(talles))[:len(talles)]
+    return {"talles": list(talles), "por_talle": por_talle, "total": sum(columnas), "prendas": len(matriz)}
+
+
+def totales_prendas(prendas):
+    """Agregado de prendas que comparten talles (las de una misma planilla)."""
+    talles = prendas[0]['talles'] if prendas else []
+    return totales_por_talle((p['cantidades'] for p in prendas), talles)
+
+
+def combinar(anterior, nuevo):
+    """Suma dos agregados posición a posición, como quedan en la planilla: las
+    cantidades nuevas se escriben bajo los encabezados que ya había."""
+    talles = anterior["talles"] or nuevo["talles"]
+    por_talle = [a + b for a, b in zip_longest(anterior["por_talle"], nuevo["por_talle"], fillvalue=0)]
+    return {
+        "talles": talles,
+        "por_talle": (por_talle + [0] * len(talles))[:len(talles)],
+        "total": anterior["total"] + nuevo["total"],
+        "prendas": anterior["prendas"] + nuevo["prendas"],
+    }
+
+
+def resumir_prendas(prendas, tam_bloque=1000):
+    """Agregado de prendas con talles posiblemente distintos (un pedido del
+    almacén), sumando por nombre de talle. Se consume de a bloques, así sirve
+    para un iterador largo sin armar la lista completa."""
+    por_nombre = {}
+    total = cantidad = 0
+    prendas = iter(prendas)
+    while True:
+        bloque = list(islice(prendas, tam_bloque))
+        if not bloque:
+            break
+        grupos = {}
+        for prenda in bloque:
+            grupos.setdefault(tuple(prenda['talles']), []).append(prenda['cantidades'])
+        for talles, filas in grupos.items():
+            parcial = totales_por_talle(filas, talles)
+            for talle, suma in zip(talles, parcial["por_talle"]):
+                por_nombre[talle] = por_nombre.get(talle, 0) + suma
+            total += parcial["total"]
+            cantidad += parcial["prendas"]
+    return {"talles": list(por_nombre), "por_talle": list(por_nombre.values()), "total": total, "prendas": cantidad}
+
+
+class AgregadosHojas:
+    """Último agregado conocido de cada planilla escrita por la API, en SQLite
+    para que lo compartan los workers."""
+
+    def __init__(self, path="agregados.db", timeout=30):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=timeout)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS agregados_hojas ("
+            "spreadsheet_id TEXT PRIMARY KEY, datos TEXT NOT NULL, actualizado REAL NOT NULL)")
+        self._conn.commit()
+
+    def obtener(self, spreadsheet_id):
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT datos FROM agregados_hojas WHERE spreadsheet_id = ?", (spreadsheet_id,)).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+    def guardar(self, spreadsheet_id, agregado):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO agregados_hojas (spreadsheet_id, datos, actualizado) VALUES (?, ?, ?)",
+                (spreadsheet_id, json.dumps(agregado), time.time()))
+            self._conn.commit()
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,144 @@
+"""Almacenamiento de las prendas cargadas, agrupadas por pedido.
+
+Por defecto usa SQLite (un archivo compartido por todos los workers de
+uvicorn, en modo WAL para que las escrituras concurrentes no se pisen). Se
+elige con la variable ALMACEN_URL: `sqlite:///ruta.db` o `memoria://`.
+"""
+import json
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+
+
+PEDIDO_GENERAL = "general"
+
+
+class AlmacenPrendas(ABC):
+    """Interfaz de los almacenes de prendas."""
+
+    @abstractmethod
+    def agregar(self, pedido_id, prenda):
+        """Guarda la prenda en el pedido y devuelve su id."""
+
+    @abstractmethod
+    def iterar(self, pedido_id=None, desde_id=0, limite=None):
+        """Recorre las prendas en orden de carga, con id mayor a `desde_id`,
+        de un pedido o de todos si `pedido_id` es None."""
+
+    def listar(self, pedido_id=None, desde_id=0, limite=None):
+        return list(self.iterar(pedido_id, desde_id, limite))
+
+    def iterar_por_paginas(self, pedido_id=None, desde_id=0, tam_pagina=500):
+        """Como `iterar`, pero leyendo de a `tam_pagina` filas por consulta. Cada
+        página se lee completa en una sola llamada, así el generador se puede
+        consumir desde hilos distintos (p. ej. un StreamingResponse)."""
+        while True:
+            pagina = self.listar(pedido_id, desde_id, tam_pagina)
+            yield from pagina
+            if len(pagina) < tam_pagina:
+                return
+            desde_id = pagina[-1]["id"]
+
+    def cerrar(self):
+        pass
+
+
+class AlmacenSQLite(AlmacenPrendas):
+
+    def __init__(self, path="prendas.db", timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()  # una conexión por hilo
+        conn = self._conexion()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS prendas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                pedido_id TEXT NOT NULL,
+                url_imagen TEXT NOT NULL,
+                descripcion TEXT NOT NULL DEFAULT '',
+                cantidades TEXT NOT NULL,
+                talles TEXT NOT NULL,
+                creado REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_prendas_pedido ON prendas (pedido_id, id);
+        """)
+
+    def _conexion(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+            self._local.conn = conn
+        return conn
+
+    def agregar(self, pedido_id, prenda):
+        conn = self._conexion()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO prendas (pedido_id, url_imagen, descripcion, cantidades, talles, creado) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (pedido_id, prenda["url_imagen"], prenda.get("descripcion", ""),
+                 json.dumps(prenda["cantidades"]), json.dumps(prenda["talles"]), time.time()))
+        return cursor.lastrowid
+
+    def iterar(self, pedido_id=None, desde_id=0, limite=None):
+        sql = "SELECT id, pedido_id, url_imagen, descripcion, cantidades, talles FROM prendas WHERE id > ?"
+        params = [desde_id]
+        if pedido_id is not None:
+            sql += " AND pedido_id = ?"
+            params.append(pedido_id)
+        sql += " ORDER BY id"
+        if limite is not None:
+            sql += " LIMIT ?"
+            params.append(limite)
+        # El cursor se consume de a una fila: no se arma la lista completa en memoria
+        for id_, pedido, url_imagen, descripcion, cantidades, talles in self._conexion().execute(sql, params):
+            yield {
+                "id": id_,
+                "pedido_id": pedido,
+                "url_imagen": url_imagen,
+                "descripcion": descripcion,
+                "cantidades": json.loads(cantidades),
+                "talles": json.loads(talles),
+            }
+
+    def cerrar(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class AlmacenMemoria(AlmacenPrendas):
+    """Almacén en memoria del proceso; útil para pruebas con un solo worker."""
+
+    def __init__(self):
+        self._prendas = []
+        self._lock = threading.Lock()
+
+    def agregar(self, pedido_id, prenda):
+        with self._lock:
+            id_ = len(self._prendas) + 1
+            self._prendas.append({"id": id_, "pedido_id": pedido_id, **prenda})
+        return id_
+
+    def iterar(self, pedido_id=None, desde_id=0, limite=None):
+        entregadas = 0
+        # Los ids son posiciones + 1: se arranca directo desde `desde_id`
+        for prenda in self._prendas[desde_id:]:
+            if limite is not None and entregadas >= limite:
+                return
+            if pedido_id is None or prenda["pedido_id"] == pedido_id:
+                entregadas += 1
+                yield dict(prenda)
+
+
+def crear_almacen(url):
+    if url.startswith("memoria://"):
+        return AlmacenMemoria()
+    if url.startswith("sqlite:///"):
+        return AlmacenSQLite(url[len("sqlite:///"):])
+    raise ValueError(f"ALMACEN_URL no soportada: {url}")
@@ -0,0 +1,358 @@
+"""Benchmark de la API contra Sheets, Drive y Cloudinary falsos (ver fakes.py).
+
+Levanta la app en el mismo proceso (httpx.ASGITransport, sin red ni cuentas
+reales) y mide, por escenario, tamaño de pedido y concurrencia: latencia p50 y
+p99, throughput, pico de memoria (tracemalloc) y round trips a las APIs
+externas por request.
+
+    python benchmark.py
+    python benchmark.py --escenarios generar,anexar --tamanos 100,1000 --concurrencias 1,8
+    python benchmark.py --salida base.json        # guardar una corrida
+    python benchmark.py --base base.json          # comparar; sale con 1 si algo empeoró
+    python benchmark.py --escenarios arranque     # arranque en frío
+
+Escenarios:
+  generar  POST /generar_google_sheet/ creando una planilla de N prendas
+  anexar   POST /generar_google_sheet/ agregando N prendas a una planilla existente
+  listar   GET /listar_sheets/?force_refresh=true con N planillas en Drive
+  agregar  N x POST /agregar_prenda/ con imágenes distintas
+  arranque en procesos nuevos: tiempo de `import main` y del primer request que
+           usa Google (p50/p99 = primer request; se mide sin y con
+           precalentar los servicios). Los servicios son los reales de
+           googleapiclient sobre un Http falso, así cuenta el armado desde el
+           discovery; no depende de --tamanos ni --concurrencias.
+
+Requiere httpx (el mismo que usa el TestClient de FastAPI).
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+
+ESCENARIOS = ("generar", "anexar", "listar", "agregar", "arranque")
+
+
+def _preparar_entorno(directorio):
+    # Antes de importar main: nada de archivos en el repo ni logs por request
+    os.environ.setdefault("ALMACEN_URL", "memoria://")
+    os.environ.setdefault("AGREGADOS_DB", os.path.join(directorio, "agregados.db"))
+    os.environ.setdefault("TRABAJOS_DB", os.path.join(directorio, "trabajos.db"))
+    os.environ.setdefault("BLOQUEOS_DB", os.path.join(directorio, "bloqueos.db"))
+    os.environ.setdefault("IMAGENES_INDICE", os.path.join(directorio, "imagenes_cache.db"))
+    os.environ.setdefault("MINIATURAS_DIR", os.path.join(directorio, "miniaturas"))
+    os.environ.setdefault("LOG_TIEMPOS", "0")
+
+
+class Entorno:
+    """La app conectada a servicios falsos nuevos."""
+
+    def __init__(self, args):
+        import fakes
+        import google_api
+        import main
+        from idempotencia import ResultadosIdempotentes
+
+        self.main = main
+        self.drive = fakes.DriveFalso(args.latencia_google, args.prob_cuota, semilla=1)
+        self.sheets = fakes.SheetsFalso(args.latencia_google, args.prob_cuota, semilla=2, drive=self.drive)
+        self.upload = fakes.subida_falsa(args.latencia_cloudinary, prob_cuota=args.prob_cuota, semilla=3)
+
+        main.gestor_credenciales.sheets = contextlib.contextmanager(lambda: (yield self.sheets))
+        main.gestor_credenciales.drive = contextlib.contextmanager(lambda: (yield self.drive))
+        main.gestor_credenciales.credenciales = lambda: object()
+        main.subidor.upload_fn = self.upload
+        main.catalogo_hojas.invalidar()
+        main.cache_encabezados.invalidar()
+        # Los ids de los fakes vuelven a empezar en cada Entorno: sin esto, una
+        # medición podría recibir las respuestas guardadas de la anterior
+        main.resultados_idempotentes = ResultadosIdempotentes()
+        if not args.cuotas_reales:
+            google_api.planificador._buckets = {}
+        google_api.planificador.backoff_base = 0.05
+
+    def round_trips(self):
+        return len(self.drive.llamadas) + len(self.sheets.llamadas) + len(self.upload.llamadas)
+
+
+def _prendas(n, talles=("S", "M", "L", "XL")):
+    return [{
+        "url_imagen": f"https://res.cloudinary.com/demo/image/upload/pedidos/{i}.jpg",
+        "cantidades": [(i + j) % 5 for j in range(len(talles))],
+        "talles": list(talles),
+    } for i in range(n)]
+
+
+def _imagen():
+    # Ruido: cada imagen es distinta, así el índice de deduplicación no evita
+    # la subida (ni dentro de una medición ni entre mediciones)
+    from PIL import Image
+    datos = io.BytesIO()
+    Image.frombytes("RGB", (64, 64), os.urandom(64 * 64 * 3)).save(datos, "JPEG")
+    return datos.getvalue()
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+async def _correr(cliente, pedidos, concurrencia):
+    """Ejecuta los pedidos (funciones async) con `concurrencia` en vuelo.
+    Devuelve (latencias, errores, segundos)."""
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias = []
+    errores = 0
+
+    async def uno(pedido):
+        nonlocal errores
+        async with semaforo:
+            inicio = time.perf_counter()
+            respuesta = await pedido(cliente)
+            latencias.append(time.perf_counter() - inicio)
+            if respuesta.status_code >= 400:
+                errores += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(uno(p) for p in pedidos))
+    return latencias, errores, time.perf_counter() - inicio
+
+
+def _pedidos(escenario, entorno, tamano, repeticiones):
+    encabezados = {"x-api-token": entorno.main.API_TOKEN}
+    if escenario == "generar":
+        cuerpo = {"prendas": _prendas(tamano), "sheetTitle": "Pedido benchmark"}
+        # Una Idempotency-Key por request: si no, los pedidos iguales se unen en uno
+        return [lambda c: c.post("/generar_google_sheet/", json=cuerpo,
+                                 headers={**encabezados, "Idempotency-Key": uuid.uuid4().hex})] * repeticiones
+    if escenario == "anexar":
+        # Cada request agrega a una planilla propia ya creada (con agregado en caché)
+        pedidos = []
+        for i in range(repeticiones):
+            url = entorno.main.generar_hoja({"prendas": _prendas(10), "sheetTitle": f"Pedido base {i}"})
+            cuerpo = {"prendas": _prendas(tamano), "spreadsheetId": url.rsplit("/", 1)[-1]}
+            pedidos.append(lambda c, cuerpo=cuerpo: c.post(
+                "/generar_google_sheet/", json=cuerpo,
+                headers={**encabezados, "Idempotency-Key": uuid.uuid4().hex}))
+        return pedidos
+    if escenario == "listar":
+        for i in range(tamano):
+            entorno.sheets.spreadsheets().create(body={"properties": {"title": f"Pedido {i}"}}).execute()
+        return [lambda c: c.get("/listar_sheets/?force_refresh=true", headers=encabezados)] * repeticiones
+    if escenario == "agregar":
+        def agregar(i):
+            datos = {"descripcion": f"Prenda {i}", "cantidades": "1,2,3", "talles": "S,M,L"}
+            archivos = {"foto": (f"{i}.jpg", _imagen(), "image/jpeg")}
+            return lambda c: c.post("/agregar_prenda/", data=datos, files=archivos, headers=encabezados)
+        return [agregar(i) for i in range(tamano)]
+    raise ValueError(escenario)
+
+
+def medir(args, escenario, tamano, concurrencia):
+    import httpx
+
+    entorno = Entorno(args)
+    repeticiones = max(args.repeticiones, concurrencia)
+    pedidos = _pedidos(escenario, entorno, tamano, repeticiones)
+    round_trips_previos = entorno.round_trips()
+
+    if args.memoria:
+        tracemalloc.start()
+
+    async def correr():
+        # Las excepciones sin manejar cuentan como 500, igual que con uvicorn
+        transporte = httpx.ASGITransport(app=entorno.main.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=None) as cliente:
+            return await _correr(cliente, pedidos, concurrencia)
+
+    latencias, errores, segundos = asyncio.run(correr())
+    pico = tracemalloc.get_traced_memory()[1] if args.memoria else None
+    if args.memoria:
+        tracemalloc.stop()
+
+    return {
+        "escenario": escenario,
+        "tamano": tamano,
+        "concurrencia": concurrencia,
+        "requests": len(latencias),
+        "errores": errores,
+        "p50_ms": round(statistics.median(latencias) * 1000, 1),
+        "p99_ms": round(_percentil(latencias, 99) * 1000, 1),
+        "req_por_s": round(len(latencias) / segundos, 2),
+        "pico_mib": round(pico / 2 ** 20, 1) if pico is not None else None,
+        "round_trips_por_request": round((entorno.round_trips() - round_trips_previos) / len(latencias), 2),
+    }
+
+
+def _hijo_arranque(precalentar):
+    """Corre en un proceso nuevo; imprime un JSON con los tiempos."""
+    import httpx
+
+    salida = io.StringIO()
+    with contextlib.redirect_stdout(salida):
+        inicio = time.perf_counter()
+        import main
+        import_ms = (time.perf_counter() - inicio) * 1000
+
+        import fakes
+        http = fakes.HttpFalso({"values": [["Imagen", "S", "M", "L"]]})
+        main.gestor_credenciales._leer_token = fakes.CredencialesFalsas
+        main.gestor_credenciales.http_factory = lambda: http
+
+        precalentar_ms = None
+        if precalentar:
+            inicio = time.perf_counter()
+            main.gestor_credenciales.precalentar()
+            precalentar_ms = (time.perf_counter() - inicio) * 1000
+
+        async def pedir():
+            transporte = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+            encabezados = {"x-api-token": main.API_TOKEN}
+            tiempos = []
+            async with httpx.AsyncClient(transport=transporte, base_url="http://bench") as cliente:
+                for spreadsheet_id in ("a", "b"):
+                    inicio = time.perf_counter()
+                    respuesta = await cliente.get(f"/leer_encabezados_sheet/?spreadsheet_id={spreadsheet_id}",
+                                                  headers=encabezados)
+                    tiempos.append(((time.perf_counter() - inicio) * 1000, respuesta.status_code))
+            return tiempos
+
+        (primero, estado), (segundo, _) = asyncio.run(pedir())
+    print(json.dumps({"import_ms": import_ms, "precalentar_ms": precalentar_ms, "primer_request_ms": primero,
+                      "segundo_request_ms": segundo, "estado": estado, "round_trips": len(http.llamadas) / 2}))
+
+
+def medir_arranque(args, precalentar):
+    import subprocess
+    corridas = []
+    for _ in range(args.repeticiones):
+        comando = [sys.executable, os.path.abspath(__file__), "--hijo-arranque"]
+        if precalentar:
+            comando.append("--precalentar")
+        resultado = subprocess.run(comando, capture_output=True, text=True, check=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        corridas.append(json.loads(resultado.stdout.strip().splitlines()[-1]))
+    primeros = [c["primer_request_ms"] for c in corridas]
+    return {
+        "escenario": "arranque_precalentado" if precalentar else "arranque",
+        "tamano": 0,
+        "concurrencia": 1,
+        "requests": len(corridas),
+        "errores": sum(1 for c in corridas if c["estado"] >= 400),
+        "p50_ms": round(statistics.median(primeros), 1),
+        "p99_ms": round(_percentil(primeros, 99), 1),
+        "req_por_s": None,
+        "pico_mib": None,
+        "round_trips_por_request": corridas[0]["round_trips"],
+        "import_ms": round(statistics.median(c["import_ms"] for c in corridas), 1),
+        "segundo_request_ms": round(statistics.median(c["segundo_request_ms"] for c in corridas), 1),
+        "precalentar_ms": (round(statistics.median(c["precalentar_ms"] for c in corridas), 1)
+                           if precalentar else None),
+    }
+
+
+def _imprimir(filas):
+    columnas = ["escenario", "tamano", "concurrencia", "requests", "errores",
+                "p50_ms", "p99_ms", "req_por_s", "pico_mib", "round_trips_por_request"]
+    if any("import_ms" in f for f in filas):
+        columnas += ["import_ms", "segundo_request_ms", "precalentar_ms"]
+    anchos = {c: max(len(c), *(len(str(f.get(c, ""))) for f in filas)) for c in columnas}
+    print("  ".join(c.rjust(anchos[c]) for c in columnas))
+    for f in filas:
+        print("  ".join(str(f.get(c, "")).rjust(anchos[c]) for c in columnas))
+
+
+def comparar(filas, base, tolerancia):
+    """Lista de regresiones respecto de una corrida guardada: p50, p99 o tiempo
+    de import más de `tolerancia` por encima, o más round trips por request."""
+    anteriores = {(f["escenario"], f["tamano"], f["concurrencia"]): f for f in base}
+    regresiones = []
+    for f in filas:
+        anterior = anteriores.get((f["escenario"], f["tamano"], f["concurrencia"]))
+        if anterior is None:
+            continue
+        for clave in ("p50_ms", "p99_ms", "import_ms"):
+            if clave in f and clave in anterior and f[clave] > anterior[clave] * (1 + tolerancia):
+                regresiones.append(f"{f['escenario']} n={f['tamano']} c={f['concurrencia']}: "
+                                   f"{clave} {anterior[clave]} -> {f[clave]}")
+        if f["round_trips_por_request"] > anterior["round_trips_por_request"]:
+            regresiones.append(f"{f['escenario']} n={f['tamano']} c={f['concurrencia']}: round trips "
+                               f"{anterior['round_trips_por_request']} -> {f['round_trips_por_request']}")
+    return regresiones
+
+
+def _lista(tipo):
+    return lambda texto: [tipo(x) for x in texto.split(",") if x]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--escenarios", type=_lista(str), default=list(ESCENARIOS))
+    parser.add_argument("--tamanos", type=_lista(int), default=[10, 100, 1000, 10000])
+    parser.add_argument("--concurrencias", type=_lista(int), default=[1, 8])
+    parser.add_argument("--repeticiones", type=int, default=5,
+                        help="requests por medición en generar/anexar/listar (al menos la concurrencia)")
+    parser.add_argument("--latencia-google", type=float, default=0.05)
+    parser.add_argument("--latencia-cloudinary", type=float, default=0.1)
+    parser.add_argument("--prob-cuota", type=float, default=0.0, help="probabilidad de error de cuota por round trip")
+    parser.add_argument("--cuotas-reales", action="store_true",
+                        help="respetar los límites por minuto del planificador (por defecto se desactivan)")
+    parser.add_argument("--sin-memoria", dest="memoria", action="store_false",
+                        help="no medir el pico de memoria (tracemalloc agrega overhead)")
+    parser.add_argument("--verbose", action="store_true", help="mostrar los logs de la app")
+    parser.add_argument("--salida", help="guardar los resultados en este JSON")
+    parser.add_argument("--base", help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.2)
+    parser.add_argument("--hijo-arranque", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--precalentar", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    for escenario in args.escenarios:
+        if escenario not in ESCENARIOS:
+            parser.error(f"escenario desconocido: {escenario}")
+
+    directorio = tempfile.mkdtemp(prefix="benchmark-")
+    _preparar_entorno(directorio)
+    if args.hijo_arranque:
+        _hijo_arranque(args.precalentar)
+        return
+
+    filas = []
+    for escenario in args.escenarios:
+        if escenario == "arranque":
+            for precalentar in (False, True):
+                fila = medir_arranque(args, precalentar)
+                print(json.dumps(fila), file=sys.stderr)
+                filas.append(fila)
+            continue
+        for tamano in args.tamanos:
+            for concurrencia in args.concurrencias:
+                # Los print() de la app ensucian la tabla; con --verbose se ven
+                with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+                    fila = medir(args, escenario, tamano, concurrencia)
+                print(json.dumps(fila), file=sys.stderr)
+                filas.append(fila)
+    _imprimir(filas)
+
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(filas, f, indent=2)
+    if args.base:
+        with open(args.base) as f:
+            regresiones = comparar(filas, json.load(f), args.tolerancia)
+        for regresion in regresiones:
+            print(f"REGRESIÓN {regresion}")
+        if regresiones:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Bloqueos por planilla compartidos entre procesos.
+
+Un bloqueo es una fila en SQLite con su dueño y un vencimiento. Mientras el
+dueño lo tiene, un hilo lo renueva; si el proceso muere sin soltarlo, vence
+solo y otro worker puede tomarlo. Los demás lo esperan consultando la tabla.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+class BloqueosCompartidos:
+    def __init__(self, path="bloqueos.db", duracion=60, intervalo=0.1, timeout=30):
+        self.duracion = duracion
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=timeout)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bloqueos ("
+            "clave TEXT PRIMARY KEY, duenio TEXT NOT NULL, vence REAL NOT NULL)")
+        self._conn.commit()
+
+    def _intentar(self, clave, duenio):
+        ahora = time.time()
+        with self._lock:
+            # Un solo INSERT: lo toma si está libre o si el anterior venció
+            self._conn.execute(
+                "INSERT INTO bloqueos (clave, duenio, vence) VALUES (?, ?, ?) "
+                "ON CONFLICT(clave) DO UPDATE SET duenio = excluded.duenio, vence = excluded.vence "
+                "WHERE bloqueos.vence < ?",
+                (clave, duenio, ahora + self.duracion, ahora))
+            self._conn.commit()
+            fila = self._conn.execute("SELECT duenio FROM bloqueos WHERE clave = ?", (clave,)).fetchone()
+        return fila is not None and fila[0] == duenio
+
+    def _renovar(self, clave, duenio):
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE bloqueos SET vence = ? WHERE clave = ? AND duenio = ?",
+                (time.time() + self.duracion, clave, duenio))
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def _soltar(self, clave, duenio):
+        with self._lock:
+            self._conn.execute("DELETE FROM bloqueos WHERE clave = ? AND duenio = ?", (clave, duenio))
+            self._conn.commit()
+
+    @contextmanager
+    def tomar(self, clave):
+        duenio = f"{os.getpid()}-{uuid.uuid4().hex}"
+        while not self._intentar(clave, duenio):
+            time.sleep(self.intervalo)
+        parar = threading.Event()
+
+        def renovar():
+            while not parar.wait(self.duracion / 3):
+                if not self._renovar(clave, duenio):
+                    print(f"Se perdió el bloqueo de {clave}")
+                    return
+
+        hilo = threading.Thread(target=renovar, name="bloqueo-renovar", daemon=True)
+        hilo.start()
+        try:
+            yield
+        finally:
+            parar.set()
+            hilo.join()
+            self._soltar(clave, duenio)
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
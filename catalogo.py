@@ -0,0 +1,180 @@
+import threading
+import time
+
+from google_api import ejecutar
+
+
+# Solo buscar en el drive principal del usuario, no en drives compartidos
+QUERY_PEDIDOS = ("mimeType='application/vnd.google-apps.spreadsheet' and trashed=false "
+                 "and 'me' in owners and name contains 'Pedido'")
+MIME_SHEET = "application/vnd.google-apps.spreadsheet"
+CAMPOS_ARCHIVO = "id, name, mimeType, webViewLink, modifiedTime, trashed, ownedByMe, owners, permissions"
+
+
+def es_pedido(f):
+    return f['name'].startswith('Pedido') and not f.get('trashed', False)
+
+
+def listar_archivos_pedido(drive_service):
+    """Lista todas las planillas 'Pedido...' del usuario recorriendo todas las páginas."""
+    params = {
+        "q": QUERY_PEDIDOS,
+        "pageSize": 1000,
+        "fields": f"nextPageToken, files({CAMPOS_ARCHIVO})",
+        "orderBy": "modifiedTime desc",
+        "corpora": "user",
+        "includeItemsFromAllDrives": False
+    }
+    files = []
+    page_token = None
+    while True:
+        if page_token:
+            params["pageToken"] = page_token
+        results = ejecutar(drive_service.files().list(**params))
+        files.extend(results.get('files', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+    # `contains` matchea por palabra; nos quedamos con las que empiezan con 'Pedido'
+    return [f for f in files if es_pedido(f)]
+
+
+class CatalogoHojas:
+    """Catálogo en memoria de las planillas 'Pedido'. Se arma una vez con un
+    listado completo y después se mantiene al día con el feed changes.list de
+    Drive, trayendo solo las diferencias cuando vence el TTL."""
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._archivos = {}
+        self._verificadas = set()
+        self._page_token = None
+        self._ultima_sync = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def vacio(self):
+        return self._page_token is None
+
+    def obtener(self, drive, force_refresh=False):
+        """Devuelve las planillas del catálogo. `drive` es una función que
+        presta un servicio de Drive (context manager); solo se llama si hay
+        que sincronizar."""
+        if not force_refresh and not self.vacio and time.monotonic() - self._ultima_sync < self.ttl:
+            return list(self._archivos.values())
+        with self._lock:
+            # Otro hilo pudo sincronizar mientras esperábamos el lock
+            if force_refresh or self.vacio:
+                with drive() as drive_service:
+                    self._reconstruir(drive_service)
+            elif time.monotonic() - self._ultima_sync >= self.ttl:
+                with drive() as drive_service:
+                    self._aplicar_cambios(drive_service)
+            return list(self._archivos.values())
+
+    def _reconstruir(self, drive_service):
+        # El token se pide antes de listar para no perder cambios intermedios
+        token = ejecutar(drive_service.changes().getStartPageToken())['startPageToken']
+        archivos = {f['id']: f for f in listar_archivos_pedido(drive_service)}
+        self._archivos = archivos
+        self._verificadas &= set(archivos)
+        self._page_token = token
+        self._ultima_sync = time.monotonic()
+        print(f"Catálogo reconstruido: {len(archivos)} planillas")
+
+    def _aplicar_cambios(self, drive_service):
+        token = self._page_token
+        cambios = 0
+        while token:
+            result = ejecutar(drive_service.changes().list(
+                pageToken=token,
+                pageSize=1000,
+                spaces='drive',
+                includeRemoved=True,
+                restrictToMyDrive=True,
+                fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({CAMPOS_ARCHIVO}))"
+            ))
+            for cambio in result.get('changes', []):
+                cambios += 1
+                file_id = cambio['fileId']
+                f = cambio.get('file')
+                self._verificadas.discard(file_id)
+                if cambio.get('removed') or not f or f.get('mimeType') != MIME_SHEET \
+                        or not f.get('ownedByMe', True) or not es_pedido(f):
+                    self._archivos.pop(file_id, None)
+                else:
+                    self._archivos[file_id] = f
+            if 'newStartPageToken' in result:
+                self._page_token = result['newStartPageToken']
+            token = result.get('nextPageToken')
+        self._ultima_sync = time.monotonic()
+        if cambios:
+            print(f"Catálogo actualizado: {cambios} cambios, {len(self._archivos)} planillas")
+
+    def modificados(self, drive, ids):
+        """modifiedTime de cada id según el catálogo (None si no está). Si el
+        catálogo ya se armó trae antes los cambios pendientes (como mucho una
+        vez por TTL); si está vacío no se arma solo para esto."""
+        if self.vacio:
+            return {file_id: None for file_id in ids}
+        self.obtener(drive)
+        archivos = self._archivos
+        return {file_id: archivos.get(file_id, {}).get('modifiedTime') for file_id in ids}
+
+    # --- Verificación de acceso ---
+
+    def sin_verificar(self, files):
+        return [f for f in files if f['id'] not in self._verificadas]
+
+    def marcar_verificadas(self, ids):
+        self._verificadas.update(ids)
+
+    def invalidar(self):
+        with self._lock:
+            self._archivos = {}
+            self._verificadas = set()
+            self._page_token = None
+
+
+class CacheEncabezados:
+    """Talles (fila de encabezados) de cada planilla. Una entrada deja de valer
+    cuando la API escribe en esa planilla (`invalidar`), cuando cambia el
+    modifiedTime que informa el catálogo o, si la planilla no está en el
+    catálogo, al vencer el TTL."""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._entradas = {}  # id -> (talles, modifiedTime, instante)
+        self._version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        """Tomarla antes de leer de Google y pasarla a `guardar`: si en el medio
+        hubo una invalidación, lo leído puede ser viejo y no se guarda."""
+        return self._version
+
+    def obtener(self, spreadsheet_id, modificado=None):
+        entrada = self._entradas.get(spreadsheet_id)
+        if entrada is None:
+            return None
+        talles, modificado_guardado, instante = entrada
+        if modificado is not None:
+            vigente = modificado == modificado_guardado
+        else:
+            vigente = time.monotonic() - instante < self.ttl
+        return list(talles) if vigente else None
+
+    def guardar(self, spreadsheet_id, talles, modificado=None, version=None):
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            self._entradas[spreadsheet_id] = (list(talles), modificado, time.monotonic())
+
+    def invalidar(self, spreadsheet_id=None):
+        with self._lock:
+            self._version += 1
+            if spreadsheet_id is None:
+                self._entradas = {}
+            else:
+                self._entradas.pop(spreadsheet_id, None)
@@ -0,0 +1,262 @@
+"""Credenciales de Google y pool de servicios de Sheets/Drive.
+
+Las librerías de Google se importan recién cuando hacen falta (son la mayor
+parte del tiempo de import de la app) y los servicios se arman desde los
+documentos de discovery que trae googleapiclient, parseados una sola vez.
+"""
+import base64
+import json
+import os
+import pickle
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+
+# Colecciones que usa la app, por API: las que conviene dejar armadas al precalentar
+COLECCIONES = {
+    ('sheets', 'v4'): ('spreadsheets', 'spreadsheets.values'),
+    ('drive', 'v3'): ('files', 'changes'),
+}
+
+
+class GestorCredenciales:
+    """Carga las credenciales una sola vez por proceso, las refresca antes de que
+    venzan y reparte servicios de Sheets/Drive reutilizables desde un pool."""
+
+    def __init__(self, token_path='token.pickle', secrets_path='credentials_oauth.json',
+                 scopes=SCOPES, margen_refresco=300, tam_pool=8, timeout_http=60,
+                 token_b64_env='GOOGLE_TOKEN_B64', token_b64_path='token.pickle.b64', http_factory=None):
+        self.token_path = token_path
+        # Token en base64 (variable de entorno o archivo del deploy): se carga
+        # en memoria, sin escribir token.pickle. La variable se lee al cargar,
+        # después del load_dotenv de main.
+        self.token_b64_env = token_b64_env
+        self.token_b64_path = token_b64_path
+        self._en_memoria = False
+        self.secrets_path = secrets_path
+        self.scopes = scopes
+        self.margen_refresco = margen_refresco  # segundos antes del vencimiento
+        self.tam_pool = tam_pool
+        self.timeout_http = timeout_http
+        # Arma el Http de cada servicio; se puede reemplazar por uno falso (ver fakes.py)
+        self.http_factory = http_factory
+        self._creds = None
+        self._lock = threading.Lock()           # protege la carga inicial y los pools
+        self._lock_refresco = threading.Lock()  # un solo refresco a la vez
+        self._pools = {}
+        self._documentos = {}  # (api, versión) -> documento de discovery parseado
+        self._esquemas = {}    # (api, versión) -> Schemas compartido por los servicios
+        self._generacion = 0  # cambia en cada invalidar(), descarta servicios viejos
+        self._hilo_refresco = None
+        self._detener = threading.Event()
+
+    # --- Credenciales ---
+
+    def credenciales(self):
+        creds = self._creds
+        if creds is None:
+            with self._lock:
+                if self._creds is None:
+                    self._creds = self._cargar()
+                creds = self._creds
+        if not creds.valid:
+            self._refrescar()
+        return self._creds
+
+    def _leer_token(self):
+        """token.pickle si existe (flujo local); si no, el token en base64."""
+        self._en_memoria = False
+        if os.path.exists(self.token_path):
+            with open(self.token_path, 'rb') as token:
+                return pickle.load(token)
+        b64 = os.getenv(self.token_b64_env) if self.token_b64_env else None
+        if not b64 and self.token_b64_path and os.path.exists(self.token_b64_path):
+            with open(self.token_b64_path, 'r') as f:
+                b64 = f.read()
+        if b64:
+            self._en_memoria = True
+            return pickle.loads(base64.b64decode(b64))
+        return None
+
+    def _cargar(self):
+        creds = self._leer_token()
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                from google.auth.transport.requests import Request as GoogleRequest
+                creds.refresh(GoogleRequest())
+            else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                flow = InstalledAppFlow.from_client_secrets_file(self.secrets_path, self.scopes)
+                creds = flow.run_local_server(port=8080)
+                self._en_memoria = False
+            self._guardar(creds)
+        return creds
+
+    def _guardar(self, creds):
+        if self._en_memoria:
+            # El refresh token no cambia al refrescar: no hace falta persistir
+            return
+        # Escritura atómica para que otro proceso nunca lea un pickle a medias
+        tmp = f"{self.token_path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as token:
+            pickle.dump(creds, token)
+        os.replace(tmp, self.token_path)
+
+    def _necesita_refresco(self, creds):
+        if not creds.valid:
+            return True
+        if creds.expiry is None:
+            return False
+        restante = (creds.expiry - datetime.utcnow()).total_seconds()
+        return restante <= self.margen_refresco
+
+    def _refrescar(self):
+        # Solo un hilo refresca; el resto espera y reutiliza el resultado
+        with self._lock_refresco:
+            creds = self._creds
+            if creds is None:
+                return
+            if not self._necesita_refresco(creds):
+                return
+            if not creds.refresh_token:
+                return
+            # Se refresca en el mismo objeto: los servicios del pool lo comparten
+            from google.auth.transport.requests import Request as GoogleRequest
+            creds.refresh(GoogleRequest())
+            self._guardar(creds)
+
+    def iniciar_refresco_en_segundo_plano(self):
+        """Lanza un hilo que refresca el token `margen_refresco` segundos antes de vencer."""
+        if self._hilo_refresco and self._hilo_refresco.is_alive():
+            return
+        self._detener.clear()
+        self._hilo_refresco = threading.Thread(target=self._bucle_refresco, name="refresco-token", daemon=True)
+        self._hilo_refresco.start()
+
+    def detener_refresco(self):
+        self._detener.set()
+
+    def _bucle_refresco(self):
+        while not self._detener.is_set():
+            espera = 60
+            creds = self._creds
+            try:
+                if creds is not None:
+                    if self._necesita_refresco(creds):
+                        self._refrescar()
+                    if creds.expiry is not None:
+                        restante = (creds.expiry - datetime.utcnow()).total_seconds()
+                        espera = max(5, min(espera, restante - self.margen_refresco))
+            except Exception as e:
+                print(f"Error refrescando token en segundo plano: {e}")
+                espera = 30
+            self._detener.wait(espera)
+
+    # --- Servicios ---
+
+    def _documento(self, nombre, version):
+        """Documento de discovery incluido en googleapiclient, parseado una vez
+        por proceso (build() lo vuelve a leer y parsear en cada llamada)."""
+        clave = (nombre, version)
+        documento = self._documentos.get(clave)
+        if documento is None:
+            from googleapiclient.discovery_cache import get_static_doc
+            contenido = get_static_doc(nombre, version)
+            if contenido is None:
+                raise ValueError(f"No hay documento de discovery para {nombre} {version}")
+            documento = self._documentos.setdefault(clave, json.loads(contenido))
+        return documento
+
+    def _construir(self, nombre, version):
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build_from_document
+        if self.http_factory is None:
+            import httplib2
+            self.http_factory = lambda: httplib2.Http(timeout=self.timeout_http)
+        # Cada servicio lleva su propio Http: httplib2 mantiene las conexiones
+        # abiertas entre requests, pero no es seguro compartirlo entre hilos.
+        http = AuthorizedHttp(self.credenciales(), http=self.http_factory())
+        svc = build_from_document(self._documento(nombre, version), http=http)
+        # Cada colección (svc.spreadsheets(), ...) arma los docstrings de sus
+        # métodos a partir de los schemas; el resultado queda cacheado en el
+        # Schemas del servicio. Compartirlo evita pagar eso (~200 ms por
+        # colección) en cada servicio nuevo del pool.
+        svc._schema = self._esquemas.setdefault((nombre, version), svc._schema)
+        return svc
+
+    @contextmanager
+    def servicio(self, nombre, version):
+        """Presta un servicio del pool mientras dura el bloque `with`."""
+        clave = (nombre, version)
+        with self._lock:
+            pool = self._pools.setdefault(clave, queue.LifoQueue(maxsize=self.tam_pool))
+            generacion = self._generacion
+        # Asegura credenciales vigentes antes de usar un servicio ya construido
+        self.credenciales()
+        try:
+            svc = pool.get_nowait()
+        except queue.Empty:
+            svc = self._construir(nombre, version)
+        try:
+            yield svc
+        finally:
+            if generacion == self._generacion:
+                try:
+                    pool.put_nowait(svc)
+                except queue.Full:
+                    pass
+
+    def precalentar(self, colecciones=COLECCIONES):
+        """Carga las credenciales y deja un servicio armado por API en el pool,
+        con sus colecciones ya recorridas, para que el primer request no pague
+        imports, discovery, schemas ni refresco."""
+        for (nombre, version), rutas in colecciones.items():
+            with self.servicio(nombre, version) as svc:
+                for ruta in rutas:
+                    recurso = svc
+                    for parte in ruta.split('.'):
+                        recurso = getattr(recurso, parte)()
+
+    def hay_token(self):
+        """Si hay un token guardado, o sea si cargar las credenciales no va a
+        abrir el flujo interactivo de OAuth."""
+        return bool(os.path.exists(self.token_path)
+                    or (self.token_b64_env and os.getenv(self.token_b64_env))
+                    or (self.token_b64_path and os.path.exists(self.token_b64_path)))
+
+    def precalentar_en_segundo_plano(self):
+        if not self.hay_token():
+            return
+
+        def precalentar():
+            inicio = time.perf_counter()
+            try:
+                self.precalentar()
+                print(f"Servicios de Google listos en {time.perf_counter() - inicio:.2f}s")
+            except Exception as e:
+                print(f"No se pudieron precalentar los servicios de Google: {e}")
+        threading.Thread(target=precalentar, name="precalentar-google", daemon=True).start()
+
+    def sheets(self):
+        return self.servicio('sheets', 'v4')
+
+    def drive(self):
+        return self.servicio('drive', 'v3')
+
+    def invalidar(self):
+        """Descarta credenciales y servicios; la próxima llamada vuelve a cargarlos."""
+        with self._lock:
+            self._creds = None
+            self._pools = {}
+            self._generacion += 1
+
+
+gestor_credenciales = GestorCredenciales()
@@ -0,0 +1,107 @@
+"""Formato de las hojas de pedido y su compilación a requests de batchUpdate.
+
+El formato se describe como una lista de reglas sobre rangos (tamaños de filas
+y columnas, formato de celdas). `compilar` fusiona las reglas iguales sobre
+rangos contiguos, así un pedido de 500 prendas produce la misma cantidad de
+requests que uno de 5.
+"""
+from collections import namedtuple
+
+
+ALTO_FILA_IMAGEN = 180
+ANCHO_COLUMNA_IMAGEN = 180
+GRIS_TOTALES = {"red": 0.9, "green": 0.9, "blue": 0.9}
+
+# Tamaño en píxeles de las filas/columnas [inicio, fin) de una dimensión
+Dimension = namedtuple("Dimension", "dimension inicio fin pixeles")
+# Formato (una clave de FORMATOS) de las celdas [fila_inicio, fila_fin) x [col_inicio, col_fin)
+Formato = namedtuple("Formato", "fila_inicio fila_fin col_inicio col_fin formato")
+
+FORMATOS = {
+    "centrado": {"horizontalAlignment": "CENTER"},
+    "totales": {
+        "backgroundColor": GRIS_TOTALES,
+        "textFormat": {"bold": True},
+        "horizontalAlignment": "CENTER"
+    },
+}
+
+
+def diseno_pedido(num_talles, filas_imagen, filas_datos, filas_totales):
+    """Describe el formato de una hoja de pedido. `filas_imagen`, `filas_datos`
+    y `filas_totales` son rangos de índices de fila (0 = encabezados)."""
+    reglas = [
+        # Columna A con las imágenes
+        Dimension("COLUMNS", 0, 1, ANCHO_COLUMNA_IMAGEN),
+        # Encabezados de talles centrados
+        Formato(0, 1, 1, 1 + num_talles, "centrado"),
+    ]
+    if len(filas_imagen):
+        reglas.append(Dimension("ROWS", filas_imagen.start, filas_imagen.stop, ALTO_FILA_IMAGEN))
+    if len(filas_datos):
+        # Cantidades por talle centradas
+        reglas.append(Formato(filas_datos.start, filas_datos.stop, 1, 1 + num_talles, "centrado"))
+    # Filas de totales en negrita, fondo gris y centradas
+    reglas.append(Formato(filas_totales.start, filas_totales.stop, 0, 1 + num_talles, "totales"))
+    return reglas
+
+
+def _fusionar(reglas, clave, inicio, fin):
+    """Agrupa por `clave` y une los rangos [inicio, fin) que se tocan o se pisan.
+    Los grupos salen en el orden de su primera regla."""
+    grupos = {}
+    for regla in reglas:
+        grupos.setdefault(clave(regla), []).append(regla)
+    fusionadas = []
+    for grupo in grupos.values():
+        grupo.sort(key=lambda r: getattr(r, inicio))
+        actual = grupo[0]
+        for regla in grupo[1:]:
+            if getattr(regla, inicio) <= getattr(actual, fin):
+                actual = actual._replace(**{fin: max(getattr(actual, fin), getattr(regla, fin))})
+            else:
+                fusionadas.append(actual)
+                actual = regla
+        fusionadas.append(actual)
+    return fusionadas
+
+
+def compilar(sheet_id, reglas):
+    """Convierte las reglas en la menor cantidad de requests de batchUpdate."""
+    dimensiones = _fusionar([r for r in reglas if isinstance(r, Dimension)],
+                            lambda r: (r.dimension, r.pixeles), "inicio", "fin")
+    formatos = _fusionar([r for r in reglas if isinstance(r, Formato)],
+                         lambda r: (r.col_inicio, r.col_fin, r.formato), "fila_inicio", "fila_fin")
+
+    requests = []
+    for d in dimensiones:
+        requests.append({
+            "updateDimensionProperties": {
+                "range": {
+                    "sheetId": sheet_id,
+                    "dimension": d.dimension,
+                    "startIndex": d.inicio,
+                    "endIndex": d.fin
+                },
+                "properties": {"pixelSize": d.pixeles},
+                "fields": "pixelSize"
+            }
+        })
+    # Se emiten en el orden de las reglas: si dos formatos se pisan, gana el
+    # último (por eso las filas de totales van al final de diseno_pedido)
+    for f in formatos:
+        formato = FORMATOS[f.formato]
+        requests.append({
+            "repeatCell": {
+                "range": {
+                    "sheetId": sheet_id,
+                    "startRowIndex": f.fila_inicio,
+                    "endRowIndex": f.fila_fin,
+                    "startColumnIndex": f.col_inicio,
+                    "endColumnIndex": f.col_fin
+                },
+                "cell": {"userEnteredFormat": formato},
+                "fields": ",".join(f"userEnteredFormat.{k}" for k in formato)
+            }
+        })
+    return requests
@@ -0,0 +1,102 @@
+"""Exportación local a .xlsx con el mismo diseño que la planilla de Google.
+
+Las filas se escriben en modo `constant_memory` de xlsxwriter: cada fila se
+vuelca a disco apenas se completa, así la memoria no crece con el pedido. Las
+imágenes se incrustan desde las miniaturas locales (ver imagenes.MiniaturasLocales);
+de cada una xlsxwriter guarda hasta el cierre solo la posición, no los píxeles.
+
+Con filas de alto distinto al de fábrica, xlsxwriter ubica cada imagen
+sumando el alto de todas las filas anteriores: el cierre del archivo crece
+como O(n²) (alrededor de 1s con 2000 prendas y 13s con 8000).
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import xlsxwriter
+
+from diseno_hoja import ALTO_FILA_IMAGEN, ANCHO_COLUMNA_IMAGEN, GRIS_TOTALES
+from agregados import totales_prendas
+from hojas import encabezados, filas_totales
+
+
+def nombre_hoja(titulo):
+    """Nombre de hoja válido para Excel: sin []:*?/\\, sin apóstrofos en los
+    bordes y de hasta 31 caracteres."""
+    nombre = re.sub(r"[\[\]:*?/\\]", "", titulo)[:31].strip().strip("'")
+    return nombre or "Pedido"
+
+
+def _color_hex(color):
+    return "#" + "".join(f"{round(color[c] * 255):02X}" for c in ("red", "green", "blue"))
+
+
+def _numero(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def preparar_miniaturas(prendas, miniaturas, descargar=True, hilos=8):
+    """Devuelve {url: ruta o None}, bajando en paralelo las que falten."""
+    urls = list(dict.fromkeys(p["url_imagen"] for p in prendas))
+    with ThreadPoolExecutor(max_workers=hilos) as executor:
+        rutas = executor.map(lambda url: miniaturas.obtener(url, descargar), urls)
+        return dict(zip(urls, rutas))
+
+
+def escribir_excel(prendas, destino, miniaturas, titulo="Pedido", descargar=True):
+    """Escribe el pedido en `destino` (.xlsx): columna de imágenes, una columna
+    por talle y las filas de totales en negrita con fondo gris."""
+    talles = prendas[0]['talles']
+    num_talles = len(talles)
+    rutas = preparar_miniaturas(prendas, miniaturas, descargar) if miniaturas is not None else {}
+
+    workbook = xlsxwriter.Workbook(destino, {"constant_memory": True})
+    try:
+        worksheet = workbook.add_worksheet(nombre_hoja(titulo))
+        centrado = workbook.add_format({"align": "center", "valign": "vcenter"})
+        totales = workbook.add_format({
+            "bold": True,
+            "bg_color": _color_hex(GRIS_TOTALES),
+            "align": "center",
+            "valign": "vcenter",
+        })
+        worksheet.set_column_pixels(0, 0, ANCHO_COLUMNA_IMAGEN)
+        # Alto de 180px como default de la hoja (y no fila por fila, que deja
+        # una entrada en memoria por fila); solo el encabezado vuelve al normal
+        worksheet.set_default_row(ALTO_FILA_IMAGEN * 0.75)
+        worksheet.set_row(0, 15)
+
+        # Encabezados (talles centrados)
+        for col, texto in enumerate(encabezados(talles)):
+            worksheet.write_string(0, col, texto, centrado if col else None)
+
+        fila = 0
+        for fila, prenda in enumerate(prendas, start=1):
+            ruta = rutas.get(prenda["url_imagen"])
+            if ruta:
+                worksheet.insert_image(fila, 0, ruta, {"x_offset": 5, "y_offset": 5, "object_position": 1})
+            else:
+                # Fórmula y no write_url: los hipervínculos quedan en memoria hasta el cierre
+                url = prenda["url_imagen"].replace('"', '""')
+                worksheet.write_formula(fila, 0, f'=HYPERLINK("{url}", "Ver imagen")', None, "Ver imagen")
+            for col, cantidad in enumerate(prenda['cantidades'], start=1):
+                numero = _numero(cantidad)
+                if numero is not None:
+                    worksheet.write_number(fila, col, numero, centrado)
+                elif cantidad not in (None, ""):
+                    worksheet.write_string(fila, col, str(cantidad), centrado)
+
+        # Totales por talle y total general
+        for fila_totales, valores in enumerate(filas_totales(totales_prendas(prendas)), start=fila + 1):
+            worksheet.write_string(fila_totales, 0, valores[0], totales)
+            for col in range(1, 1 + num_talles):
+                valor = valores[col] if col < len(valores) else ""
+                if valor == "":
+                    worksheet.write_blank(fila_totales, col, None, totales)
+                else:
+                    worksheet.write_number(fila_totales, col, valor, totales)
+    finally:
+        workbook.close()
+    return destino
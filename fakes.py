@@ -0,0 +1,428 @@
+"""Implementaciones falsas de los servicios externos para pruebas locales.
+
+Todas cuentan sus round trips en `llamadas` y aceptan una latencia fija y una
+probabilidad de responder con error de cuota (`prob_cuota`), para medir la app
+sin cuentas reales (ver benchmark.py).
+"""
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+
+class ErrorCuotaCloudinary(Exception):
+    """Lo que responde Cloudinary al superar el rate limit (HTTP 420)."""
+
+    http_code = 420
+
+
+def subida_falsa(latencia=0.2, cloud_name="demo", prob_cuota=0.0, semilla=None):
+    """Devuelve un reemplazo de `cloudinary.uploader.upload` que duerme
+    `latencia` segundos y responde con una URL determinística. Con
+    `prob_cuota` > 0 a veces falla como si se hubiera agotado la cuota."""
+    contador = itertools.count(1)
+    azar = random.Random(semilla)
+    lock = threading.Lock()
+
+    def upload(archivo, folder="", **opciones):
+        datos = archivo.read() if hasattr(archivo, "read") else archivo
+        upload.llamadas.append("upload")
+        time.sleep(latencia)
+        with lock:
+            falla = azar.random() < prob_cuota
+        if falla:
+            raise ErrorCuotaCloudinary("Rate Limit Exceeded")
+        public_id = f"{folder}/{hashlib.sha1(datos).hexdigest()[:16]}-{next(contador)}".lstrip("/")
+        return {
+            "public_id": public_id,
+            "bytes": len(datos),
+            "secure_url": f"https://res.cloudinary.com/{cloud_name}/image/upload/{public_id}.jpg",
+        }
+
+    upload.llamadas = []
+    return upload
+
+
+class CredencialesFalsas:
+    """Credenciales de Google siempre vigentes, sin refresh token."""
+
+    valid = True
+    expired = False
+    expiry = None
+    refresh_token = None
+
+    def before_request(self, request, method, url, headers):
+        headers["authorization"] = "Bearer falso"
+
+    def apply(self, headers, token=None):
+        headers["authorization"] = "Bearer falso"
+
+
+class HttpFalso:
+    """Reemplazo de httplib2.Http para servicios reales de googleapiclient:
+    cada request duerme `latencia` y responde 200 con `cuerpo` en JSON. Sirve
+    para medir el armado de los servicios (discovery, build) sin red."""
+
+    def __init__(self, cuerpo=None, latencia=0.0):
+        self.cuerpo = cuerpo or {}
+        self.latencia = latencia
+        self.llamadas = []
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        import httplib2
+        self.llamadas.append((method, uri))
+        if self.latencia:
+            time.sleep(self.latencia)
+        respuesta = httplib2.Response({"status": "200", "content-type": "application/json"})
+        return respuesta, json.dumps(self.cuerpo).encode()
+
+
+def _error_http(status, retry_after=None, mensaje=""):
+    import httplib2
+    from googleapiclient.errors import HttpError
+    encabezados = {"status": str(status)}
+    if retry_after is not None:
+        encabezados["retry-after"] = str(retry_after)
+    return HttpError(httplib2.Response(encabezados), mensaje.encode())
+
+
+class _ServicioFalso:
+    """Base de los servicios de Google falsos: latencia y errores de cuota por round trip."""
+
+    API = ""
+    URI_BASE = ""
+
+    def __init__(self, latencia=0.0, prob_cuota=0.0, retry_after=None, semilla=None):
+        self.latencia = latencia
+        self.prob_cuota = prob_cuota
+        self.retry_after = retry_after
+        self.llamadas = []
+        self._azar = random.Random(semilla)
+        self._lock = threading.Lock()
+
+    def _round_trip(self, operacion):
+        self.llamadas.append(operacion)
+        if self.latencia:
+            time.sleep(self.latencia)
+        if self.prob_cuota:
+            with self._lock:
+                falla = self._azar.random() < self.prob_cuota
+            if falla:
+                raise _error_http(429, self.retry_after, "Quota exceeded")
+
+    def new_batch_http_request(self, callback=None):
+        return _LoteFalso(self, callback)
+
+
+class _LoteFalso:
+    """Imita un BatchHttpRequest: todas las llamadas en un solo round trip."""
+
+    def __init__(self, servicio, callback=None):
+        self._servicio = servicio
+        self._callback = callback
+        self._requests = {}
+        self._callbacks = {}
+
+    def add(self, request, callback=None, request_id=None):
+        request_id = request_id or str(len(self._requests) + 1)
+        self._requests[request_id] = request
+        self._callbacks[request_id] = callback or self._callback
+
+    def execute(self, num_retries=0):
+        self._servicio._round_trip("batch")
+        for request_id, request in self._requests.items():
+            try:
+                respuesta, error = request._fn(), None
+            except Exception as e:
+                respuesta, error = None, e
+            if self._callbacks[request_id]:
+                self._callbacks[request_id](request_id, respuesta, error)
+
+
+class _Llamada:
+    """Imita un HttpRequest de googleapiclient: la respuesta se calcula en execute()."""
+
+    def __init__(self, servicio, operacion, fn, method="GET"):
+        self._servicio = servicio
+        self._operacion = operacion
+        self._fn = fn
+        # Para que google_api clasifique la llamada igual que una real
+        self.uri = f"{servicio.URI_BASE}/{operacion}"
+        self.methodId = f"{servicio.API}.{operacion}"
+        self.method = method
+
+    def execute(self, num_retries=0):
+        self._servicio._round_trip(self._operacion)
+        return self._fn()
+
+
+class _Recurso:
+    """Colección de la API (files(), spreadsheets(), ...). Los métodos cuyo
+    valor es otro _Recurso son subcolecciones (spreadsheets().values())."""
+
+    def __init__(self, servicio, nombre, metodos, escrituras=()):
+        # `escrituras`: nombres de métodos POST, o {nombre: método HTTP}
+        self._servicio = servicio
+        self._nombre = nombre
+        self._metodos = metodos
+        self._escrituras = escrituras
+
+    def __getattr__(self, metodo):
+        if metodo not in self._metodos:
+            raise AttributeError(metodo)
+        fn = self._metodos[metodo]
+        if isinstance(fn, _Recurso):
+            return lambda: fn
+        if isinstance(self._escrituras, dict):
+            method = self._escrituras.get(metodo, "GET")
+        else:
+            method = "POST" if metodo in self._escrituras else "GET"
+        return lambda **kwargs: _Llamada(self._servicio, f"{self._nombre}.{metodo}", lambda: fn(**kwargs), method)
+
+
+class DriveFalso(_ServicioFalso):
+    """Drive v3 en memoria: files.list con paginación y el feed de cambios
+    (changes.getStartPageToken / changes.list). Sirve en lugar del servicio
+    real, p. ej. `catalogo.obtener(lambda: nullcontext(drive_falso))`."""
+
+    MIME_SHEET = "application/vnd.google-apps.spreadsheet"
+    API = "drive"
+    URI_BASE = "https://www.googleapis.com/drive/v3"
+
+    def __init__(self, latencia=0.0, prob_cuota=0.0, retry_after=None, semilla=None):
+        super().__init__(latencia, prob_cuota, retry_after, semilla)
+        self._archivos = {}
+        self._cambios = []  # (numero, fileId)
+        self._ids = itertools.count(1)
+        self._reloj = itertools.count(1)
+
+    def _ahora(self):
+        n = next(self._reloj)
+        return f"2024-01-01T{n // 3600 % 24:02d}:{n // 60 % 60:02d}:{n % 60:02d}.000Z"
+
+    # --- Manipulación del estado (lado "servidor") ---
+
+    def _registrar_cambio(self, file_id):
+        self._cambios.append((len(self._cambios) + 1, file_id))
+
+    def crear(self, name, mime_type=MIME_SHEET, file_id=None):
+        file_id = file_id or f"file{next(self._ids)}"
+        self._archivos[file_id] = {
+            "id": file_id,
+            "name": name,
+            "mimeType": mime_type,
+            "webViewLink": f"https://docs.google.com/spreadsheets/d/{file_id}",
+            "modifiedTime": self._ahora(),
+            "trashed": False,
+            "ownedByMe": True,
+            "owners": [{"me": True}],
+        }
+        self._registrar_cambio(file_id)
+        return file_id
+
+    def modificar(self, file_id, **campos):
+        self._archivos[file_id].update(campos)
+        self._archivos[file_id]["modifiedTime"] = self._ahora()
+        self._registrar_cambio(file_id)
+
+    def borrar(self, file_id):
+        del self._archivos[file_id]
+        self._registrar_cambio(file_id)
+
+    # --- API ---
+
+    def files(self):
+        return _Recurso(self, "files", {"list": self._files_list, "get": self._files_get})
+
+    def changes(self):
+        return _Recurso(self, "changes", {"getStartPageToken": self._start_token, "list": self._changes_list})
+
+    def _files_list(self, q="", pageSize=100, pageToken=None, orderBy=None, **_):
+        archivos = [f for f in self._archivos.values()
+                    if f["mimeType"] == self.MIME_SHEET and not f["trashed"]
+                    and ("name contains 'Pedido'" not in q or "Pedido" in f["name"])]
+        if orderBy == "modifiedTime desc":
+            archivos.sort(key=lambda f: f["modifiedTime"], reverse=True)
+        inicio = int(pageToken or 0)
+        pagina = archivos[inicio:inicio + pageSize]
+        result = {"files": [dict(f) for f in pagina]}
+        if inicio + pageSize < len(archivos):
+            result["nextPageToken"] = str(inicio + pageSize)
+        return result
+
+    def _files_get(self, fileId, **_):
+        if fileId not in self._archivos:
+            raise _error_http(404, mensaje=f"File not found: {fileId}")
+        return dict(self._archivos[fileId])
+
+    def _start_token(self, **_):
+        return {"startPageToken": str(len(self._cambios) + 1)}
+
+    def _changes_list(self, pageToken, pageSize=100, **_):
+        inicio = int(pageToken)
+        pagina = [c for c in self._cambios if c[0] >= inicio][:pageSize]
+        changes = []
+        for _numero, file_id in pagina:
+            f = self._archivos.get(file_id)
+            if f is None:
+                changes.append({"fileId": file_id, "removed": True})
+            else:
+                changes.append({"fileId": file_id, "removed": False, "file": dict(f)})
+        ultimo = pagina[-1][0] if pagina else inicio - 1
+        if ultimo < len(self._cambios):
+            return {"changes": changes, "nextPageToken": str(ultimo + 1)}
+        return {"changes": changes, "newStartPageToken": str(len(self._cambios) + 1)}
+
+
+# 'Hoja 1'!A1:B2, A:B, 1:1, A1 ...
+_A1 = re.compile(r"^(?:(?:'((?:[^']|'')*)'|([^!']+))!)?([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$")
+
+
+def _columna(letras):
+    n = 0
+    for letra in letras:
+        n = n * 26 + ord(letra) - ord("A") + 1
+    return n - 1
+
+
+def _rango(a1):
+    """(fila_inicio, fila_fin, col_inicio, col_fin), 0-based y con fin exclusivo
+    (None = sin límite). Ignora el nombre de la hoja: hay una sola."""
+    m = _A1.match(a1)
+    if not m:
+        raise _error_http(400, mensaje=f"Unable to parse range: {a1}")
+    _, _, col1, fila1, col2, fila2 = m.groups()
+    if m.group(5) is None and m.group(6) is None:
+        # Una sola celda o fila/columna
+        col2, fila2 = col1, fila1
+    fila_inicio = int(fila1) - 1 if fila1 else 0
+    col_inicio = _columna(col1) if col1 else 0
+    fila_fin = int(fila2) if fila2 else None
+    col_fin = _columna(col2) + 1 if col2 else None
+    return fila_inicio, fila_fin, col_inicio, col_fin
+
+
+def _interpretar(valor):
+    """Valor ingresado con USER_ENTERED: los textos numéricos pasan a número."""
+    if isinstance(valor, str) and not valor.startswith("="):
+        for tipo in (int, float):
+            try:
+                return tipo(valor)
+            except ValueError:
+                pass
+    return valor
+
+
+def _celda(valor):
+    if valor is None or valor == "":
+        return {}
+    if isinstance(valor, str) and valor.startswith("="):
+        # Las fórmulas (=IMAGE) no tienen un valor efectivo que nos importe
+        return {"userEnteredValue": {"formulaValue": valor}}
+    clave = "numberValue" if isinstance(valor, (int, float)) and not isinstance(valor, bool) else "stringValue"
+    return {"userEnteredValue": {clave: valor}, "effectiveValue": {clave: valor}}
+
+
+class SheetsFalso(_ServicioFalso):
+    """Sheets v4 en memoria, con lo que usa la app: spreadsheets.create/get/
+    batchUpdate, values.get/update y batch HTTP. Cada planilla tiene una sola
+    hoja guardada como lista de filas. Si se pasa `drive`, las planillas
+    creadas aparecen también ahí."""
+
+    API = "sheets"
+    URI_BASE = "https://sheets.googleapis.com/v4/spreadsheets"
+
+    def __init__(self, latencia=0.0, prob_cuota=0.0, retry_after=None, semilla=None, drive=None):
+        super().__init__(latencia, prob_cuota, retry_after, semilla)
+        self.drive = drive
+        self.planillas = {}  # id -> {"title", "filas"}
+        self._ids = itertools.count(1)
+
+    def spreadsheets(self):
+        values = _Recurso(self, "spreadsheets.values",
+                          {"get": self._values_get, "update": self._values_update}, escrituras={"update": "PUT"})
+        return _Recurso(self, "spreadsheets",
+                        {"create": self._create, "get": self._get, "batchUpdate": self._batch_update,
+                         "values": values},
+                        escrituras=("create", "batchUpdate"))
+
+    def _planilla(self, spreadsheet_id):
+        if spreadsheet_id not in self.planillas:
+            raise _error_http(404, mensaje=f"Requested entity was not found: {spreadsheet_id}")
+        return self.planillas[spreadsheet_id]
+
+    def _create(self, body, **_):
+        titulo = body.get("properties", {}).get("title", "Untitled spreadsheet")
+        spreadsheet_id = f"hoja{next(self._ids)}"
+        with self._lock:
+            self.planillas[spreadsheet_id] = {"title": titulo, "filas": []}
+        if self.drive is not None:
+            self.drive.crear(titulo, file_id=spreadsheet_id)
+        return {"spreadsheetId": spreadsheet_id, "sheets": [{"properties": {"sheetId": 0, "title": "Hoja 1"}}]}
+
+    def _get(self, spreadsheetId, ranges=None, includeGridData=False, **_):
+        planilla = self._planilla(spreadsheetId)
+        hoja = {"properties": {"sheetId": 0, "title": "Hoja 1"}}
+        if includeGridData:
+            fila_inicio, fila_fin, col_inicio, col_fin = _rango(ranges[0] if ranges else "A:ZZZ")
+            hoja["data"] = [{"rowData": [
+                {"values": [_celda(v) for v in fila[col_inicio:col_fin]]}
+                for fila in planilla["filas"][fila_inicio:fila_fin]
+            ]}]
+        return {"spreadsheetId": spreadsheetId, "properties": {"title": planilla["title"]}, "sheets": [hoja]}
+
+    def _values_get(self, spreadsheetId, range, valueRenderOption="FORMATTED_VALUE", **_):
+        filas = self._planilla(spreadsheetId)["filas"]
+        fila_inicio, fila_fin, col_inicio, col_fin = _rango(range)
+        values = []
+        for fila in filas[fila_inicio:fila_fin]:
+            fila = ["" if isinstance(v, str) and v.startswith("=") else v for v in fila[col_inicio:col_fin]]
+            if valueRenderOption == "FORMATTED_VALUE":
+                fila = ["" if v is None else str(v) for v in fila]
+            while fila and fila[-1] in ("", None):
+                fila.pop()
+            values.append(fila)
+        while values and not values[-1]:
+            values.pop()
+        return {"range": range, "values": values} if values else {"range": range}
+
+    def _values_update(self, spreadsheetId, range, body, valueInputOption="RAW", **_):
+        filas = self._planilla(spreadsheetId)["filas"]
+        fila_inicio, _, col_inicio, _ = _rango(range)
+        for i, valores in enumerate(body.get("values", [])):
+            if valueInputOption == "USER_ENTERED":
+                valores = [_interpretar(v) for v in valores]
+            self._escribir(filas, fila_inicio + i, col_inicio, valores)
+        return {"spreadsheetId": spreadsheetId, "updatedRows": len(body.get("values", []))}
+
+    @staticmethod
+    def _escribir(filas, fila, col, valores):
+        while len(filas) <= fila:
+            filas.append([])
+        actual = filas[fila]
+        if len(actual) < col + len(valores):
+            actual.extend([""] * (col + len(valores) - len(actual)))
+        actual[col:col + len(valores)] = valores
+
+    def _batch_update(self, spreadsheetId, body, **_):
+        filas = self._planilla(spreadsheetId)["filas"]
+        for request in body.get("requests", []):
+            if "deleteDimension" in request:
+                r = request["deleteDimension"]["range"]
+                if r["dimension"] == "ROWS":
+                    del filas[r["startIndex"]:r["endIndex"]]
+            elif "insertDimension" in request:
+                r = request["insertDimension"]["range"]
+                if r["dimension"] == "ROWS":
+                    filas[r["startIndex"]:r["startIndex"]] = [[] for _ in range(r["endIndex"] - r["startIndex"])]
+            elif "updateCells" in request:
+                u = request["updateCells"]
+                for i, fila in enumerate(u.get("rows", [])):
+                    valores = [next(iter(c["userEnteredValue"].values())) if c.get("userEnteredValue") else ""
+                               for c in fila.get("values", [])]
+                    self._escribir(filas, u["start"]["rowIndex"] + i, u["start"].get("columnIndex", 0), valores)
+            # El formato (repeatCell, updateDimensionProperties) no se guarda
+        return {"spreadsheetId": spreadsheetId, "replies": [{} for _ in body.get("requests", [])]}
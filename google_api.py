@@ -0,0 +1,327 @@
+"""Capa única por la que pasan todas las llamadas `.execute()` a Sheets y Drive.
+
+- Limita el ritmo con un token bucket por API y tipo de operación, alineado
+  con las cuotas por usuario de Google.
+- Reintenta los errores transitorios (429, 5xx, red) con backoff exponencial
+  y jitter, respetando Retry-After cuando viene. Las escrituras no
+  idempotentes solo se reintentan ante un 429.
+- Serializa las escrituras por planilla (también entre procesos, con
+  `bloqueos.BloqueosCompartidos`) y junta en una sola escritura los
+  agregados que quedaron esperando turno sobre la misma planilla.
+"""
+import math
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from metricas import anotar, medir
+
+
+ESTADOS_RETRY = {429, 500, 502, 503, 504}
+
+
+class CuotaAgotada(Exception):
+    """Se agotaron los reintentos contra un error de cuota o de disponibilidad."""
+
+    def __init__(self, status, retry_after, causa, msg=None):
+        super().__init__(msg or f"Google respondió {status} tras varios reintentos: {causa}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class EscrituraIncierta(Exception):
+    """Una escritura no idempotente (create, batchUpdate) falló de una forma
+    en que Google pudo haberla aplicado igual (5xx, timeout): no se reintenta,
+    porque repetirla podría duplicar la planilla o las filas."""
+
+    def __init__(self, causa):
+        super().__init__(f"La escritura pudo haberse aplicado a pesar del error: {causa}")
+        self.causa = causa
+
+
+class EscrituraIncompleta(Exception):
+    """Una escritura en bloques falló después de escribir `filas_escritas`
+    prendas, que quedaron en la planilla con sus totales. Se reanuda agregando
+    el resto a `spreadsheet_id` (ver `reanudar`), salvo que la causa sea una
+    EscrituraIncierta: el bloque que falló pudo haberse escrito igual y
+    reanudar desde `filas_escritas` lo duplicaría."""
+
+    def __init__(self, spreadsheet_id, filas_escritas, causa):
+        super().__init__(f"Se escribieron {filas_escritas} prendas antes del error: {causa}")
+        self.spreadsheet_id = spreadsheet_id
+        self.filas_escritas = filas_escritas
+        self.causa = causa
+
+    @property
+    def reanudar(self):
+        """Campos a pisar en el pedido para seguir desde la primera prenda sin
+        escribir, o None si no se sabe cuál es."""
+        if isinstance(self.causa, EscrituraIncierta):
+            return None
+        return {"spreadsheetId": self.spreadsheet_id, "desde": self.filas_escritas}
+
+    def recortar(self, inicio, cantidad):
+        """La parte del error que corresponde a las prendas [inicio, inicio + cantidad)
+        de la escritura; None si esas prendas se llegaron a escribir todas."""
+        filas = min(max(self.filas_escritas - inicio, 0), cantidad)
+        return None if filas == cantidad else EscrituraIncompleta(self.spreadsheet_id, filas, self.causa)
+
+
+def es_http_error(e):
+    # Sin importar googleapiclient (pesado para el arranque): si el módulo
+    # todavía no se cargó, `e` no puede ser un HttpError
+    errores = sys.modules.get("googleapiclient.errors")
+    return errores is not None and isinstance(e, errores.HttpError)
+
+
+def es_error_transitorio(e):
+    """Errores que vale la pena reintentar: cuota, errores 5xx y de red."""
+    if isinstance(e, CuotaAgotada):
+        return True
+    if isinstance(e, EscrituraIncompleta):
+        return es_error_transitorio(e.causa)
+    if es_http_error(e):
+        return e.resp.status in ESTADOS_RETRY
+    return isinstance(e, (socket.timeout, TimeoutError, ConnectionError))
+
+
+class TokenBucket:
+    """`tasa` tokens por segundo con ráfagas de hasta `capacidad`. Las reservas
+    pueden dejar el saldo negativo: cada llamador espera su turno en orden."""
+
+    def __init__(self, tasa, capacidad):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self._tokens = capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reservar(self, costo=1, max_espera=None):
+        """Descuenta `costo` tokens y devuelve cuántos segundos hay que esperar.
+        Con `max_espera`, si la espera sería mayor no descuenta nada (el
+        llamador ve una espera mayor a `max_espera` y desiste)."""
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            if max_espera is not None and (costo - self._tokens) / self.tasa > max_espera:
+                return (costo - self._tokens) / self.tasa
+            self._tokens -= costo
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.tasa
+
+    def intentar(self, costo=1):
+        """Como `reservar`, pero sin quedar en negativo: si no alcanza no
+        descuenta nada y devuelve cuántos segundos faltan (0 si alcanzó)."""
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            if self._tokens >= costo:
+                self._tokens -= costo
+                return 0.0
+            return (costo - self._tokens) / self.tasa
+
+
+def _clasificar(request):
+    """Devuelve (api, tipo, costo) de un HttpRequest o BatchHttpRequest."""
+    costo = 1
+    subrequests = getattr(request, "_requests", None)
+    if subrequests:
+        costo = len(subrequests)
+        request = next(iter(subrequests.values()))
+    uri = getattr(request, "uri", "") or ""
+    api = "drive" if "/drive/" in uri or "drive.googleapis" in uri else "sheets"
+    tipo = "lectura" if getattr(request, "method", "GET") == "GET" else "escritura"
+    return api, tipo, costo
+
+
+def _idempotente(request):
+    """Lecturas y PUT (values.update) se pueden repetir sin efectos extra; los
+    POST (create, batchUpdate con insertDimension) no."""
+    subrequests = getattr(request, "_requests", None)
+    if subrequests:
+        return all(_idempotente(r) for r in subrequests.values())
+    return getattr(request, "method", "GET") in ("GET", "PUT")
+
+
+def _operacion(request):
+    """Nombre de la operación para las métricas, p. ej. 'spreadsheets.get'."""
+    if getattr(request, "_requests", None) is not None:
+        return "batch"
+    metodo = getattr(request, "methodId", None)
+    if metodo:
+        return metodo.split(".", 1)[-1]
+    return "desconocida"
+
+
+class PlanificadorGoogle:
+    """`max_espera` acota lo que una llamada puede dormir entre la cuota y los
+    reintentos: si haría falta esperar más, se lanza CuotaAgotada enseguida
+    (con el Retry-After estimado) en vez de bloquear el request minutos."""
+
+    def __init__(self, limites=None, max_reintentos=5, backoff_base=1.0, backoff_max=32.0, max_espera=10.0):
+        # Por defecto, las cuotas por usuario por minuto de cada API
+        limites = limites or {
+            ("sheets", "lectura"): 60,
+            ("sheets", "escritura"): 60,
+            ("drive", "lectura"): 12000,
+            ("drive", "escritura"): 12000,
+        }
+        self._buckets = {clave: TokenBucket(por_minuto / 60.0, por_minuto) for clave, por_minuto in limites.items()}
+        self.max_reintentos = max_reintentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_espera = max_espera
+        self.metricas = Counter()
+        self._lock_metricas = threading.Lock()
+
+    def _contar(self, clave, cantidad=1):
+        with self._lock_metricas:
+            self.metricas[clave] += cantidad
+
+    def ejecutar(self, request):
+        """Ejecuta el request respetando el rate limit y con reintentos."""
+        api, tipo, costo = _clasificar(request)
+        operacion = _operacion(request)
+        bucket = self._buckets.get((api, tipo))
+        idempotente = _idempotente(request)
+        esperado = 0.0
+        for intento in range(self.max_reintentos + 1):
+            if bucket is not None:
+                espera = bucket.reservar(costo, self.max_espera - esperado)
+                if espera > self.max_espera - esperado:
+                    self._contar(f"{api}_{tipo}_sin_cuota")
+                    raise CuotaAgotada(429, math.ceil(espera), None,
+                                       f"Sin cuota de {api} ({tipo}): habría que esperar {espera:.0f}s")
+                esperado += espera
+                if espera > 0:
+                    self._contar(f"{api}_{tipo}_throttles")
+                    self._contar(f"{api}_{tipo}_segundos_throttle", espera)
+                    anotar(f"{api}.espera_cuota", espera)
+                    time.sleep(espera)
+            self._contar(f"{api}_{tipo}_llamadas")
+            try:
+                with medir(api, operacion):
+                    return request.execute()
+            except Exception as e:
+                if not es_error_transitorio(e):
+                    self._contar(f"{api}_{tipo}_errores")
+                    raise
+                # Un 429 se rechazó sin aplicarse; tras un 5xx o un timeout una
+                # escritura no idempotente pudo haberse hecho igual
+                if not idempotente and not (es_http_error(e) and e.resp.status == 429):
+                    self._contar(f"{api}_{tipo}_errores")
+                    raise EscrituraIncierta(e) from e
+                retry_after = None
+                if es_http_error(e):
+                    retry_after = e.resp.get("retry-after")
+                status = e.resp.status if es_http_error(e) else 503
+                if intento == self.max_reintentos:
+                    self._contar(f"{api}_{tipo}_errores")
+                    raise CuotaAgotada(status, int(float(retry_after)) if retry_after else int(self.backoff_max), e)
+                # Backoff exponencial con "full jitter"
+                espera = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** intento))
+                if retry_after:
+                    espera = max(espera, float(retry_after))
+                if esperado + espera > self.max_espera:
+                    self._contar(f"{api}_{tipo}_errores")
+                    raise CuotaAgotada(status, math.ceil(espera), e,
+                                       f"Google respondió {status} y habría que esperar {espera:.0f}s para reintentar: {e}")
+                esperado += espera
+                self._contar(f"{api}_{tipo}_reintentos")
+                print(f"Google {api} {tipo}: error transitorio ({status}), reintento en {espera:.1f}s")
+                anotar(f"{api}.espera_reintento", espera)
+                time.sleep(espera)
+
+
+class EscritorHojas:
+    """Serializa las escrituras por planilla. Si mientras una escritura está en
+    curso llegan más agregados a la misma planilla, el siguiente en obtener el
+    turno los escribe todos juntos en una sola operación.
+
+    Con `compartidos` (un `bloqueos.BloqueosCompartidos`), además del lock
+    del proceso se toma el de la planilla en SQLite, así dos workers no
+    escriben la misma planilla a la vez; la unión de agregados sigue siendo
+    por proceso."""
+
+    def __init__(self, compartidos=None):
+        self.compartidos = compartidos
+        self._lock = threading.Lock()
+        self._bloqueos = {}
+        self._pendientes = {}
+        self.metricas = Counter()
+
+    @contextmanager
+    def bloqueo(self, spreadsheet_id):
+        with self._lock:
+            bloqueo, usos = self._bloqueos.get(spreadsheet_id, (threading.Lock(), 0))
+            self._bloqueos[spreadsheet_id] = (bloqueo, usos + 1)
+        try:
+            with bloqueo:
+                if self.compartidos is None:
+                    yield
+                else:
+                    with self.compartidos.tomar(spreadsheet_id):
+                        yield
+        finally:
+            with self._lock:
+                bloqueo, usos = self._bloqueos[spreadsheet_id]
+                if usos == 1:
+                    del self._bloqueos[spreadsheet_id]
+                else:
+                    self._bloqueos[spreadsheet_id] = (bloqueo, usos - 1)
+
+    def agregar(self, spreadsheet_id, prendas, escribir, progreso):
+        """Agrega `prendas` a la planilla llamando a `escribir(spreadsheet_id,
+        prendas, progreso)`, posiblemente junto con otros agregados en espera."""
+        pedido = {"prendas": prendas, "listo": threading.Event(), "error": None}
+        with self._lock:
+            self._pendientes.setdefault(spreadsheet_id, []).append(pedido)
+        with self.bloqueo(spreadsheet_id):
+            if not pedido["listo"].is_set():
+                with self._lock:
+                    lote = self._pendientes.pop(spreadsheet_id, [])
+                todas = [p for pendiente in lote for p in pendiente["prendas"]]
+                if len(lote) > 1:
+                    self.metricas["agregados_combinados"] += len(lote) - 1
+                self.metricas["escrituras"] += 1
+                try:
+                    escribir(spreadsheet_id, todas, progreso)
+                except EscrituraIncompleta as e:
+                    # A cada agregado le toca la parte que no llegó a escribirse
+                    inicio = 0
+                    for pendiente in lote:
+                        pendiente["error"] = e.recortar(inicio, len(pendiente["prendas"]))
+                        inicio += len(pendiente["prendas"])
+                except Exception as e:
+                    for pendiente in lote:
+                        pendiente["error"] = e
+                for pendiente in lote:
+                    pendiente["listo"].set()
+        if pedido["error"] is not None:
+            raise pedido["error"]
+        return spreadsheet_id
+
+
+planificador = PlanificadorGoogle(
+    limites={
+        ("sheets", "lectura"): int(os.getenv("SHEETS_LECTURAS_POR_MINUTO", "60")),
+        ("sheets", "escritura"): int(os.getenv("SHEETS_ESCRITURAS_POR_MINUTO", "60")),
+        ("drive", "lectura"): int(os.getenv("DRIVE_LECTURAS_POR_MINUTO", "12000")),
+        ("drive", "escritura"): int(os.getenv("DRIVE_ESCRITURAS_POR_MINUTO", "12000")),
+    },
+    max_reintentos=int(os.getenv("GOOGLE_MAX_REINTENTOS", "5")),
+    max_espera=float(os.getenv("GOOGLE_MAX_ESPERA", "10")),
+)
+escritor_hojas = EscritorHojas()
+
+
+def ejecutar(request):
+    return planificador.ejecutar(request)
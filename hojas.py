@@ -0,0 +1,363 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from agregados import agregado_vacio, combinar, entero, totales_por_talle, totales_prendas
+from diseno_hoja import compilar, diseno_pedido
+from google_api import CuotaAgotada, EscrituraIncompleta, ejecutar
+
+# Prendas por batchUpdate en los pedidos grandes: lejos del límite de tamaño
+# de request de Sheets y con avance visible cada pocos segundos
+TAM_BLOQUE = 500
+
+
+def filas_prendas(prendas):
+    """Una fila por prenda: fórmula =IMAGE() en la columna A y cantidades por talle."""
+    return [[f'=IMAGE("{prenda["url_imagen"]}")'] + prenda['cantidades'] for prenda in prendas]
+
+
+def filas_totales(agregado):
+    """Las dos filas finales de la hoja: totales por talle y total general.
+    La del total general conserva el formato de siempre (total en la columna B)."""
+    num_talles = len(agregado["talles"])
+    return [
+        ["Total por talle"] + agregado["por_talle"],
+        ["Total", agregado["total"]] + [""] * (num_talles - 1),
+    ]
+
+
+def encabezados(talles):
+    return ["Imagen"] + [f"Talle ({t})" for t in talles]
+
+
+def celda(valor):
+    """Convierte un valor al CellData de la API, con la misma interpretación
+    que valueInputOption=USER_ENTERED para los tipos que escribimos."""
+    if valor is None or valor == "":
+        return {}
+    if isinstance(valor, bool):
+        return {"userEnteredValue": {"boolValue": valor}}
+    if isinstance(valor, (int, float)):
+        return {"userEnteredValue": {"numberValue": valor}}
+    texto = str(valor)
+    if texto.startswith("="):
+        return {"userEnteredValue": {"formulaValue": texto}}
+    try:
+        return {"userEnteredValue": {"numberValue": int(texto)}}
+    except ValueError:
+        pass
+    try:
+        return {"userEnteredValue": {"numberValue": float(texto)}}
+    except ValueError:
+        return {"userEnteredValue": {"stringValue": texto}}
+
+
+def talles_de_encabezado(fila):
+    """Talles de la fila de encabezados (todo menos la columna de imágenes)."""
+    return fila[1:] if len(fila) > 1 else []
+
+
+def leer_talles(service, spreadsheet_id):
+    """Lee la fila 1 completa de la primera hoja, sin límite de columnas."""
+    result = ejecutar(service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id,
+        range="1:1"  # sin nombre de hoja: la primera hoja visible
+    ))
+    values = result.get('values', [])
+    return talles_de_encabezado(values[0]) if values else []
+
+
+def leer_talles_lote(service, spreadsheet_ids, tam_lote=20):
+    """Como `leer_talles` para muchas planillas, de a `tam_lote` lecturas por
+    batch HTTP. Devuelve ({id: talles}, {id: error}); si se agota la cuota,
+    las que no llegaron a leerse van a los errores.
+
+    values().batchGet lee varios rangos de UNA planilla; para varias planillas
+    hay que agrupar las values().get en un batch HTTP."""
+    talles = {}
+    errores = {}
+
+    def callback(request_id, response, exception):
+        if exception is None:
+            values = response.get('values', [])
+            talles[request_id] = talles_de_encabezado(values[0]) if values else []
+        else:
+            errores[request_id] = str(exception)
+
+    ids = list(dict.fromkeys(spreadsheet_ids))
+    for inicio in range(0, len(ids), tam_lote):
+        batch = service.new_batch_http_request(callback=callback)
+        for spreadsheet_id in ids[inicio:inicio + tam_lote]:
+            batch.add(service.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range="1:1"),
+                      request_id=spreadsheet_id)
+        try:
+            ejecutar(batch)
+        except CuotaAgotada as e:
+            for spreadsheet_id in ids[inicio:]:
+                errores.setdefault(spreadsheet_id, str(e))
+            break
+    return talles, errores
+
+
+def url_hoja(spreadsheet_id):
+    return f'https://docs.google.com/spreadsheets/d/{spreadsheet_id}'
+
+
+def sin_progreso(porcentaje, mensaje="", **datos):
+    pass
+
+
+def crear_hoja(service, prendas, sheet_title, progreso=sin_progreso, agregados=None, tam_bloque=TAM_BLOQUE):
+    """Crea una planilla nueva con las prendas y devuelve su id. Si se pasa
+    `agregados` (ver agregados.AgregadosHojas) guarda ahí sus totales.
+
+    Las filas se escriben con escribir_en_bloques (un solo batchUpdate si no
+    superan `tam_bloque`): si algo falla después de crear la planilla, el
+    error es EscrituraIncompleta y el reintento sigue sobre esa misma planilla
+    en vez de crear otra."""
+    spreadsheet = ejecutar(service.spreadsheets().create(
+        body={'properties': {'title': sheet_title}},
+        fields='spreadsheetId,sheets.properties(sheetId,title)'))
+    spreadsheet_id = spreadsheet.get('spreadsheetId')
+    try:
+        hoja = spreadsheet['sheets'][0]['properties']
+        progreso(30, "Planilla creada")
+        estado = {
+            "spreadsheet_id": spreadsheet_id,
+            "sheet_id": hoja['sheetId'],
+            "title": hoja['title'],
+            "existing_rows": 0,
+            "total_existente": 0,
+            "filas_totales": 0,
+        }
+        escribir_en_bloques(service, estado, prendas, agregado_vacio(prendas[0]['talles']),
+                            progreso, agregados, tam_bloque, avance=(30, 100))
+    except EscrituraIncompleta:
+        raise
+    except Exception as e:
+        raise EscrituraIncompleta(spreadsheet_id, 0, e) from e
+    return spreadsheet_id
+
+
+def estado_despues(estado, cantidad):
+    """El estado que tendrá la hoja después de agregarle `cantidad` prendas con
+    `planificar_agregado`, sin volver a leerla."""
+    filas = estado["existing_rows"] - estado["filas_totales"] if estado["existing_rows"] else 1
+    return {**estado, "existing_rows": filas + cantidad + 2, "filas_totales": 2}
+
+
+def escribir_en_bloques(service, estado, prendas, agregado_anterior, progreso=sin_progreso,
+                        agregados=None, tam_bloque=TAM_BLOQUE, avance=(40, 100)):
+    """Agrega las prendas a la hoja de a `tam_bloque`, un batchUpdate por bloque.
+    Cada batchUpdate es atómico y deja la hoja completa con sus totales, así que
+    si uno falla lo escrito hasta ahí queda bien y se lanza EscrituraIncompleta
+    con la cantidad de prendas escritas. Mientras se envía un bloque se arma el
+    siguiente. Devuelve el agregado final de la hoja."""
+    spreadsheet_id = estado["spreadsheet_id"]
+    total = len(prendas)
+    escritas = 0
+
+    def planificar(desde, estado, agregado):
+        bloque = prendas[desde:desde + tam_bloque]
+        requests, agregado = planificar_agregado(estado, bloque, agregado)
+        return len(bloque), requests, agregado
+
+    def enviar(requests):
+        ejecutar(service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={"requests": requests}
+        ))
+
+    agregado = agregado_anterior
+    # Un solo hilo de envío: los bloques se escriben en orden, uno a la vez
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="bloques") as executor:
+        siguiente = planificar(0, estado, agregado)
+        while siguiente is not None:
+            cantidad, requests, agregado_bloque = siguiente
+            envio = executor.submit(contextvars.copy_context().run, enviar, requests)
+            # El próximo bloque se arma suponiendo que este se escribe bien
+            estado = estado_despues(estado, cantidad)
+            desde = escritas + cantidad
+            siguiente = planificar(desde, estado, agregado_bloque) if desde < total else None
+            try:
+                envio.result()
+            except Exception as e:
+                raise EscrituraIncompleta(spreadsheet_id, escritas, e) from e
+            escritas, agregado = desde, agregado_bloque
+            if agregados is not None:
+                agregados.guardar(spreadsheet_id, agregado)
+            inicio, fin = avance
+            progreso(inicio + (fin - inicio) * escritas // total,
+                     f"Prendas escritas: {escritas} de {total}", filas_escritas=escritas)
+    return agregado
+
+
+def leer_estado_hoja(service, spreadsheet_id):
+    """Lee en un solo spreadsheets().get la primera hoja, cuántas filas tienen
+    datos en la columna A y cuántas de las últimas son filas de totales (una en
+    las hojas viejas, dos desde que hay totales por talle)."""
+    metadata = ejecutar(service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id,
+        ranges=["A:B"],  # sin nombre de hoja: la primera hoja visible
+        includeGridData=True,
+        fields="sheets(properties(sheetId,title),data(rowData(values(userEnteredValue,effectiveValue))))"
+    ))
+    sheets = metadata['sheets']
+    sheet = next((s for s in sheets if s.get('data')), sheets[0])
+    filas = []
+    for bloque in sheet.get('data', []):
+        filas.extend(bloque.get('rowData', []))
+
+    def valor(fila, col):
+        celdas = fila.get('values', [])
+        if col >= len(celdas):
+            return None
+        efectivo = celdas[col].get('effectiveValue', {})
+        return next(iter(efectivo.values()), None)
+
+    # Última fila con datos en la columna A. Se mira el valor ingresado porque
+    # las celdas =IMAGE() no tienen valor efectivo.
+    existing_rows = 0
+    for i, fila in enumerate(filas):
+        celdas = fila.get('values', [])
+        if celdas and celdas[0].get('userEnteredValue'):
+            existing_rows = i + 1
+
+    total_existente = 0
+    num_filas_totales = 0
+    if existing_rows > 0 and valor(filas[existing_rows - 1], 0) == "Total":
+        total_existente = entero(valor(filas[existing_rows - 1], 1))
+        num_filas_totales = 1
+        if existing_rows > 1 and valor(filas[existing_rows - 2], 0) == "Total por talle":
+            num_filas_totales = 2
+    return {
+        "spreadsheet_id": spreadsheet_id,
+        "sheet_id": sheet['properties']['sheetId'],
+        "title": sheet['properties']['title'],
+        "existing_rows": existing_rows,
+        "total_existente": total_existente,
+        "filas_totales": num_filas_totales,
+    }
+
+
+def filas_de_datos(estado):
+    """Cantidad de prendas en la hoja (sin encabezado ni filas de totales)."""
+    return max(estado["existing_rows"] - estado["filas_totales"] - 1, 0)
+
+
+def agregado_vigente(agregado, estado):
+    """Si el agregado guardado corresponde a la hoja leída. Se compara con lo
+    que ya trae la lectura del estado (cantidad de filas y total general), por
+    si la planilla se editó a mano desde la última escritura."""
+    return (agregado is not None and estado["filas_totales"] > 0
+            and agregado["prendas"] == filas_de_datos(estado)
+            and agregado["total"] == estado["total_existente"])
+
+
+def leer_agregado_hoja(service, estado, talles):
+    """Recalcula los totales leyendo las filas de prendas de la hoja. Solo
+    hace falta sin agregado guardado (hojas viejas o editadas a mano)."""
+    if filas_de_datos(estado) == 0:
+        return agregado_vacio(talles)
+    titulo = estado["title"].replace("'", "''")
+    fin = 1 + filas_de_datos(estado)
+    respuesta = ejecutar(service.spreadsheets().values().get(
+        spreadsheetId=estado["spreadsheet_id"],
+        range=f"'{titulo}'!2:{fin}",
+        valueRenderOption="UNFORMATTED_VALUE"
+    ))
+    filas = [fila[1:] for fila in respuesta.get('values', [])]
+    agregado = totales_por_talle(filas, talles)
+    # values.get omite las filas vacías del final
+    agregado["prendas"] = filas_de_datos(estado)
+    return agregado
+
+
+def planificar_agregado(estado, prendas, agregado_anterior):
+    """Arma la lista de requests de un único batchUpdate que agrega las prendas
+    a una hoja existente: borra las filas de totales viejas, inserta las filas
+    nuevas (con encabezados si la hoja está vacía) y aplica el formato.
+    Devuelve los requests y el agregado de la hoja con las prendas nuevas."""
+    sheet_id = estado["sheet_id"]
+    existing_rows = estado["existing_rows"]
+    talles = prendas[0]['talles']
+    values = filas_prendas(prendas)
+    requests = []
+
+    # Si ya había filas de totales, se eliminan antes de agregar las nuevas filas
+    if estado["filas_totales"]:
+        requests.append({
+            "deleteDimension": {
+                "range": {
+                    "sheetId": sheet_id,
+                    "dimension": "ROWS",
+                    "startIndex": existing_rows - estado["filas_totales"],
+                    "endIndex": existing_rows
+                }
+            }
+        })
+        existing_rows -= estado["filas_totales"]
+
+    # Si la hoja está vacía, agregar encabezados primero
+    values_to_insert = []
+    if existing_rows == 0:
+        values_to_insert.append(encabezados(talles))
+    values_to_insert.extend(values)
+    # Totales acumulados: los anteriores más los de las prendas nuevas
+    agregado = combinar(agregado_anterior, totales_prendas(prendas))
+    values_to_insert.extend(filas_totales(agregado))
+
+    # Insertar filas nuevas debajo de los datos (como INSERT_ROWS) y escribirlas
+    requests.append({
+        "insertDimension": {
+            "range": {
+                "sheetId": sheet_id,
+                "dimension": "ROWS",
+                "startIndex": existing_rows,
+                "endIndex": existing_rows + len(values_to_insert)
+            },
+            "inheritFromBefore": False
+        }
+    })
+    requests.append({
+        "updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": existing_rows, "columnIndex": 0},
+            "rows": [{"values": [celda(v) for v in fila]} for fila in values_to_insert],
+            "fields": "userEnteredValue"
+        }
+    })
+
+    # Ajustar alto de filas nuevas (si ya había encabezado, solo las nuevas)
+    data_start = existing_rows if existing_rows > 0 else 1
+    data_end = data_start + len(values)
+    filas_datos = range(data_start, data_end)
+    num_talles = len(agregado["talles"])
+    requests.extend(compilar(sheet_id, diseno_pedido(
+        num_talles, filas_datos, filas_datos, range(data_end, data_end + 2))))
+    return requests, agregado
+
+
+def agregar_a_hoja(service, spreadsheet_id, prendas, progreso=sin_progreso, agregados=None, tam_bloque=TAM_BLOQUE):
+    """Agrega prendas a una planilla existente en dos round trips: una lectura
+    y un batchUpdate con todas las modificaciones (uno por bloque si hay más de
+    `tam_bloque` prendas). Los totales se acumulan sobre el agregado guardado en
+    `agregados`; solo si falta o no coincide con la hoja se leen las filas de
+    prendas (un round trip más)."""
+    estado = leer_estado_hoja(service, spreadsheet_id)
+    talles = prendas[0]['talles']
+    anterior = agregados.obtener(spreadsheet_id) if agregados is not None else None
+    if estado["existing_rows"] == 0:
+        anterior = agregado_vacio(talles)
+    elif not agregado_vigente(anterior, estado):
+        anterior = leer_agregado_hoja(service, estado, talles)
+    progreso(40, "Planilla leída")
+    if len(prendas) > tam_bloque:
+        escribir_en_bloques(service, estado, prendas, anterior, progreso, agregados, tam_bloque)
+        return spreadsheet_id
+    requests, agregado = planificar_agregado(estado, prendas, anterior)
+    ejecutar(service.spreadsheets().batchUpdate(
+        spreadsheetId=spreadsheet_id,
+        body={"requests": requests}
+    ))
+    if agregados is not None:
+        agregados.guardar(spreadsheet_id, agregado)
+    return spreadsheet_id
@@ -0,0 +1,93 @@
+"""Resultados idempotentes y unión de requests iguales en curso.
+
+Cada request se identifica con una clave: la del header Idempotency-Key o, si
+no viene, un hash del payload. Mientras la primera ejecución de una clave está
+en curso, las repetidas la esperan y reciben su mismo resultado; cuando
+termina bien, el resultado queda guardado hasta que vence su TTL y los
+reintentos lo reciben sin volver a llamar a Google.
+
+Se usa desde el event loop (sin locks) y vale por proceso: con varios workers
+de uvicorn, un reintento que cae en otro worker se ejecuta de nuevo.
+"""
+import asyncio
+import hashlib
+import json
+import time
+
+
+class ClaveReutilizada(Exception):
+    """La misma Idempotency-Key llegó con otro payload."""
+
+    def __init__(self):
+        super().__init__("La Idempotency-Key ya se usó con otro contenido")
+
+
+def huella(payload):
+    """Hash del payload con las claves ordenadas: dos requests con el mismo
+    JSON dan la misma huella aunque el orden de los campos cambie."""
+    texto = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def clave_idempotencia(token, idempotency_key, huella_payload):
+    """Clave del request, separada por token para que dos clientes no
+    compartan resultados aunque elijan la misma Idempotency-Key."""
+    origen = f"key:{idempotency_key}" if idempotency_key else f"payload:{huella_payload}"
+    return hashlib.sha256(f"{token}\n{origen}".encode("utf-8")).hexdigest()
+
+
+class ResultadosIdempotentes:
+    def __init__(self, max_entradas=1000):
+        self.max_entradas = max_entradas
+        self._resultados = {}  # clave -> (huella, resultado, vence)
+        self._en_curso = {}    # clave -> (huella, tarea)
+        self.metricas = {"ejecutados": 0, "repetidos": 0, "unidos": 0}
+
+    def _limpiar(self):
+        ahora = time.monotonic()
+        for clave in [c for c, (_, _, vence) in self._resultados.items() if vence <= ahora]:
+            del self._resultados[clave]
+        # Los más viejos primero (el dict respeta el orden de inserción)
+        while len(self._resultados) > self.max_entradas:
+            del self._resultados[next(iter(self._resultados))]
+
+    def _terminar(self, clave, huella_payload, ttl, guardar_si, tarea):
+        self._en_curso.pop(clave, None)
+        if tarea.cancelled() or tarea.exception() is not None:
+            return
+        resultado = tarea.result()
+        if ttl > 0 and guardar_si(resultado):
+            self._resultados[clave] = (huella_payload, resultado, time.monotonic() + ttl)
+            self._limpiar()
+
+    async def ejecutar(self, clave, huella_payload, fn, ttl, guardar_si=lambda resultado: True):
+        """Devuelve (resultado, repetido). `fn()` es una corrutina y corre una
+        sola vez por clave; el resultado se guarda `ttl` segundos si cumple
+        `guardar_si` (los errores no se guardan, así un reintento los repite)."""
+        self._limpiar()
+        guardado = self._resultados.get(clave)
+        if guardado is not None:
+            if guardado[0] != huella_payload:
+                raise ClaveReutilizada()
+            self.metricas["repetidos"] += 1
+            return guardado[1], True
+
+        en_curso = self._en_curso.get(clave)
+        if en_curso is not None:
+            if en_curso[0] != huella_payload:
+                raise ClaveReutilizada()
+            self.metricas["unidos"] += 1
+            tarea, repetido = en_curso[1], True
+        else:
+            # La ejecución es una tarea propia: si el cliente que la inició
+            # se desconecta, sigue corriendo para los que esperan
+            tarea = asyncio.ensure_future(fn())
+            tarea.add_done_callback(
+                lambda t: self._terminar(clave, huella_payload, ttl, guardar_si, t))
+            self._en_curso[clave] = (huella_payload, tarea)
+            self.metricas["ejecutados"] += 1
+            repetido = False
+        return await asyncio.shield(tarea), repetido
+
+    def estadisticas(self):
+        return {**self.metricas, "guardados": len(self._resultados), "en_curso": len(self._en_curso)}
@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+
+from metricas import medir
+
+
+def reducir_imagen(contenido, max_lado=512, calidad=85):
+    """Achica la imagen para que su lado mayor no supere `max_lado` y la
+    recomprime. Si no es una imagen o ya es chica, devuelve los bytes originales."""
+    from PIL import Image, ImageOps
+    try:
+        img = Image.open(io.BytesIO(contenido))
+        img = ImageOps.exif_transpose(img)
+    except Exception:
+        return contenido
+    if max(img.size) <= max_lado and img.format in ("JPEG", "PNG"):
+        return contenido
+    img.thumbnail((max_lado, max_lado), Image.LANCZOS)
+    salida = io.BytesIO()
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img.save(salida, format="PNG", optimize=True)
+    else:
+        img.convert("RGB").save(salida, format="JPEG", quality=calidad, optimize=True, progressive=True)
+    reducido = salida.getvalue()
+    return reducido if len(reducido) < len(contenido) else contenido
+
+
+def miniatura(contenido, lado=170):
+    """PNG/JPEG chico para incrustar en la columna de imágenes de un Excel."""
+    from PIL import Image, ImageOps
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(contenido)))
+    img.thumbnail((lado, lado), Image.LANCZOS)
+    salida = io.BytesIO()
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img.convert("RGBA").save(salida, format="PNG", optimize=True)
+    else:
+        img.convert("RGB").save(salida, format="JPEG", quality=80, optimize=True)
+    return salida.getvalue()
+
+
+class MiniaturasLocales:
+    """Miniaturas en disco indexadas por la URL de la imagen subida, para poder
+    armar el Excel sin conexión. Si falta una, se puede descargar la original."""
+
+    def __init__(self, directorio="miniaturas", lado=170, timeout_descarga=5):
+        self.directorio = directorio
+        self.lado = lado
+        self.timeout_descarga = timeout_descarga
+        os.makedirs(directorio, exist_ok=True)
+
+    def ruta(self, url):
+        return os.path.join(self.directorio, hashlib.sha1(url.encode()).hexdigest())
+
+    def guardar(self, url, contenido):
+        try:
+            datos = miniatura(contenido, self.lado)
+        except Exception as e:
+            print(f"No se pudo generar la miniatura de {url}: {e}")
+            return None
+        ruta = self.ruta(url)
+        tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(datos)
+        os.replace(tmp, ruta)
+        return ruta
+
+    def obtener(self, url, descargar=True):
+        """Devuelve la ruta de la miniatura, o None si no hay y no se pudo bajar."""
+        ruta = self.ruta(url)
+        if os.path.exists(ruta):
+            return ruta
+        if not descargar:
+            return None
+        try:
+            import requests
+            with medir("cloudinary", "descarga"):
+                respuesta = requests.get(url, timeout=self.timeout_descarga)
+                respuesta.raise_for_status()
+        except Exception as e:
+            print(f"Sin miniatura para {url}: {e}")
+            return None
+        return self.guardar(url, respuesta.content)
+
+
+class PipelineImagenes:
+    """Etapa previa a la subida: deduplica por hash de contenido contra un
+    índice persistente hash -> secure_url y achica las imágenes nuevas."""
+
+    def __init__(self, subidor, indice_path="imagenes_cache.db", max_lado=512, calidad=85, miniaturas=None):
+        self.subidor = subidor
+        self.miniaturas = miniaturas
+        self.indice_path = indice_path
+        self.max_lado = max_lado
+        self.calidad = calidad
+        self.aciertos = 0
+        self.fallos = 0
+        self.bytes_ahorrados = 0
+        self._lock = threading.Lock()
+        self._en_vuelo = {}  # hash -> future de la subida en curso
+        self._conn = sqlite3.connect(indice_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS imagenes (hash TEXT PRIMARY KEY, secure_url TEXT NOT NULL)")
+        self._conn.commit()
+
+    def _buscar(self, clave):
+        with self._lock:
+            fila = self._conn.execute("SELECT secure_url FROM imagenes WHERE hash = ?", (clave,)).fetchone()
+        return fila[0] if fila else None
+
+    def _guardar(self, clave, url):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO imagenes (hash, secure_url) VALUES (?, ?)", (clave, url))
+            self._conn.commit()
+
+    async def subir(self, contenido, folder="pedidos", **opciones):
+        clave = hashlib.sha256(folder.encode() + b"\0" + contenido).hexdigest()
+        loop = asyncio.get_running_loop()
+        # El índice es SQLite con timeout de espera: las consultas van al
+        # executor para no frenar el event loop si otro worker tiene el lock
+        url = None if clave in self._en_vuelo else await loop.run_in_executor(None, self._buscar, clave)
+        if url:
+            self.aciertos += 1
+            self.bytes_ahorrados += len(contenido)
+            return {"secure_url": url, "cache": True}
+        # Si la misma imagen ya se está subiendo, esperar esa subida
+        if clave in self._en_vuelo:
+            self.aciertos += 1
+            self.bytes_ahorrados += len(contenido)
+            return await asyncio.shield(self._en_vuelo[clave])
+
+        self.fallos += 1
+        futuro = loop.create_future()
+        self._en_vuelo[clave] = futuro
+        try:
+            reducido = await loop.run_in_executor(None, reducir_imagen, contenido, self.max_lado, self.calidad)
+            self.bytes_ahorrados += len(contenido) - len(reducido)
+            result = await self.subidor.subir(reducido, folder=folder, **opciones)
+            await loop.run_in_executor(None, self._guardar, clave, result["secure_url"])
+            if self.miniaturas is not None:
+                await loop.run_in_executor(None, self.miniaturas.guardar, result["secure_url"], reducido)
+            futuro.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except Exception as e:
+            futuro.set_exception(e)
+            # Evita el warning de excepción nunca recuperada si nadie esperaba
+            futuro.exception()
+            raise
+        finally:
+            self._en_vuelo.pop(clave, None)
+
+    def estadisticas(self):
+        with self._lock:
+            entradas = self._conn.execute("SELECT COUNT(*) FROM imagenes").fetchone()[0]
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "bytes_ahorrados": self.bytes_ahorrados,
+            "entradas": entradas,
+        }
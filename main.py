@@ -1,25 +1,31 @@
+import asyncio
+import itertools
+import json
 import os
+import tempfile
+import time
 from fastapi import FastAPI, File, UploadFile, Form, Request, Query, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
-import cloudinary
-import cloudinary.uploader
+from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
+from typing import List, Optional
 from dotenv import load_dotenv
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request as GoogleRequest
-import pickle
-import base64
-import requests
 
+from credenciales import gestor_credenciales
+from subidas import subidor, ColaLlena, TiempoAgotado
+from imagenes import PipelineImagenes, MiniaturasLocales
+from catalogo import CatalogoHojas, CacheEncabezados
+from hojas import crear_hoja, agregar_a_hoja, url_hoja, sin_progreso, leer_talles, leer_talles_lote
+from trabajos import ColaTrabajos, ColaTrabajosLlena
+from google_api import ejecutar, planificador, escritor_hojas, CuotaAgotada, EscrituraIncompleta
+from almacen import crear_almacen, PEDIDO_GENERAL
+from agregados import AgregadosHojas, resumir_prendas
+from bloqueos import BloqueosCompartidos
+from metricas import RECHAZOS_ADMISION, exportar, iniciar_desglose, registrar_request, terminar_desglose
+from admision import ControlAdmision, Rechazado, cargar_limites
+from idempotencia import ClaveReutilizada, ResultadosIdempotentes, clave_idempotencia, huella
 
-   # Solo si el archivo binario no existe ya
-if os.path.exists("token.pickle.b64") and not os.path.exists("token.pickle"):
-    with open("token.pickle.b64", "r") as f:
-        b64data = f.read()
-    with open("token.pickle", "wb") as f:
-        f.write(base64.b64decode(b64data))
 
 ENV = os.getenv("ENVIRONMENT", "development")
 
@@ -28,20 +34,9 @@ if ENV == "production":
 else:
     allowed_origins = ["*"]  
 
-SCOPES = [
-    'https://www.googleapis.com/auth/spreadsheets',
-    'https://www.googleapis.com/auth/drive'
-]
-
-# Cargar variables de entorno
+# Cargar variables de entorno (Cloudinary se configura con ellas en la primera subida)
 load_dotenv()
 
-cloudinary.config(
-    cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
-    api_key=os.getenv('CLOUDINARY_API_KEY'),
-    api_secret=os.getenv('CLOUDINARY_API_SECRET')
-)
-
 app = FastAPI()
 
 app.add_middleware(
@@ -53,6 +48,80 @@ app.add_middleware(
 )
 
 API_TOKEN = os.getenv("API_TOKEN", "sorrento")
+# Tokens adicionales (separados por coma), cada uno con sus propios límites
+API_TOKENS = {API_TOKEN} | {t.strip() for t in os.getenv("API_TOKENS", "").split(",") if t.strip()}
+
+# Límites de concurrencia y de ritmo por ruta y por token (ver admision.py).
+# Desactivados salvo que se defina ADMISION_LIMITES
+control_admision = ControlAdmision(
+    limites=cargar_limites(os.getenv("ADMISION_LIMITES", "")),
+    retry_after=int(os.getenv("ADMISION_RETRY_AFTER", "5")),
+)
+
+# Miniaturas locales de las imágenes subidas, para exportar a Excel sin conexión
+miniaturas = MiniaturasLocales(directorio=os.getenv("MINIATURAS_DIR", "miniaturas"))
+
+# Deduplicación y reducción de imágenes antes de subirlas a Cloudinary
+pipeline_imagenes = PipelineImagenes(
+    subidor,
+    indice_path=os.getenv("IMAGENES_INDICE", "imagenes_cache.db"),
+    max_lado=int(os.getenv("IMAGENES_MAX_LADO", "512")),
+    calidad=int(os.getenv("IMAGENES_CALIDAD", "85")),
+    miniaturas=miniaturas,
+)
+
+
+# Catálogo de planillas 'Pedido' mantenido con el feed de cambios de Drive
+catalogo_hojas = CatalogoHojas(ttl=float(os.getenv("CATALOGO_TTL", "30")))
+
+# Talles de cada planilla, para no releer los encabezados en cada selección
+cache_encabezados = CacheEncabezados(ttl=float(os.getenv("ENCABEZADOS_TTL", "300")))
+
+# Trabajos de generación de planillas en segundo plano
+cola_trabajos = ColaTrabajos(
+    workers=int(os.getenv("TRABAJOS_WORKERS", "2")),
+    max_en_cola=int(os.getenv("TRABAJOS_MAX_EN_COLA", "50")),
+    reintentos=int(os.getenv("TRABAJOS_REINTENTOS", "3")),
+    path=os.getenv("TRABAJOS_DB", "trabajos.db"),
+)
+
+
+@app.on_event("startup")
+def iniciar_credenciales():
+    # Refresca el token en segundo plano antes de que venza
+    gestor_credenciales.iniciar_refresco_en_segundo_plano()
+    # Arma los servicios de Google mientras llega el primer request
+    if os.getenv("PRECALENTAR_SERVICIOS", "1") == "1":
+        gestor_credenciales.precalentar_en_segundo_plano()
+
+
+@app.on_event("shutdown")
+def detener_credenciales():
+    gestor_credenciales.detener_refresco()
+    subidor.cerrar()
+    cola_trabajos.cerrar()
+    almacen_prendas.cerrar()
+    agregados_hojas.cerrar()
+    escritor_hojas.compartidos.cerrar()
+
+
+@app.middleware("http")
+async def admitir(request: Request, call_next):
+    # Corre después de check_token: solo cuentan los requests con token válido.
+    # El lugar se libera al tener la respuesta (en streaming, los encabezados).
+    token = request.headers.get("x-api-token")
+    if request.method == "OPTIONS" or token not in API_TOKENS:
+        return await call_next(request)
+    try:
+        prefijo = control_admision.admitir(token, request.url.path)
+    except Rechazado as e:
+        RECHAZOS_ADMISION.labels(e.prefijo, e.motivo).inc()
+        return JSONResponse({"ok": False, "msg": str(e)}, status_code=e.status,
+                            headers={"Retry-After": str(e.retry_after)})
+    try:
+        return await call_next(request)
+    finally:
+        control_admision.liberar(token, prefijo)
 
 @app.middleware("http")
 async def check_token(request: Request, call_next):
@@ -61,16 +130,64 @@ async def check_token(request: Request, call_next):
         return await call_next(request)
     if request.url.path.startswith("/docs") or request.url.path.startswith("/openapi.json") or request.url.path == "/":
         return await call_next(request)
+    if request.url.path == "/metrics":
+        return await call_next(request)
     # Verifica el header personalizado
     token = request.headers.get("x-api-token")
-    if token != API_TOKEN:
+    if token not in API_TOKENS:
         raise HTTPException(status_code=401, detail="Unauthorized")
     return await call_next(request)
 
+@app.middleware("http")
+async def medir_tiempos(request: Request, call_next):
+    # Se registra después de check_token para medir también los rechazos. En
+    # las respuestas en streaming el tiempo llega hasta los encabezados.
+    inicio = time.perf_counter()
+    token, desglose = iniciar_desglose()
+    estado = 500
+    try:
+        response = await call_next(request)
+        estado = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        # Con la plantilla de la ruta (/jobs/{job_id}) y no el path, para no
+        # abrir una serie por cada id
+        ruta = getattr(route, "path", "sin_ruta")
+        if ruta != "/metrics":
+            registrar_request(request.method, ruta, estado, time.perf_counter() - inicio, desglose)
+        terminar_desglose(token)
+
+@app.get("/metrics")
+def metrics():
+    cuerpo, content_type = exportar()
+    return Response(cuerpo, media_type=content_type)
 
 
-# Estructura temporal para guardar prendas (en memoria)
-pedido_prendas = []
+
+# Prendas cargadas, por pedido (SQLite por defecto, compartido entre workers)
+almacen_prendas = crear_almacen(os.getenv("ALMACEN_URL", "sqlite:///prendas.db"))
+
+# Totales de cada planilla escrita por la API, para acumular al agregar filas
+# y responder /resumen/ sin consultar a Google
+agregados_hojas = AgregadosHojas(os.getenv("AGREGADOS_DB", "agregados.db"))
+
+# Una sola escritura a la vez por planilla, también entre workers
+escritor_hojas.compartidos = BloqueosCompartidos(os.getenv("BLOQUEOS_DB", "bloqueos.db"))
+
+def parsear_prenda(descripcion, cantidades, talles):
+    """Arma una prenda (sin imagen) a partir de los campos del formulario."""
+    return {
+        "descripcion": descripcion,
+        "cantidades": [int(x) if x else 0 for x in cantidades.split(",")],
+        "talles": [t.strip() for t in talles.split(",")],
+    }
+
+def _respuesta_error_subida(e):
+    if isinstance(e, ColaLlena):
+        return JSONResponse({"ok": False, "msg": str(e)}, status_code=503,
+                            headers={"Retry-After": str(e.retry_after)})
+    return JSONResponse({"ok": False, "msg": str(e)}, status_code=504)
 
 @app.post("/agregar_prenda/")
 async def agregar_prenda(
@@ -78,448 +195,466 @@ async def agregar_prenda(
     descripcion: str = Form(""),
     cantidades: str = Form(...),
     talles: str = Form(...),
+    pedido_id: str = Form(PEDIDO_GENERAL),
 ):
-    # Subir imagen a Cloudinary
-    result = cloudinary.uploader.upload(foto.file, folder="pedidos")
+    try:
+        datos = parsear_prenda(descripcion, cantidades, talles)
+    except ValueError:
+        return JSONResponse({"ok": False, "msg": "Cantidades inválidas"}, status_code=400)
+    # Subir imagen a Cloudinary (en el executor de subidas, sin bloquear el loop)
+    try:
+        result = await pipeline_imagenes.subir(await foto.read(), folder="pedidos")
+    except (ColaLlena, TiempoAgotado) as e:
+        return _respuesta_error_subida(e)
     url_imagen = result["secure_url"]
-    # Guardar prenda en la lista temporal
-    prenda = {
-        "url_imagen": url_imagen,
-        "descripcion": descripcion,
-        "cantidades": [int(x) if x else 0 for x in cantidades.split(",")],
-        "talles": [t.strip() for t in talles.split(",")],
-    }
-    pedido_prendas.append(prenda)
-    return JSONResponse({"ok": True, "url_imagen": url_imagen})
+    # Guardar prenda en el pedido
+    prenda = {"url_imagen": url_imagen, **datos}
+    prenda_id = await run_in_threadpool(almacen_prendas.agregar, pedido_id, prenda)
+    return JSONResponse({"ok": True, "url_imagen": url_imagen, "id": prenda_id})
+
+@app.post("/agregar_prendas/")
+async def agregar_prendas(
+    fotos: List[UploadFile] = File(...),
+    descripciones: List[str] = Form([]),
+    cantidades: List[str] = Form(...),
+    talles: List[str] = Form(...),
+    pedido_id: str = Form(PEDIDO_GENERAL),
+):
+    """Carga varias prendas en un solo request. `cantidades` va una por foto;
+    `descripciones` y `talles` pueden ir una por foto o una sola para todas."""
+    n = len(fotos)
+    if len(cantidades) != n:
+        return JSONResponse({"ok": False, "msg": "Debe haber un valor de cantidades por foto"}, status_code=400)
+    if len(talles) not in (1, n) or len(descripciones) not in (0, 1, n):
+        return JSONResponse({"ok": False, "msg": "Cantidad de talles o descripciones inválida"}, status_code=400)
+
+    # No superar la cola del subidor: el lote comparte los cupos con el resto
+    limite = asyncio.Semaphore(subidor.max_concurrencia)
+
+    async def procesar(i, foto):
+        descripcion = descripciones[i] if len(descripciones) == n else (descripciones[0] if descripciones else "")
+        try:
+            datos = parsear_prenda(descripcion, cantidades[i], talles[i] if len(talles) == n else talles[0])
+        except ValueError:
+            return {"indice": i, "ok": False, "msg": "Cantidades inválidas"}
+        try:
+            async with limite:
+                result = await pipeline_imagenes.subir(await foto.read(), folder="pedidos")
+        except (ColaLlena, TiempoAgotado) as e:
+            return {"indice": i, "ok": False, "msg": str(e)}
+        except Exception as e:
+            print(f"Error subiendo foto {i} del lote: {e}")
+            return {"indice": i, "ok": False, "msg": f"Error subiendo la imagen: {str(e)}"}
+        prenda = {"url_imagen": result["secure_url"], **datos}
+        prenda_id = await run_in_threadpool(almacen_prendas.agregar, pedido_id, prenda)
+        return {"indice": i, "ok": True, "url_imagen": prenda["url_imagen"], "id": prenda_id}
+
+    resultados = await asyncio.gather(*(procesar(i, foto) for i, foto in enumerate(fotos)))
+    agregadas = sum(1 for r in resultados if r["ok"])
+    return JSONResponse({"ok": agregadas == n, "agregadas": agregadas, "resultados": resultados})
+
+@app.get("/cache_imagenes/")
+def cache_imagenes():
+    return pipeline_imagenes.estadisticas()
+
+@app.get("/metricas_google/")
+def metricas_google():
+    return {**planificador.metricas, **escritor_hojas.metricas}
+
+@app.get("/admision/")
+def admision():
+    return control_admision.estado()
+
+@app.get("/idempotencia/")
+def idempotencia():
+    return resultados_idempotentes.estadisticas()
+
+MAX_LIMITE_PRENDAS = 1000
 
 @app.get("/listar_prendas/")
-def listar_prendas():
-    return pedido_prendas
+def listar_prendas(
+    pedido_id: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIMITE_PRENDAS),
+    cursor: Optional[int] = Query(None, ge=0),
+    formato: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """Sin `limit` ni `cursor` devuelve todas las prendas (como siempre, pero
+    enviadas a medida que se leen). Con `limit`/`cursor` devuelve una página y
+    el `next_cursor` para pedir la siguiente. `formato=ndjson` emite una prenda
+    por línea."""
+    desde_id = cursor or 0
+    if formato == "ndjson":
+        prendas = almacen_prendas.iterar_por_paginas(pedido_id, desde_id)
+        if limit is not None:
+            prendas = itertools.islice(prendas, limit)
+        return StreamingResponse((json.dumps(p) + "\n" for p in prendas), media_type="application/x-ndjson")
+
+    if limit is None and cursor is None:
+        def array_json():
+            yield "["
+            for i, prenda in enumerate(almacen_prendas.iterar_por_paginas(pedido_id)):
+                yield ("," if i else "") + json.dumps(prenda)
+            yield "]"
+        return StreamingResponse(array_json(), media_type="application/json")
+
+    limite = limit or MAX_LIMITE_PRENDAS
+    # Se pide una de más para saber si hay otra página
+    prendas = almacen_prendas.listar(pedido_id, desde_id, limite + 1)
+    next_cursor = prendas[limite - 1]["id"] if len(prendas) > limite else None
+    return {"prendas": prendas[:limite], "next_cursor": next_cursor}
+
+# Prendas por batchUpdate al escribir pedidos grandes
+BLOQUE_FILAS = int(os.getenv("BLOQUE_FILAS", "500"))
+
+def generar_hoja(data, progreso=sin_progreso):
+    """Crea la planilla o agrega las prendas a `spreadsheetId`; devuelve la URL.
+    Con `desde` se saltean las primeras prendas, para reanudar una escritura
+    que falló a mitad de camino (ver EscrituraIncompleta)."""
+    desde = int(data.get('desde') or 0)
+    prendas = data['prendas'][desde:]
+    spreadsheet_id = data.get('spreadsheetId')  # <-- Nuevo parámetro opcional
+    if desde:
+        progreso_pedido = progreso
+
+        def progreso(porcentaje, mensaje="", **datos):
+            # El avance de una escritura reanudada, contado sobre el pedido entero
+            if "filas_escritas" in datos:
+                datos["filas_escritas"] += desde
+                mensaje = f"Prendas escritas: {datos['filas_escritas']} de {desde + len(prendas)}"
+            progreso_pedido(porcentaje, mensaje, **datos)
+    try:
+        if spreadsheet_id:
+            # AGREGAR FILAS a hoja existente (una escritura a la vez por planilla;
+            # los agregados que esperan turno se escriben juntos)
+            if prendas:
+                escritor_hojas.agregar(spreadsheet_id, prendas, _agregar_filas, progreso)
+        else:
+            # CREAR NUEVA HOJA
+            sheet_title = data.get('sheetTitle', 'Pedido generado por API')
+            with gestor_credenciales.sheets() as service:
+                spreadsheet_id = crear_hoja(service, prendas, sheet_title, progreso, agregados_hojas, BLOQUE_FILAS)
+    except EscrituraIncompleta as e:
+        # Contadas desde el principio del pedido, no desde `desde`
+        raise EscrituraIncompleta(e.spreadsheet_id, desde + e.filas_escritas, e.causa) from e.causa
+    return url_hoja(spreadsheet_id)
+
+def _agregar_filas(spreadsheet_id, prendas, progreso):
+    try:
+        with gestor_credenciales.sheets() as service:
+            agregar_a_hoja(service, spreadsheet_id, prendas, progreso, agregados_hojas, BLOQUE_FILAS)
+    finally:
+        # Si la hoja estaba vacía se le escribieron encabezados (aunque la
+        # escritura en bloques haya fallado después del primero)
+        cache_encabezados.invalidar(spreadsheet_id)
+
+@app.get("/resumen/")
+def resumen(spreadsheet_id: Optional[str] = None, pedido_id: Optional[str] = None):
+    """Totales por talle y total general. Con `spreadsheet_id`, los de la
+    planilla según la última escritura hecha por la API; si no, los de las
+    prendas cargadas (de `pedido_id` o de todos los pedidos). No llama a Google."""
+    if spreadsheet_id:
+        agregado = agregados_hojas.obtener(spreadsheet_id)
+        if agregado is None:
+            return JSONResponse({"ok": False, "msg": "No hay totales registrados para esa planilla"}, status_code=404)
+        return {"ok": True, "spreadsheet_id": spreadsheet_id, **agregado}
+    agregado = resumir_prendas(almacen_prendas.iterar_por_paginas(pedido_id))
+    return {"ok": True, "pedido_id": pedido_id, **agregado}
+
+# Resultados de generar_google_sheet por Idempotency-Key (o por payload), para
+# que los doble clic y los reintentos no creen planillas ni filas repetidas
+resultados_idempotentes = ResultadosIdempotentes(max_entradas=int(os.getenv("IDEMPOTENCIA_MAX", "1000")))
+IDEMPOTENCIA_TTL = float(os.getenv("IDEMPOTENCIA_TTL", "86400"))
+# Sin Idempotency-Key, dos pedidos iguales solo se consideran el mismo si
+# llegan casi juntos: después puede ser un pedido nuevo a propósito
+IDEMPOTENCIA_TTL_PAYLOAD = float(os.getenv("IDEMPOTENCIA_TTL_PAYLOAD", "60"))
+
+def _respuesta_repetida(response):
+    headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    return Response(response.body, status_code=response.status_code, headers={**headers, "Idempotent-Replayed": "true"})
 
 @app.post("/generar_google_sheet/")
-async def generar_google_sheet(request: Request):
+async def generar_google_sheet(request: Request, asincrono: bool = Query(False)):
+    """Con el header Idempotency-Key, los reintentos con la misma clave devuelven
+    el resultado de la primera ejecución en vez de repetirla."""
     try:
         data = await request.json()
+    except ValueError:
+        return JSONResponse({"ok": False, "msg": "El cuerpo no es un JSON válido"}, status_code=400)
+    idempotency_key = request.headers.get("idempotency-key")
+    huella_payload = huella({"asincrono": asincrono, "data": data})
+    clave = clave_idempotencia(request.headers.get("x-api-token"), idempotency_key, huella_payload)
+    try:
+        response, repetida = await resultados_idempotentes.ejecutar(
+            clave, huella_payload, lambda: _generar_google_sheet(data, asincrono),
+            ttl=IDEMPOTENCIA_TTL if idempotency_key else IDEMPOTENCIA_TTL_PAYLOAD,
+            guardar_si=lambda r: r.status_code < 300)
+    except ClaveReutilizada as e:
+        return JSONResponse({"ok": False, "msg": str(e)}, status_code=422)
+    return _respuesta_repetida(response) if repetida else response
+
+async def _generar_google_sheet(data, asincrono):
+    try:
         prendas = data.get('prendas', [])
-        spreadsheet_id = data.get('spreadsheetId')  # <-- Nuevo parámetro opcional
         if not prendas:
             return JSONResponse({"ok": False, "msg": "No hay prendas cargadas"}, status_code=400)
+        desde = data.get('desde') or 0
+        if isinstance(desde, bool) or not isinstance(desde, int) or not 0 <= desde <= len(prendas):
+            return JSONResponse({"ok": False, "msg": "`desde` tiene que ser un entero entre 0 y la cantidad de prendas"},
+                                status_code=400)
 
-        creds = None
-        if os.path.exists('token.pickle'):
-            with open('token.pickle', 'rb') as token:
-                creds = pickle.load(token)
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(GoogleRequest())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    'credentials_oauth.json', SCOPES)
-                creds = flow.run_local_server(port=8080)
-            with open('token.pickle', 'wb') as token:
-                pickle.dump(creds, token)
-
-        service = build('sheets', 'v4', credentials=creds)
-
-        # Encabezados y valores
-        talles = prendas[0]['talles']
-        values = []
-        for prenda in prendas:
-            # Usar fórmula =IMAGE() para imágenes en columna separada
-            fila = [f'=IMAGE("{prenda["url_imagen"]}")'] + prenda['cantidades']
-            values.append(fila)
-
-        if spreadsheet_id:
-            # AGREGAR FILAS a hoja existente
-            # Busca el nombre de la primera hoja
-            sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-            sheet = sheet_metadata['sheets'][0]
-            sheet_name = sheet['properties']['title']
-            sheet_id = sheet['properties']['sheetId']
-            # Encuentra la última fila con datos
-            result = service.spreadsheets().values().get(
-                spreadsheetId=spreadsheet_id,
-                range=f"{sheet_name}!A:A"
-            ).execute()
-            existing_rows = len(result.get('values', []))
-            last_row = existing_rows + 1
-            
-            # Calcular totales de las nuevas prendas
-            nuevas_prendas = sum(sum(int(cant) if cant else 0 for cant in prenda['cantidades']) for prenda in prendas)
-            
-            # Obtener total existente de la hoja
-            total_existente = 0
-            tiene_fila_totales = False
-            if existing_rows > 0:
-                # Buscar la fila de totales (última fila)
-                total_result = service.spreadsheets().values().get(
-                    spreadsheetId=spreadsheet_id,
-                    range=f"{sheet_name}!A{existing_rows}:B{existing_rows}"
-                ).execute()
-                total_values = total_result.get('values', [])
-                if total_values and total_values[0] and total_values[0][0] == "Total":
-                    try:
-                        total_existente = int(total_values[0][1]) if len(total_values[0]) > 1 else 0
-                        tiene_fila_totales = True
-                    except (ValueError, TypeError):
-                        total_existente = 0
-            
-            # Calcular total acumulado
-            total_prendas = total_existente + nuevas_prendas
-            
-            # Si la hoja está vacía, agregar encabezados primero
-            headers = ["Imagen"] + [f"Talle ({t})" for t in talles]
-            values_to_insert = []
-            if existing_rows == 0:
-                values_to_insert.append(headers)
-            values_to_insert.extend(values)
-            
-            # Si ya había una fila de totales, la eliminamos antes de agregar las nuevas filas
-            if tiene_fila_totales:
-                # Eliminar la última fila (fila de totales)
-                delete_request = {
-                    "deleteDimension": {
-                        "range": {
-                            "sheetId": sheet_id,
-                            "dimension": "ROWS",
-                            "startIndex": existing_rows - 1,
-                            "endIndex": existing_rows
-                        }
-                    }
-                }
-                service.spreadsheets().batchUpdate(
-                    spreadsheetId=spreadsheet_id,
-                    body={"requests": [delete_request]}
-                ).execute()
-                # Ajustar el número de filas existentes
-                existing_rows -= 1
-            
-            # Agregar UNA SOLA fila de totales al final
-            total_row = ["Total", total_prendas] + [""] * (len(talles) - 1)
-            values_to_insert.append(total_row)
-            
-            # Agrega las filas nuevas (con o sin encabezados)
-            service.spreadsheets().values().append(
-                spreadsheetId=spreadsheet_id,
-                range=f"{sheet_name}!A1",
-                valueInputOption='USER_ENTERED',
-                insertDataOption='INSERT_ROWS',
-                body={'values': values_to_insert}
-            ).execute()
-            # Ajustar tamaño de columna A (imágenes) y filas de imágenes (180px)
-            requests = [
-                {
-                    "updateDimensionProperties": {
-                        "range": {
-                            "sheetId": sheet_id,
-                            "dimension": "COLUMNS",
-                            "startIndex": 0,
-                            "endIndex": 1
-                        },
-                        "properties": {"pixelSize": 180},
-                        "fields": "pixelSize"
-                    }
-                }
-            ]
-            # Ajustar alto de filas nuevas (todas menos encabezado si ya existía)
-            start_row = existing_rows if existing_rows > 0 else 1  # Si ya había encabezado, solo las nuevas
-            # Ajustar filas de datos (excluyendo la fila de totales)
-            for i in range(start_row, start_row + len(values)):
-                requests.append({
-                    "updateDimensionProperties": {
-                        "range": {
-                            "sheetId": sheet_id,
-                            "dimension": "ROWS",
-                            "startIndex": i,
-                            "endIndex": i+1
-                        },
-                        "properties": {"pixelSize": 180},
-                        "fields": "pixelSize"
-                    }
-                })
-            # Centrar encabezados y cantidades por talle
-            num_talles = len(talles)
-            # Centrar encabezados de talles
-            requests.append({
-                "repeatCell": {
-                    "range": {
-                        "sheetId": sheet_id,
-                        "startRowIndex": 0,
-                        "endRowIndex": 1,
-                        "startColumnIndex": 1,
-                        "endColumnIndex": 1 + num_talles
-                    },
-                    "cell": {"userEnteredFormat": {"horizontalAlignment": "CENTER"}},
-                    "fields": "userEnteredFormat.horizontalAlignment"
-                }
-            })
-            # Centrar cantidades por talle (todas las filas de datos, excluyendo totales)
-            if existing_rows == 0:
-                data_start = 1
-            else:
-                data_start = existing_rows
-            data_end = data_start + len(values)
-            requests.append({
-                "repeatCell": {
-                    "range": {
-                        "sheetId": sheet_id,
-                        "startRowIndex": data_start,
-                        "endRowIndex": data_end,
-                        "startColumnIndex": 1,
-                        "endColumnIndex": 1 + num_talles
-                    },
-                    "cell": {"userEnteredFormat": {"horizontalAlignment": "CENTER"}},
-                    "fields": "userEnteredFormat.horizontalAlignment"
-                }
-            })
-            
-            # Formatear fila de totales (negrita y fondo gris)
-            total_row_index = data_end  # La fila de totales va después de los datos
-            requests.append({
-                "repeatCell": {
-                    "range": {
-                        "sheetId": sheet_id,
-                        "startRowIndex": total_row_index,
-                        "endRowIndex": total_row_index + 1,
-                        "startColumnIndex": 0,
-                        "endColumnIndex": 1 + num_talles
-                    },
-                    "cell": {
-                        "userEnteredFormat": {
-                            "backgroundColor": {"red": 0.9, "green": 0.9, "blue": 0.9},
-                            "textFormat": {"bold": True},
-                            "horizontalAlignment": "CENTER"
-                        }
-                    },
-                    "fields": "userEnteredFormat.backgroundColor,userEnteredFormat.textFormat,userEnteredFormat.horizontalAlignment"
-                }
-            })
-            service.spreadsheets().batchUpdate(
-                spreadsheetId=spreadsheet_id,
-                body={"requests": requests}
-            ).execute()
-            
-            url = f'https://docs.google.com/spreadsheets/d/{spreadsheet_id}'
-        else:
-            # CREAR NUEVA HOJA (como antes)
-            headers = ["Imagen"] + [f"Talle ({t})" for t in talles]
-            
-            # Calcular totales
-            total_prendas = sum(sum(int(cant) if cant else 0 for cant in prenda['cantidades']) for prenda in prendas)
-            
-            # Agregar UNA SOLA fila de totales al final
-            total_row = ["Total", total_prendas] + [""] * (len(talles) - 1)
-            all_values = [headers] + values + [total_row]
-            sheet_title = data.get('sheetTitle', 'Pedido generado por API')
-            spreadsheet = {
-                'properties': {
-                    'title': sheet_title
-                }
-            }
-            spreadsheet = service.spreadsheets().create(body=spreadsheet, fields='spreadsheetId').execute()
-            spreadsheet_id = spreadsheet.get('spreadsheetId')
-            # Escribir los datos
-            service.spreadsheets().values().update(
-                spreadsheetId=spreadsheet_id,
-                range='A1',
-                valueInputOption='USER_ENTERED',
-                body={'values': all_values}
-            ).execute()
-            # Ajustar tamaño de columna A (imágenes) y filas de imágenes (180px)
-            requests = [
-                {
-                    "updateDimensionProperties": {
-                        "range": {
-                            "sheetId": 0,
-                            "dimension": "COLUMNS",
-                            "startIndex": 0,
-                            "endIndex": 1
-                        },
-                        "properties": {"pixelSize": 180},
-                        "fields": "pixelSize"
-                    }
-                }
-            ]
-            # Ajustar alto de filas con imágenes (todas menos encabezado)
-            for i in range(1, len(all_values)):
-                requests.append({
-                    "updateDimensionProperties": {
-                        "range": {
-                            "sheetId": 0,
-                            "dimension": "ROWS",
-                            "startIndex": i,
-                            "endIndex": i+1
-                        },
-                        "properties": {"pixelSize": 180},
-                        "fields": "pixelSize"
-                    }
-                })
-            # Centrar encabezados de talles
-            num_talles = len(talles)
-            requests.append({
-                "repeatCell": {
-                    "range": {
-                        "sheetId": 0,
-                        "startRowIndex": 0,
-                        "endRowIndex": 1,
-                        "startColumnIndex": 1,
-                        "endColumnIndex": 1 + num_talles
-                    },
-                    "cell": {"userEnteredFormat": {"horizontalAlignment": "CENTER"}},
-                    "fields": "userEnteredFormat.horizontalAlignment"
-                }
-            })
-            # Centrar cantidades por talle (todas las filas de datos)
-            requests.append({
-                "repeatCell": {
-                    "range": {
-                        "sheetId": 0,
-                        "startRowIndex": 1,
-                        "endRowIndex": len(all_values) - 1,  # Excluir la fila de totales
-                        "startColumnIndex": 1,
-                        "endColumnIndex": 1 + num_talles
-                    },
-                    "cell": {"userEnteredFormat": {"horizontalAlignment": "CENTER"}},
-                    "fields": "userEnteredFormat.horizontalAlignment"
-                }
-            })
-            
-            # Formatear fila de totales (negrita y fondo gris)
-            total_row_index = len(all_values) - 1
-            requests.append({
-                "repeatCell": {
-                    "range": {
-                        "sheetId": 0,
-                        "startRowIndex": total_row_index,
-                        "endRowIndex": total_row_index + 1,
-                        "startColumnIndex": 0,
-                        "endColumnIndex": 1 + num_talles
-                    },
-                    "cell": {
-                        "userEnteredFormat": {
-                            "backgroundColor": {"red": 0.9, "green": 0.9, "blue": 0.9},
-                            "textFormat": {"bold": True},
-                            "horizontalAlignment": "CENTER"
-                        }
-                    },
-                    "fields": "userEnteredFormat.backgroundColor,userEnteredFormat.textFormat,userEnteredFormat.horizontalAlignment"
-                }
-            })
-            service.spreadsheets().batchUpdate(
-                spreadsheetId=spreadsheet_id,
-                body={"requests": requests}
-            ).execute()
-            
-            url = f'https://docs.google.com/spreadsheets/d/{spreadsheet_id}'
+        if asincrono:
+            # Encolar y responder enseguida; el estado se consulta en /jobs/{id}
+            try:
+                job_id = cola_trabajos.encolar(generar_hoja, data)
+            except ColaTrabajosLlena as e:
+                return JSONResponse({"ok": False, "msg": str(e)}, status_code=503,
+                                    headers={"Retry-After": str(e.retry_after)})
+            return JSONResponse({"ok": True, "job_id": job_id, "estado_url": f"/jobs/{job_id}",
+                                 "eventos_url": f"/jobs/{job_id}/eventos"}, status_code=202)
 
+        # Las llamadas a Google son bloqueantes: correrlas fuera del event loop
+        url = await run_in_threadpool(generar_hoja, data)
         return JSONResponse({"ok": True, "url": url})
+    except EscrituraIncompleta as e:
+        # Lo escrito queda en la planilla: el cliente reenvía el pedido con
+        # `reanudar` para seguir desde la primera prenda que falta. Si no se
+        # sabe si el último bloque se escribió, no hay `reanudar`: hay que
+        # revisar la planilla antes de reenviar.
+        print(f"Escritura incompleta generando la hoja: {e}")
+        causa = e.causa
+        extra = {"reanudar": e.reanudar} if e.reanudar else {"spreadsheetId": e.spreadsheet_id}
+        if isinstance(causa, CuotaAgotada):
+            return JSONResponse({"ok": False, "msg": f"Google está limitando las solicitudes: {str(e)}", **extra},
+                                status_code=429 if causa.status == 429 else 503,
+                                headers={"Retry-After": str(causa.retry_after)})
+        return JSONResponse({"ok": False, "msg": f"Error generando la hoja: {str(e)}", **extra}, status_code=500)
+    except CuotaAgotada as e:
+        print(f"Cuota de Google agotada generando la hoja: {e}")
+        return JSONResponse({"ok": False, "msg": f"Google está limitando las solicitudes: {str(e)}"},
+                            status_code=429 if e.status == 429 else 503,
+                            headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         print(f"Error generando Google Sheet: {e}")
         return JSONResponse({"ok": False, "msg": f"Error generando la hoja: {str(e)}"}, status_code=500)
 
+@app.post("/generar_excel/")
+async def generar_excel(request: Request, descargar_imagenes: bool = Query(True)):
+    """Arma el pedido como .xlsx localmente, sin pasar por Google. Con
+    descargar_imagenes=false usa solo las miniaturas que ya están en disco."""
+    try:
+        data = await request.json()
+    except ValueError:
+        return JSONResponse({"ok": False, "msg": "El cuerpo no es un JSON válido"}, status_code=400)
+    prendas = data.get('prendas', [])
+    if not prendas:
+        return JSONResponse({"ok": False, "msg": "No hay prendas cargadas"}, status_code=400)
+    titulo = data.get('sheetTitle', 'Pedido generado por API')
+    fd, destino = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    # xlsxwriter se importa recién acá: el export es poco frecuente
+    from excel import escribir_excel
+    try:
+        await run_in_threadpool(escribir_excel, prendas, destino, miniaturas, titulo, descargar_imagenes)
+    except Exception as e:
+        os.remove(destino)
+        print(f"Error generando Excel: {e}")
+        return JSONResponse({"ok": False, "msg": f"Error generando el Excel: {str(e)}"}, status_code=500)
+    return FileResponse(
+        destino,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        filename=f"{titulo}.xlsx",
+        background=BackgroundTask(os.remove, destino),
+    )
+
+@app.get("/jobs/{job_id}")
+def estado_trabajo(job_id: str):
+    trabajo = cola_trabajos.estado(job_id)
+    if trabajo is None:
+        return JSONResponse({"ok": False, "msg": "Trabajo inexistente"}, status_code=404)
+    respuesta = {
+        "ok": trabajo["estado"] != "error",
+        "id": trabajo["id"],
+        "estado": trabajo["estado"],
+        "progreso": trabajo["progreso"],
+        "mensaje": trabajo["mensaje"],
+        "intentos": trabajo["intentos"],
+    }
+    if trabajo["resultado"]:
+        respuesta["url"] = trabajo["resultado"]
+    if trabajo["error"]:
+        respuesta["msg"] = f"Error generando la hoja: {trabajo['error']}"
+    if trabajo.get("filas_escritas") is not None:
+        respuesta["filas_escritas"] = trabajo["filas_escritas"]
+    if trabajo.get("reanudar"):
+        respuesta["reanudar"] = trabajo["reanudar"]
+    return respuesta
+
+INTERVALO_EVENTOS = float(os.getenv("INTERVALO_EVENTOS", "0.5"))
+# Duración máxima de una conexión de eventos; EventSource reconecta solo
+DURACION_EVENTOS = float(os.getenv("DURACION_EVENTOS", "300"))
+
+def _evento(nombre, datos):
+    return f"event: {nombre}\ndata: {json.dumps(datos)}\n\n"
+
+@app.get("/jobs/{job_id}/eventos")
+async def eventos_trabajo(job_id: str):
+    """El avance del trabajo como Server-Sent Events: un evento `progreso` por
+    cada cambio y uno final `completado` o `error` (con `reanudar` si quedaron
+    prendas sin escribir). La conexión se cierra a los DURACION_EVENTOS
+    segundos aunque el trabajo siga; el cliente reconecta para seguirlo."""
+    # El estado se lee de SQLite: fuera del event loop
+    loop = asyncio.get_running_loop()
+    if await loop.run_in_executor(None, cola_trabajos.estado, job_id) is None:
+        return JSONResponse({"ok": False, "msg": "Trabajo inexistente"}, status_code=404)
+
+    async def eventos():
+        anterior = None
+        ultimo_envio = time.monotonic()
+        fin = ultimo_envio + DURACION_EVENTOS
+        while time.monotonic() < fin:
+            respuesta = await loop.run_in_executor(None, estado_trabajo, job_id)
+            if not isinstance(respuesta, dict):
+                # El trabajo se borró mientras se lo seguía
+                return
+            if respuesta["estado"] in ("completado", "error"):
+                yield _evento(respuesta["estado"], respuesta)
+                return
+            if respuesta != anterior:
+                yield _evento("progreso", respuesta)
+                anterior = respuesta
+                ultimo_envio = time.monotonic()
+            elif time.monotonic() - ultimo_envio > 15:
+                # Comentario SSE para que los proxies no corten la conexión
+                yield ": sigue\n\n"
+                ultimo_envio = time.monotonic()
+            await asyncio.sleep(INTERVALO_EVENTOS)
+
+    return StreamingResponse(eventos(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Cada llamada de un batch cuenta para la cuota de lecturas de Sheets (60 por
+# minuto): de a pocas, para no agotarla con un solo request
+TAM_LOTE_SHEETS = int(os.getenv("TAM_LOTE_SHEETS", "20"))
+
+def verificar_accesibles(sheets_service, files, marcar=None):
+    """Confirma que cada planilla abre en Sheets usando requests batch con un
+    `fields` mínimo, en lugar de un spreadsheets().get completo por archivo.
+    `marcar(ids)` recibe las accesibles de cada batch apenas se confirman, así
+    un error a mitad de camino no pierde lo ya verificado."""
+    accesibles = set()
+
+    def callback(request_id, response, exception):
+        if exception is None:
+            accesibles.add(request_id)
+        else:
+            print(f"  ✗ {request_id} - NO ACCESIBLE: {str(exception)}")
+
+    for inicio in range(0, len(files), TAM_LOTE_SHEETS):
+        lote = files[inicio:inicio + TAM_LOTE_SHEETS]
+        batch = sheets_service.new_batch_http_request(callback=callback)
+        for f in lote:
+            batch.add(sheets_service.spreadsheets().get(spreadsheetId=f['id'], fields="spreadsheetId"),
+                      request_id=f['id'])
+        ejecutar(batch)
+        if marcar is not None:
+            marcar([f['id'] for f in lote if f['id'] in accesibles])
+    return [f for f in files if f['id'] in accesibles]
+
 @app.get("/listar_sheets/")
-def listar_sheets(force_refresh: bool = False):
+def listar_sheets(force_refresh: bool = False, verificar: bool = True):
+    """Planillas 'Pedido' propias. El listado de Drive ya filtra por
+    propietario; con `verificar` (por defecto) además se confirma que abren en
+    Sheets, solo las que cambiaron desde la última verificación."""
     try:
-        creds = None
-        if os.path.exists('token.pickle'):
-            with open('token.pickle', 'rb') as token:
-                creds = pickle.load(token)
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(GoogleRequest())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    'credentials_oauth.json', SCOPES)
-                creds = flow.run_local_server(port=8080)
-            with open('token.pickle', 'wb') as token:
-                pickle.dump(creds, token)
-
-        drive_service = build('drive', 'v3', credentials=creds)
-        sheets_service = build('sheets', 'v4', credentials=creds)
-        
-        # Parámetros más agresivos para evitar cache
-        # Solo buscar en el drive principal del usuario, no en drives compartidos
-        params = {
-            "q": "mimeType='application/vnd.google-apps.spreadsheet' and trashed=false and 'me' in owners",
-            "pageSize": 100,  # Aumentar para obtener más resultados
-            "fields": "files(id, name, webViewLink, modifiedTime, trashed, owners, permissions)",
-            "orderBy": "modifiedTime desc",  # Siempre ordenar por fecha de modificación
-            "corpora": "user",  # Solo archivos del usuario actual
-            "includeItemsFromAllDrives": False  # No incluir drives compartidos
-        }
-        
-        # Si se fuerza refresh, agregar parámetros adicionales
-        if force_refresh:
-            params["orderBy"] = "modifiedTime desc"
-        
-        results = drive_service.files().list(**params).execute()
-        files = results.get('files', [])
-        
-        # Filtrar por nombre que comience exactamente con el string y NO esté en papelera
-        filtered = [f for f in files if f['name'].startswith('Pedido') and not f.get('trashed', False)]
-        
-        print(f"Archivos encontrados inicialmente: {len(files)}")
-        print(f"Después de filtrar por 'Pedido': {len(filtered)}")
-        
-        # Verificar que las hojas realmente existen y son accesibles
-        accessible_files = []
+        creds = gestor_credenciales.credenciales()
+        # Se responde desde memoria; Drive solo se consulta al vencer el TTL
+        # (trayendo los cambios) o con force_refresh (listado completo)
+        filtered = catalogo_hojas.obtener(gestor_credenciales.drive, force_refresh=force_refresh)
+
+        # Verificar que el usuario actual es el propietario
+        propios = []
         for f in filtered:
-            try:
-                # Verificar que el usuario actual es el propietario
-                owners = f.get('owners', [])
-                is_owner = any(owner.get('emailAddress') == creds.service_account_email if hasattr(creds, 'service_account_email') else True for owner in owners)
-                
-                if not is_owner:
-                    print(f"  ⚠ {f['name']} (ID: {f['id']}) - NO ES PROPIETARIO")
-                    continue
-                
-                # Intentar acceder a la hoja para verificar que existe
-                sheets_service.spreadsheets().get(spreadsheetId=f['id']).execute()
-                accessible_files.append(f)
-                print(f"  ✓ {f['name']} (ID: {f['id']}) - ACCESIBLE Y PROPIETARIO")
-            except Exception as e:
-                print(f"  ✗ {f['name']} (ID: {f['id']}) - NO ACCESIBLE: {str(e)}")
-        
+            owners = f.get('owners', [])
+            is_owner = any(owner.get('emailAddress') == creds.service_account_email if hasattr(creds, 'service_account_email') else True for owner in owners)
+            if not is_owner:
+                print(f"  ⚠ {f['name']} (ID: {f['id']}) - NO ES PROPIETARIO")
+                continue
+            propios.append(f)
+
+        # Verificar que las hojas realmente existen y son accesibles
+        # (solo las que no se verificaron desde su último cambio)
+        pendientes = catalogo_hojas.sin_verificar(propios) if verificar else []
+        if pendientes:
+            with gestor_credenciales.sheets() as sheets_service:
+                accesibles = verificar_accesibles(sheets_service, pendientes, catalogo_hojas.marcar_verificadas)
+            inaccesibles = {f['id'] for f in pendientes} - {f['id'] for f in accesibles}
+            accessible_files = [f for f in propios if f['id'] not in inaccesibles]
+        else:
+            accessible_files = propios
+
         # Ordenar por fecha de modificación (más reciente primero)
         accessible_files.sort(key=lambda x: x.get('modifiedTime', ''), reverse=True)
-        
+
         print(f"Encontradas {len(accessible_files)} hojas de pedidos accesibles y propias (de {len(filtered)} total)")
-        
+
         return accessible_files
+    except CuotaAgotada as e:
+        # Las planillas ya verificadas quedan marcadas: el reintento sigue con el resto
+        print(f"Cuota de Google agotada verificando planillas: {e}")
+        return JSONResponse({"ok": False, "msg": f"Google está limitando las solicitudes: {str(e)}"},
+                            status_code=429 if e.status == 429 else 503,
+                            headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         print(f"Error en listar_sheets: {e}")
-        return [] 
+        return []
+
+def obtener_talles(spreadsheet_ids, errores_por_id=True):
+    """Talles de cada planilla, desde el caché si sigue vigente. Las que falten
+    se leen en batch y las que no se pudieron leer van en los errores; con
+    `errores_por_id=False` (una sola planilla) se leen con una llamada simple
+    y el error se propaga."""
+    version = cache_encabezados.version
+    modificados = catalogo_hojas.modificados(gestor_credenciales.drive, spreadsheet_ids)
+    talles = {}
+    faltan = []
+    for spreadsheet_id in spreadsheet_ids:
+        en_cache = cache_encabezados.obtener(spreadsheet_id, modificados[spreadsheet_id])
+        if en_cache is None:
+            faltan.append(spreadsheet_id)
+        else:
+            talles[spreadsheet_id] = en_cache
+    errores = {}
+    if faltan:
+        with gestor_credenciales.sheets() as service:
+            if len(faltan) == 1 and not errores_por_id:
+                leidos = {faltan[0]: leer_talles(service, faltan[0])}
+            else:
+                leidos, errores = leer_talles_lote(service, faltan, TAM_LOTE_SHEETS)
+        for spreadsheet_id, talles_leidos in leidos.items():
+            cache_encabezados.guardar(spreadsheet_id, talles_leidos, modificados[spreadsheet_id], version)
+        talles.update(leidos)
+    return talles, errores
 
 @app.get("/leer_encabezados_sheet/")
 def leer_encabezados_sheet(spreadsheet_id: str = Query(...)):
-    creds = None
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(GoogleRequest())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials_oauth.json', SCOPES)
-            creds = flow.run_local_server(port=8080)
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-    service = build('sheets', 'v4', credentials=creds)
-    sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-    sheet_name = sheet_metadata['sheets'][0]['properties']['title']
-    result = service.spreadsheets().values().get(
-        spreadsheetId=spreadsheet_id,
-        range=f"{sheet_name}!A1:Z1"
-    ).execute()
-    values = result.get('values', [])
-    talles = values[0][1:] if values and len(values[0]) > 1 else []
-    return {"talles": talles}
+    talles, _ = obtener_talles([spreadsheet_id], errores_por_id=False)
+    return {"talles": talles[spreadsheet_id]}
+
+@app.get("/leer_encabezados_sheets/")
+def leer_encabezados_sheets(spreadsheet_id: List[str] = Query(...)):
+    """Talles de varias planillas (`?spreadsheet_id=a&spreadsheet_id=b`), para
+    precargar el selector. Las que no se pudieron leer van en `errores`."""
+    ids = list(dict.fromkeys(spreadsheet_id))
+    talles, errores = obtener_talles(ids)
+    return {"talles": talles, "errores": errores}
 
 @app.post("/limpiar_cache/")
 def limpiar_cache():
     """Elimina el token y fuerza una nueva autenticación"""
     try:
+        gestor_credenciales.invalidar()
+        catalogo_hojas.invalidar()
+        cache_encabezados.invalidar()
         if os.path.exists('token.pickle'):
             os.remove('token.pickle')
             print("Token eliminado. Se requerirá nueva autenticación.")
@@ -0,0 +1,100 @@
+"""Métricas en formato Prometheus y desglose de tiempos por request.
+
+Cada llamada a Sheets, Drive o Cloudinary pasa por `medir(servicio, operacion)`,
+que registra su latencia y sus errores por clase. Además, lo que se mide
+durante un request se acumula en su desglose (una contextvar), y el middleware
+de main.py lo escribe en el log como una línea JSON al terminar.
+
+Con varios workers de uvicorn, definir PROMETHEUS_MULTIPROC_DIR para que
+/metrics sume los de todos los procesos.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+
+DURACION_REQUESTS = Histogram(
+    "http_request_duration_seconds", "Latencia de los requests por ruta",
+    ["metodo", "ruta", "estado"])
+DURACION_LLAMADAS = Histogram(
+    "llamadas_externas_duration_seconds", "Latencia de las llamadas a Sheets, Drive y Cloudinary",
+    ["servicio", "operacion"])
+ERRORES_LLAMADAS = Counter(
+    "llamadas_externas_errores_total", "Llamadas a Sheets, Drive y Cloudinary que fallaron",
+    ["servicio", "operacion", "error"])
+RECHAZOS_ADMISION = Counter(
+    "admision_rechazos_total", "Requests rechazados por los límites de admisión",
+    ["ruta", "motivo"])
+
+LOG_TIEMPOS = os.getenv("LOG_TIEMPOS", "1") == "1"
+
+_desglose = contextvars.ContextVar("desglose", default=None)
+_lock_desglose = threading.Lock()
+
+
+def iniciar_desglose():
+    """Empieza el desglose del request actual; devuelve (token, desglose)."""
+    desglose = {}
+    return _desglose.set(desglose), desglose
+
+
+def terminar_desglose(token):
+    _desglose.reset(token)
+
+
+def anotar(clave, segundos):
+    """Suma `segundos` a `clave` en el desglose del request en curso, si hay."""
+    desglose = _desglose.get()
+    if desglose is None:
+        return
+    with _lock_desglose:
+        entrada = desglose.setdefault(clave, {"llamadas": 0, "segundos": 0.0})
+        entrada["llamadas"] += 1
+        entrada["segundos"] += segundos
+
+
+def clase_error(e):
+    status = getattr(getattr(e, "resp", None), "status", None)
+    return f"http_{status}" if status else type(e).__name__
+
+
+@contextmanager
+def medir(servicio, operacion):
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        ERRORES_LLAMADAS.labels(servicio, operacion, clase_error(e)).inc()
+        raise
+    finally:
+        duracion = time.perf_counter() - inicio
+        DURACION_LLAMADAS.labels(servicio, operacion).observe(duracion)
+        anotar(f"{servicio}.{operacion}", duracion)
+
+
+def registrar_request(metodo, ruta, estado, duracion, desglose):
+    DURACION_REQUESTS.labels(metodo, ruta, str(estado)).observe(duracion)
+    if LOG_TIEMPOS:
+        print(json.dumps({
+            "metodo": metodo,
+            "ruta": ruta,
+            "estado": estado,
+            "ms": round(duracion * 1000, 1),
+            "desglose": {clave: {"llamadas": e["llamadas"], "ms": round(e["segundos"] * 1000, 1)}
+                         for clave, e in desglose.items()},
+        }))
+
+
+def exportar():
+    """Devuelve (cuerpo, content type) para /metrics."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import CollectorRegistry, multiprocess
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+        return generate_latest(registro), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,105 @@
+import asyncio
+import contextvars
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metricas import medir
+
+
+class ColaLlena(Exception):
+    """Hay más subidas pendientes de las que admite la cola."""
+
+    def __init__(self, retry_after):
+        super().__init__("Demasiadas subidas en curso, reintentar más tarde")
+        self.retry_after = retry_after
+
+
+class TiempoAgotado(Exception):
+    """La subida no terminó dentro del timeout configurado."""
+
+
+_cloudinary_configurado = False
+
+
+def _upload_cloudinary(archivo, **opciones):
+    # cloudinary se importa y configura recién en la primera subida
+    global _cloudinary_configurado
+    import cloudinary
+    import cloudinary.uploader
+    if not _cloudinary_configurado:
+        cloudinary.config(
+            cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
+            api_key=os.getenv('CLOUDINARY_API_KEY'),
+            api_secret=os.getenv('CLOUDINARY_API_SECRET')
+        )
+        _cloudinary_configurado = True
+    return cloudinary.uploader.upload(archivo, **opciones)
+
+
+class SubidorImagenes:
+    """Sube imágenes en un executor propio para no bloquear el event loop.
+
+    `max_concurrencia` subidas corren a la vez y hasta `max_en_cola` esperan
+    turno; por encima de eso se rechaza al instante con `ColaLlena`.
+    `upload_fn` se puede reemplazar por un uploader falso (ver fakes.py).
+    """
+
+    def __init__(self, upload_fn=None, max_concurrencia=4, max_en_cola=16, timeout=30, retry_after=5):
+        self.upload_fn = upload_fn or _upload_cloudinary
+        self.max_concurrencia = max_concurrencia
+        self.max_en_cola = max_en_cola
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrencia, thread_name_prefix="subida")
+        self._lock = threading.Lock()
+        self._pendientes = 0  # en ejecución + en cola dentro del executor
+
+    @property
+    def pendientes(self):
+        return self._pendientes
+
+    def _liberar(self, _futuro):
+        with self._lock:
+            self._pendientes -= 1
+
+    def _subir(self, archivo, opciones):
+        with medir("cloudinary", "upload"):
+            return self.upload_fn(archivo, **opciones)
+
+    def _reservar(self):
+        with self._lock:
+            if self._pendientes >= self.max_concurrencia + self.max_en_cola:
+                raise ColaLlena(self.retry_after)
+            self._pendientes += 1
+
+    async def subir(self, contenido, **opciones):
+        """Sube `contenido` (bytes) y devuelve el resultado del uploader."""
+        self._reservar()
+        try:
+            # Se sube desde una copia en memoria: el UploadFile original se
+            # cierra al terminar el request aunque la subida siga en curso.
+            # El contexto se copia para que la subida cuente en el desglose del request
+            contexto = contextvars.copy_context()
+            futuro = self._executor.submit(contexto.run, self._subir, io.BytesIO(contenido), opciones)
+        except BaseException:
+            self._liberar(None)
+            raise
+        # El cupo se libera cuando el hilo termina de verdad, no al vencer el timeout
+        futuro.add_done_callback(self._liberar)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(futuro), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise TiempoAgotado(f"La subida superó los {self.timeout}s")
+
+    def cerrar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+subidor = SubidorImagenes(
+    max_concurrencia=int(os.getenv("SUBIDAS_MAX_CONCURRENCIA", "4")),
+    max_en_cola=int(os.getenv("SUBIDAS_MAX_EN_COLA", "16")),
+    timeout=float(os.getenv("SUBIDAS_TIMEOUT", "30")),
+    retry_after=int(os.getenv("SUBIDAS_RETRY_AFTER", "5")),
+)
@@ -0,0 +1,31 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# Los módulos de la app están en la raíz del repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def _directorio_app(tmp_path_factory):
+    import benchmark
+    directorio = tmp_path_factory.mktemp("app")
+    # Bases y miniaturas en un directorio temporal, antes de importar main
+    benchmark._preparar_entorno(str(directorio))
+    return directorio
+
+
+@pytest.fixture
+def entorno(_directorio_app):
+    """La app (módulo main) conectada a Sheets, Drive y Cloudinary falsos nuevos."""
+    import benchmark
+    return benchmark.Entorno(SimpleNamespace(latencia_google=0, latencia_cloudinary=0,
+                                             prob_cuota=0, cuotas_reales=False))
+
+
+@pytest.fixture
+def cliente(entorno):
+    from fastapi.testclient import TestClient
+    return TestClient(entorno.main.app, headers={"x-api-token": entorno.main.API_TOKEN})
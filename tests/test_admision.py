@@ -0,0 +1,90 @@
+import pytest
+
+from admision import LIMITES_SUGERIDOS, ControlAdmision, Rechazado, cargar_limites
+
+
+def _rechazo(control, token, path):
+    with pytest.raises(Rechazado) as error:
+        control.admitir(token, path)
+    return error.value
+
+
+def test_cargar_limites():
+    assert cargar_limites("") == {}
+    assert cargar_limites(" sugeridos ") is LIMITES_SUGERIDOS
+    assert cargar_limites('{"/a/": {"concurrencia": 1}}') == {"/a/": {"concurrencia": 1}}
+    with pytest.raises(ValueError):
+        cargar_limites("[1]")
+
+
+def test_sin_regla_no_limita():
+    control = ControlAdmision({"/generar_excel/": {"concurrencia": 1}})
+    assert control.admitir("t", "/listar_sheets/") is None
+    control.liberar("t", None)
+
+
+def test_el_prefijo_mas_largo_gana():
+    control = ControlAdmision({"/agregar_prenda": {"concurrencia": 5}, "/agregar_prendas/": {"concurrencia": 1}})
+    assert control.admitir("t", "/agregar_prendas/") == "/agregar_prendas/"
+    assert control.admitir("t", "/agregar_prenda/") == "/agregar_prenda"
+
+
+def test_ruta_saturada_es_503_y_token_excedido_es_429():
+    control = ControlAdmision({"/x/": {"concurrencia": 2, "concurrencia_por_token": 1}}, retry_after=7)
+    prefijo = control.admitir("a", "/x/")
+    # El mismo token ya tiene su lugar: 429
+    rechazo = _rechazo(control, "a", "/x/")
+    assert (rechazo.status, rechazo.motivo, rechazo.retry_after) == (429, "concurrencia_por_token", 7)
+    # Otro token entra hasta llenar la ruta; después, 503 para cualquiera
+    control.admitir("b", "/x/")
+    rechazo = _rechazo(control, "c", "/x/")
+    assert (rechazo.status, rechazo.motivo, rechazo.retry_after) == (503, "concurrencia", 7)
+    control.liberar("a", prefijo)
+    assert control.admitir("c", "/x/") == "/x/"
+    assert control.estado() == {"en_curso": {"/x/": 2},
+                                "rechazos": {"concurrencia_por_token": 1, "concurrencia": 1}}
+
+
+def test_ritmo_por_token_con_retry_after():
+    # 60 por minuto con ráfaga de 2: el tercero espera un segundo
+    control = ControlAdmision({"/x/": {"por_minuto_por_token": 60, "rafaga_por_token": 2}})
+    for _ in range(2):
+        control.liberar("a", control.admitir("a", "/x/"))
+    rechazo = _rechazo(control, "a", "/x/")
+    assert (rechazo.status, rechazo.motivo, rechazo.retry_after) == (429, "por_minuto_por_token", 1)
+    # Cada token tiene su propio ritmo
+    assert control.admitir("b", "/x/") == "/x/"
+
+
+def test_un_rechazo_por_concurrencia_no_gasta_ritmo():
+    control = ControlAdmision({"/x/": {"concurrencia": 1, "por_minuto_por_token": 60, "rafaga_por_token": 2}})
+    prefijo = control.admitir("a", "/x/")
+    for _ in range(5):
+        assert _rechazo(control, "a", "/x/").motivo == "concurrencia"
+    control.liberar("a", prefijo)
+    # Queda el segundo lugar de la ráfaga
+    control.liberar("a", control.admitir("a", "/x/"))
+    assert _rechazo(control, "a", "/x/").motivo == "por_minuto_por_token"
+
+
+def test_el_middleware_libera_el_lugar_si_el_handler_falla(entorno, cliente, monkeypatch):
+    control = ControlAdmision({"/resumen/": {"concurrencia": 1}})
+    monkeypatch.setattr(entorno.main, "control_admision", control)
+
+    def falla(*args, **kwargs):
+        raise RuntimeError("falla")
+
+    monkeypatch.setattr(entorno.main.almacen_prendas, "iterar_por_paginas", falla)
+    with pytest.raises(RuntimeError):
+        cliente.get("/resumen/")
+    assert control.estado()["en_curso"] == {"/resumen/": 0}
+
+
+def test_el_middleware_responde_con_retry_after(entorno, cliente, monkeypatch):
+    control = ControlAdmision({"/resumen/": {"concurrencia_por_token": 1}}, retry_after=9)
+    monkeypatch.setattr(entorno.main, "control_admision", control)
+    control.admitir(entorno.main.API_TOKEN, "/resumen/")
+    respuesta = cliente.get("/resumen/")
+    assert respuesta.status_code == 429
+    assert respuesta.headers["Retry-After"] == "9"
+    assert respuesta.json()["ok"] is False
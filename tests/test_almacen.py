@@ -0,0 +1,120 @@
+import json
+
+import pytest
+
+from almacen import AlmacenMemoria, AlmacenPrendas, crear_almacen
+
+
+def _prenda(i):
+    return {"url_imagen": f"https://x/{i}.jpg", "descripcion": f"Prenda {i}",
+            "cantidades": [i, 1], "talles": ["S", "M"]}
+
+
+@pytest.fixture(params=["memoria://", "sqlite:///"])
+def almacen(request, tmp_path):
+    url = request.param
+    if url == "sqlite:///":
+        url += str(tmp_path / "prendas.db")
+    almacen = crear_almacen(url)
+    yield almacen
+    almacen.cerrar()
+
+
+def _cargar(almacen, n):
+    # Intercaladas entre dos pedidos
+    return [almacen.agregar("a" if i % 2 else "b", _prenda(i)) for i in range(n)]
+
+
+def test_la_interfaz_es_abstracta():
+    with pytest.raises(TypeError):
+        AlmacenPrendas()
+
+
+def test_url_no_soportada():
+    with pytest.raises(ValueError):
+        crear_almacen("postgres://x")
+
+
+def test_agregar_y_listar(almacen):
+    ids = _cargar(almacen, 4)
+    assert ids == sorted(ids) and len(set(ids)) == 4
+    prendas = almacen.listar()
+    assert [p["id"] for p in prendas] == ids
+    assert prendas[1] == {"id": ids[1], "pedido_id": "a", **_prenda(1)}
+
+
+def test_listar_por_pedido_desde_id_y_limite(almacen):
+    ids = _cargar(almacen, 7)
+    assert [p["id"] for p in almacen.listar("a")] == ids[1::2]
+    assert [p["id"] for p in almacen.listar("b", desde_id=ids[2])] == ids[4::2]
+    assert [p["id"] for p in almacen.listar("b", limite=2)] == ids[0:4:2]
+    assert [p["id"] for p in almacen.listar(desde_id=ids[1], limite=3)] == ids[2:5]
+    assert almacen.listar("otro") == []
+
+
+def test_iterar_por_paginas_recorre_todo(almacen):
+    ids = _cargar(almacen, 10)
+    assert [p["id"] for p in almacen.iterar_por_paginas(tam_pagina=3)] == ids
+    assert [p["id"] for p in almacen.iterar_por_paginas("a", tam_pagina=5)] == ids[1::2]
+    assert [p["id"] for p in almacen.iterar_por_paginas(desde_id=ids[7], tam_pagina=2)] == ids[8:]
+
+
+def test_sqlite_comparte_las_prendas_entre_instancias(tmp_path):
+    url = "sqlite:///" + str(tmp_path / "prendas.db")
+    uno, otro = crear_almacen(url), crear_almacen(url)
+    uno.agregar("a", _prenda(1))
+    assert [p["url_imagen"] for p in otro.listar()] == ["https://x/1.jpg"]
+    uno.cerrar()
+    otro.cerrar()
+
+
+@pytest.fixture
+def prendas_cargadas(entorno, monkeypatch):
+    almacen = AlmacenMemoria()
+    monkeypatch.setattr(entorno.main, "almacen_prendas", almacen)
+    return _cargar(almacen, 5)
+
+
+def test_listar_prendas_paginado_con_next_cursor(cliente, prendas_cargadas):
+    vistas, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor is not None else {})}
+        pagina = cliente.get("/listar_prendas/", params=params).json()
+        vistas += [p["id"] for p in pagina["prendas"]]
+        cursor = pagina["next_cursor"]
+        if cursor is None:
+            break
+        assert cursor == vistas[-1]
+    assert vistas == prendas_cargadas
+
+
+def test_listar_prendas_ultima_pagina_exacta(cliente, prendas_cargadas):
+    # Si la página llena justo hasta el final no hay next_cursor
+    pagina = cliente.get("/listar_prendas/", params={"limit": 5}).json()
+    assert len(pagina["prendas"]) == 5 and pagina["next_cursor"] is None
+    pagina = cliente.get("/listar_prendas/", params={"cursor": prendas_cargadas[-1]}).json()
+    assert pagina == {"prendas": [], "next_cursor": None}
+
+
+def test_listar_prendas_por_pedido(cliente, prendas_cargadas):
+    pagina = cliente.get("/listar_prendas/", params={"pedido_id": "a", "limit": 1}).json()
+    assert [p["id"] for p in pagina["prendas"]] == prendas_cargadas[1:2]
+    siguiente = cliente.get("/listar_prendas/", params={"pedido_id": "a", "cursor": pagina["next_cursor"]}).json()
+    assert [p["id"] for p in siguiente["prendas"]] == prendas_cargadas[3:4]
+    assert siguiente["next_cursor"] is None
+
+
+def test_listar_prendas_sin_paginar_devuelve_todas(cliente, prendas_cargadas):
+    respuesta = cliente.get("/listar_prendas/")
+    assert [p["id"] for p in respuesta.json()] == prendas_cargadas
+
+
+def test_listar_prendas_ndjson(cliente, prendas_cargadas):
+    respuesta = cliente.get("/listar_prendas/", params={"formato": "ndjson", "cursor": prendas_cargadas[0], "limit": 3})
+    assert respuesta.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(linea)["id"] for linea in respuesta.text.splitlines()] == prendas_cargadas[1:4]
+
+
+@pytest.mark.parametrize("params", [{"limit": 0}, {"limit": 1001}, {"cursor": -1}, {"formato": "csv"}])
+def test_listar_prendas_parametros_invalidos(cliente, params):
+    assert cliente.get("/listar_prendas/", params=params).status_code == 422
@@ -0,0 +1,85 @@
+from contextlib import nullcontext
+
+from catalogo import CatalogoHojas
+from fakes import DriveFalso
+
+
+def _nombres(catalogo, drive):
+    return sorted(f["name"] for f in catalogo.obtener(lambda: nullcontext(drive)))
+
+
+def _catalogo_armado(*nombres):
+    drive = DriveFalso()
+    ids = [drive.crear(nombre) for nombre in nombres]
+    catalogo = CatalogoHojas(ttl=0)
+    _nombres(catalogo, drive)
+    drive.llamadas.clear()
+    return catalogo, drive, ids
+
+
+def test_arma_el_catalogo_con_un_listado_completo():
+    drive = DriveFalso()
+    drive.crear("Pedido 1")
+    drive.crear("Otra cosa")
+    drive.crear("Mi Pedido")
+    catalogo = CatalogoHojas(ttl=60)
+    assert _nombres(catalogo, drive) == ["Pedido 1"]
+    assert drive.llamadas == ["changes.getStartPageToken", "files.list"]
+    # Dentro del TTL no se consulta a Drive
+    assert _nombres(catalogo, drive) == ["Pedido 1"]
+    assert len(drive.llamadas) == 2
+
+
+def test_agrega_las_planillas_nuevas_desde_el_feed_de_cambios():
+    catalogo, drive, _ = _catalogo_armado("Pedido 1")
+    drive.crear("Pedido 2")
+    drive.crear("Presupuesto")
+    assert _nombres(catalogo, drive) == ["Pedido 1", "Pedido 2"]
+    assert drive.llamadas == ["changes.list"]
+
+
+def test_quita_las_planillas_borradas_y_en_papelera():
+    catalogo, drive, (borrada, en_papelera, _) = _catalogo_armado("Pedido 1", "Pedido 2", "Pedido 3")
+    drive.borrar(borrada)
+    drive.modificar(en_papelera, trashed=True)
+    assert _nombres(catalogo, drive) == ["Pedido 3"]
+    assert drive.llamadas == ["changes.list"]
+
+
+def test_sigue_los_renombres():
+    catalogo, drive, (file_id,) = _catalogo_armado("Pedido 1")
+    drive.modificar(file_id, name="Pedido 1 (final)")
+    assert _nombres(catalogo, drive) == ["Pedido 1 (final)"]
+    drive.modificar(file_id, name="Archivado 1")
+    assert _nombres(catalogo, drive) == []
+    drive.modificar(file_id, name="Pedido 1")
+    assert _nombres(catalogo, drive) == ["Pedido 1"]
+    assert drive.llamadas == ["changes.list"] * 3
+
+
+def test_un_cambio_vuelve_a_pedir_la_verificacion():
+    catalogo, drive, (modificada, intacta) = _catalogo_armado("Pedido 1", "Pedido 2")
+    catalogo.marcar_verificadas([modificada, intacta])
+    drive.modificar(modificada, name="Pedido 1 bis")
+    archivos = catalogo.obtener(lambda: nullcontext(drive))
+    assert [f["id"] for f in catalogo.sin_verificar(archivos)] == [modificada]
+
+
+def test_recorre_todas_las_paginas_de_cambios():
+    catalogo, drive, _ = _catalogo_armado()
+    for i in range(1500):
+        drive.crear(f"Pedido {i}")
+    assert len(_nombres(catalogo, drive)) == 1500
+    assert drive.llamadas == ["changes.list"] * 2
+    # El token quedó al día: sin cambios nuevos no aparece nada
+    drive.llamadas.clear()
+    assert len(_nombres(catalogo, drive)) == 1500
+    assert drive.llamadas == ["changes.list"]
+
+
+def test_modificados_no_arma_el_catalogo():
+    drive = DriveFalso()
+    file_id = drive.crear("Pedido 1")
+    catalogo = CatalogoHojas(ttl=0)
+    assert catalogo.modificados(lambda: nullcontext(drive), [file_id]) == {file_id: None}
+    assert drive.llamadas == []
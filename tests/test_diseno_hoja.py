@@ -0,0 +1,56 @@
+from diseno_hoja import ALTO_FILA_IMAGEN, Dimension, Formato, compilar, diseno_pedido
+
+
+def _rangos(requests, tipo):
+    rangos = []
+    for request in requests:
+        if tipo in request:
+            r = request[tipo]["range"]
+            rangos.append((r.get("startIndex", r.get("startRowIndex")), r.get("endIndex", r.get("endRowIndex"))))
+    return rangos
+
+
+def test_fusiona_rangos_contiguos_y_superpuestos():
+    reglas = [Dimension("ROWS", 1, 2, 180), Dimension("ROWS", 2, 3, 180), Dimension("ROWS", 3, 6, 180),
+              Dimension("ROWS", 4, 5, 180), Dimension("ROWS", 8, 9, 180)]
+    requests = compilar(7, reglas)
+    assert _rangos(requests, "updateDimensionProperties") == [(1, 6), (8, 9)]
+    assert {r["updateDimensionProperties"]["range"]["sheetId"] for r in requests} == {7}
+
+
+def test_fusiona_sin_importar_el_orden_de_las_reglas():
+    reglas = [Formato(5, 8, 1, 4, "centrado"), Formato(0, 2, 1, 4, "centrado"), Formato(2, 5, 1, 4, "centrado")]
+    assert _rangos(compilar(0, reglas), "repeatCell") == [(0, 8)]
+
+
+def test_no_fusiona_reglas_distintas():
+    reglas = [
+        Dimension("ROWS", 0, 1, 180), Dimension("ROWS", 1, 2, 21), Dimension("COLUMNS", 2, 3, 180),
+        Formato(0, 1, 1, 4, "centrado"), Formato(1, 2, 1, 5, "centrado"), Formato(2, 3, 1, 4, "totales"),
+    ]
+    assert len(compilar(0, reglas)) == len(reglas)
+
+
+def test_los_totales_van_despues_del_resto_del_formato():
+    requests = compilar(0, diseno_pedido(3, range(1, 11), range(1, 11), range(11, 13)))
+    formatos = [r["repeatCell"]["cell"]["userEnteredFormat"] for r in requests if "repeatCell" in r]
+    assert formatos[-1]["textFormat"] == {"bold": True}
+    # Encabezados y cantidades comparten columnas: un solo request centrado
+    assert _rangos(requests, "repeatCell") == [(0, 11), (11, 13)]
+
+
+def test_la_cantidad_de_requests_no_depende_del_tamano_del_pedido():
+    chico = compilar(0, diseno_pedido(3, range(1, 6), range(1, 6), range(6, 8)))
+    grande = compilar(0, diseno_pedido(3, range(1, 501), range(1, 501), range(501, 503)))
+    assert len(chico) == len(grande) == 4
+    filas = [r for r in grande if "updateDimensionProperties" in r
+             and r["updateDimensionProperties"]["range"]["dimension"] == "ROWS"]
+    assert filas[0]["updateDimensionProperties"]["range"]["endIndex"] == 501
+    assert filas[0]["updateDimensionProperties"]["properties"] == {"pixelSize": ALTO_FILA_IMAGEN}
+
+
+def test_campos_del_formato():
+    (request,) = compilar(0, [Formato(0, 1, 0, 2, "totales")])
+    assert request["repeatCell"]["fields"] == (
+        "userEnteredFormat.backgroundColor,userEnteredFormat.textFormat,"
+        "userEnteredFormat.horizontalAlignment")
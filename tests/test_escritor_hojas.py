@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+from bloqueos import BloqueosCompartidos
+from google_api import EscritorHojas, EscrituraIncompleta
+
+
+def _esperar(condicion, limite=2):
+    fin = time.monotonic() + limite
+    while not condicion():
+        assert time.monotonic() < fin
+        time.sleep(0.01)
+
+
+class _Escritura:
+    """`escribir` para EscritorHojas: la primera llamada espera a `liberar`,
+    así los agregados que llegan mientras tanto quedan en espera."""
+
+    def __init__(self, error=None):
+        self.liberar = threading.Event()
+        self.llamadas = []
+        self.error = error
+
+    def __call__(self, spreadsheet_id, prendas, progreso):
+        self.llamadas.append(list(prendas))
+        if len(self.llamadas) == 1:
+            self.liberar.wait(5)
+        elif self.error is not None:
+            raise self.error
+
+
+def _agregar_en_espera(escritor, escribir, lotes):
+    """Lanza un agregado por lote: el primero toma la planilla y los demás
+    esperan turno, en orden. Devuelve {índice: resultado o excepción}."""
+    resultados = {}
+
+    def agregar(i, prendas):
+        try:
+            resultados[i] = escritor.agregar("hoja", prendas, escribir, None)
+        except Exception as e:
+            resultados[i] = e
+
+    hilos = []
+    for i, prendas in enumerate(lotes):
+        hilos.append(threading.Thread(target=agregar, args=(i, prendas)))
+        hilos[-1].start()
+        if i == 0:
+            _esperar(lambda: escribir.llamadas)
+        else:
+            _esperar(lambda: len(escritor._pendientes.get("hoja", [])) == i)
+    escribir.liberar.set()
+    for hilo in hilos:
+        hilo.join(5)
+    return resultados
+
+
+def test_junta_los_agregados_en_espera_en_una_escritura():
+    escritor = EscritorHojas()
+    escribir = _Escritura()
+    resultados = _agregar_en_espera(escritor, escribir, [["a"], ["b", "c"], ["d"], ["e"]])
+    assert escribir.llamadas == [["a"], ["b", "c", "d", "e"]]
+    assert resultados == {i: "hoja" for i in range(4)}
+    assert escritor.metricas == {"escrituras": 2, "agregados_combinados": 2}
+    assert escritor._pendientes == {} and escritor._bloqueos == {}
+
+
+def test_reparte_una_escritura_incompleta_entre_los_agregados():
+    causa = ConnectionError("red caída")
+    escritor = EscritorHojas()
+    escribir = _Escritura(EscrituraIncompleta("hoja", 3, causa))
+    resultados = _agregar_en_espera(escritor, escribir, [["a"], ["b", "c"], ["d", "e"], ["f", "g"]])
+    # Se escribieron b, c y d: el segundo terminó, el tercero a medias y el cuarto nada
+    assert resultados[1] == "hoja"
+    assert isinstance(resultados[2], EscrituraIncompleta) and resultados[2].filas_escritas == 1
+    assert resultados[2].reanudar == {"spreadsheetId": "hoja", "desde": 1}
+    assert isinstance(resultados[3], EscrituraIncompleta) and resultados[3].filas_escritas == 0
+    assert resultados[3].causa is causa
+
+
+def test_otros_errores_llegan_a_todos_los_agregados_juntados():
+    error = RuntimeError("falla")
+    escribir = _Escritura(error)
+    resultados = _agregar_en_espera(EscritorHojas(), escribir, [["a"], ["b"], ["c"]])
+    assert resultados[0] == "hoja"
+    assert resultados[1] is error and resultados[2] is error
+
+
+@pytest.mark.parametrize("inicio, cantidad, esperado", [(0, 3, None), (2, 1, None), (2, 2, 1), (3, 1, 0), (4, 3, 0)])
+def test_recortar(inicio, cantidad, esperado):
+    # Se escribieron las prendas [0, 3) de la escritura
+    parte = EscrituraIncompleta("hoja", 3, None).recortar(inicio, cantidad)
+    assert (parte if parte is None else parte.filas_escritas) == esperado
+
+
+def test_bloqueo_compartido_entre_escritores(tmp_path):
+    # Dos escritores con la misma base, como dos workers de uvicorn
+    path = str(tmp_path / "bloqueos.db")
+    escritores = [EscritorHojas(BloqueosCompartidos(path, intervalo=0.01)) for _ in range(2)]
+    dentro = []
+    maximo = []
+
+    def escribir(spreadsheet_id, prendas, progreso):
+        dentro.append(1)
+        maximo.append(len(dentro))
+        time.sleep(0.02)
+        dentro.pop()
+
+    hilos = [threading.Thread(target=escritores[i % 2].agregar, args=("hoja", [i], escribir, None))
+             for i in range(6)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join(5)
+    assert max(maximo) == 1
+    for escritor in escritores:
+        escritor.compartidos.cerrar()
@@ -0,0 +1,57 @@
+import re
+import zipfile
+
+import pytest
+from PIL import Image
+
+from diseno_hoja import ALTO_FILA_IMAGEN
+from excel import escribir_excel, nombre_hoja
+
+
+@pytest.mark.parametrize("titulo, esperado", [
+    ("Pedido 12/05", "Pedido 1205"),
+    ("Pedido [A]", "Pedido A"),
+    ("Pedido: X*?", "Pedido X"),
+    ("'Pedido'", "Pedido"),
+    ("[]:*?/\\", "Pedido"),
+    ("x" * 40, "x" * 31),
+])
+def test_nombre_hoja(titulo, esperado):
+    assert nombre_hoja(titulo) == esperado
+
+
+def test_escribir_excel_con_titulo_invalido(tmp_path):
+    prendas = [{"url_imagen": "https://x/1.jpg", "cantidades": [1, 2], "talles": ["S", "M"]}]
+    destino = tmp_path / "pedido.xlsx"
+    escribir_excel(prendas, str(destino), None, titulo="Pedido 12/05 [A]: X")
+    with zipfile.ZipFile(destino) as xlsx:
+        assert 'name="Pedido 1205 A X"' in xlsx.read("xl/workbook.xml").decode()
+
+
+class _Miniaturas:
+    def __init__(self, ruta):
+        self.ruta = ruta
+
+    def obtener(self, url, descargar=True):
+        return self.ruta
+
+
+def test_cada_imagen_queda_en_su_fila(tmp_path):
+    imagen = tmp_path / "imagen.png"
+    Image.new("RGB", (150, 150), "red").save(imagen)
+    prendas = [{"url_imagen": f"https://x/{i}.jpg", "cantidades": [i, 1], "talles": ["S", "M"]} for i in range(30)]
+    destino = tmp_path / "pedido.xlsx"
+    escribir_excel(prendas, str(destino), _Miniaturas(str(imagen)))
+    with zipfile.ZipFile(destino) as xlsx:
+        dibujo = xlsx.read("xl/drawings/drawing1.xml").decode()
+        hoja = xlsx.read("xl/worksheets/sheet1.xml").decode()
+    filas = re.findall(r"<xdr:from><xdr:col>0</xdr:col><xdr:colOff>\d+</xdr:colOff><xdr:row>(\d+)</xdr:row>", dibujo)
+    assert filas == [str(fila) for fila in range(1, 31)]
+    altos = re.findall(r'<row r="\d+" ht="([\d.]+)"', hoja)
+    assert altos[0] == "15" and set(altos[1:31]) == {f"{ALTO_FILA_IMAGEN * 0.75:g}"}
+
+
+def test_generar_excel_con_json_invalido(cliente):
+    respuesta = cliente.post("/generar_excel/", content=b"{no es json", headers={"content-type": "application/json"})
+    assert respuesta.status_code == 400
+    assert respuesta.json() == {"ok": False, "msg": "El cuerpo no es un JSON válido"}
@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+from fakes import _error_http
+from google_api import EscrituraIncierta, EscrituraIncompleta
+
+
+def _prendas(n):
+    return [{"url_imagen": f"https://x/{i}.jpg", "cantidades": [1, 2], "talles": ["S", "M"]} for i in range(n)]
+
+
+def _fallar_en(sheets, llamada, aplicar):
+    """Hace que el batchUpdate número `llamada` responda 500, aplicándolo
+    antes o no según `aplicar`."""
+    original = sheets._batch_update
+    llamadas = []
+
+    def batch_update(spreadsheetId, body, **kwargs):
+        llamadas.append(1)
+        if len(llamadas) != llamada:
+            return original(spreadsheetId, body, **kwargs)
+        if aplicar:
+            original(spreadsheetId, body, **kwargs)
+        raise _error_http(500, mensaje="Internal error")
+
+    sheets._batch_update = batch_update
+
+
+def _filas_de_datos(sheets, spreadsheet_id):
+    return [f for f in sheets.planillas[spreadsheet_id]["filas"][1:] if str(f[0]).startswith("=IMAGE")]
+
+
+def _esperar_trabajo(cliente, job_id, limite=5):
+    fin = time.monotonic() + limite
+    while True:
+        estado = cliente.get(f"/jobs/{job_id}").json()
+        if estado["estado"] in ("completado", "error"):
+            return estado
+        assert time.monotonic() < fin
+        time.sleep(0.02)
+
+
+def test_sin_reanudar_si_el_bloque_pudo_haberse_escrito(entorno, cliente, monkeypatch):
+    monkeypatch.setattr(entorno.main, "BLOQUE_FILAS", 3)
+    _fallar_en(entorno.sheets, 2, aplicar=True)
+    respuesta = cliente.post("/generar_google_sheet/", json={"prendas": _prendas(7)})
+    cuerpo = respuesta.json()
+    assert respuesta.status_code == 500
+    assert "reanudar" not in cuerpo
+    # El segundo bloque sí quedó: reanudar desde 3 lo habría duplicado
+    assert len(_filas_de_datos(entorno.sheets, cuerpo["spreadsheetId"])) == 6
+
+
+def test_reanudar_despues_de_un_error_de_cuota(entorno, cliente, monkeypatch):
+    monkeypatch.setattr(entorno.main, "BLOQUE_FILAS", 3)
+    monkeypatch.setattr(entorno.main.planificador, "max_reintentos", 0)
+    original = entorno.sheets._batch_update
+    llamadas = []
+
+    def batch_update(spreadsheetId, body, **kwargs):
+        llamadas.append(1)
+        if len(llamadas) == 2:
+            raise _error_http(429, retry_after=1, mensaje="Quota exceeded")
+        return original(spreadsheetId, body, **kwargs)
+
+    entorno.sheets._batch_update = batch_update
+    prendas = _prendas(7)
+    respuesta = cliente.post("/generar_google_sheet/", json={"prendas": prendas})
+    assert respuesta.status_code == 429
+    reanudar = respuesta.json()["reanudar"]
+    assert reanudar["desde"] == 3
+    respuesta = cliente.post("/generar_google_sheet/", json={"prendas": prendas, **reanudar})
+    assert respuesta.status_code == 200
+    filas = entorno.sheets.planillas[reanudar["spreadsheetId"]]["filas"]
+    assert len(_filas_de_datos(entorno.sheets, reanudar["spreadsheetId"])) == 7
+    assert filas[-1][:2] == ["Total", 21]
+
+
+def test_trabajo_sin_reanudar_si_el_bloque_pudo_haberse_escrito(entorno, cliente, monkeypatch):
+    monkeypatch.setattr(entorno.main, "BLOQUE_FILAS", 3)
+    _fallar_en(entorno.sheets, 2, aplicar=True)
+    respuesta = cliente.post("/generar_google_sheet/?asincrono=true", json={"prendas": _prendas(7)})
+    assert respuesta.status_code == 202
+    estado = _esperar_trabajo(cliente, respuesta.json()["job_id"])
+    assert estado["estado"] == "error"
+    assert estado["intentos"] == 1
+    assert "reanudar" not in estado
+
+
+def test_crear_hoja_con_error_ambiguo_no_reanuda_desde_cero(entorno):
+    from hojas import crear_hoja
+    _fallar_en(entorno.sheets, 1, aplicar=True)
+    with pytest.raises(EscrituraIncompleta) as error:
+        crear_hoja(entorno.sheets, _prendas(2), "Pedido")
+    assert isinstance(error.value.causa, EscrituraIncierta)
+    assert error.value.reanudar is None
+
+
+@pytest.mark.parametrize("desde", [-2, 8, "3", 1.5, True])
+def test_desde_invalido(cliente, desde):
+    respuesta = cliente.post("/generar_google_sheet/", json={"prendas": _prendas(7), "desde": desde})
+    assert respuesta.status_code == 400
+    assert respuesta.json()["ok"] is False
@@ -0,0 +1,75 @@
+from agregados import AgregadosHojas
+from fakes import SheetsFalso
+from hojas import agregar_a_hoja, estado_despues, leer_estado_hoja, planificar_agregado
+
+TALLES = ["S", "M", "L"]
+
+
+def _prenda(i, cantidades=(1, 2, 3)):
+    return {"url_imagen": f"https://x/{i}.jpg", "cantidades": list(cantidades), "talles": TALLES}
+
+
+def _hoja_vieja(sheets):
+    """Una planilla de antes de los totales por talle: encabezados, dos
+    prendas y una sola fila "Total"."""
+    sheets.planillas["vieja"] = {"title": "Pedido viejo", "filas": [
+        ["Imagen", "Talle (S)", "Talle (M)", "Talle (L)"],
+        ['=IMAGE("https://x/a.jpg")', 1, 0, 2],
+        ['=IMAGE("https://x/b.jpg")', 0, 4, 1],
+        ["Total", 8],
+    ]}
+    return "vieja"
+
+
+def test_lee_el_estado_de_una_hoja_vieja():
+    sheets = SheetsFalso()
+    estado = leer_estado_hoja(sheets, _hoja_vieja(sheets))
+    assert (estado["existing_rows"], estado["filas_totales"], estado["total_existente"]) == (4, 1, 8)
+
+
+def test_planificar_sobre_una_hoja_vieja_reemplaza_su_unica_fila_de_totales():
+    sheets = SheetsFalso()
+    estado = leer_estado_hoja(sheets, _hoja_vieja(sheets))
+    anterior = {"talles": TALLES, "por_talle": [1, 4, 3], "total": 8, "prendas": 2}
+    requests, agregado = planificar_agregado(estado, [_prenda(1)], anterior)
+    assert requests[0]["deleteDimension"]["range"] == {
+        "sheetId": 0, "dimension": "ROWS", "startIndex": 3, "endIndex": 4}
+    # Una prenda y las dos filas de totales nuevas, desde donde estaba "Total"
+    assert requests[1]["insertDimension"]["range"]["startIndex"] == 3
+    assert requests[1]["insertDimension"]["range"]["endIndex"] == 6
+    assert agregado == {"talles": TALLES, "por_talle": [2, 6, 6], "total": 14, "prendas": 3}
+    formato = [r["repeatCell"]["range"] for r in requests if "repeatCell" in r]
+    assert (formato[-1]["startRowIndex"], formato[-1]["endRowIndex"]) == (4, 6)
+
+
+def test_estado_despues_de_una_hoja_vieja():
+    sheets = SheetsFalso()
+    estado = leer_estado_hoja(sheets, _hoja_vieja(sheets))
+    despues = estado_despues(estado, 5)
+    assert (despues["existing_rows"], despues["filas_totales"]) == (10, 2)
+
+
+def test_agregar_a_una_hoja_vieja_recalcula_los_totales():
+    sheets = SheetsFalso()
+    spreadsheet_id = _hoja_vieja(sheets)
+    agregar_a_hoja(sheets, spreadsheet_id, [_prenda(1)])
+    filas = sheets.planillas[spreadsheet_id]["filas"]
+    assert len(filas) == 6
+    assert filas[3][0] == '=IMAGE("https://x/1.jpg")'
+    assert filas[4] == ["Total por talle", 2, 6, 6]
+    assert filas[5][:2] == ["Total", 14]
+
+
+def test_agregar_en_bloques_a_una_hoja_vieja(tmp_path):
+    sheets = SheetsFalso()
+    spreadsheet_id = _hoja_vieja(sheets)
+    agregados = AgregadosHojas(str(tmp_path / "agregados.db"))
+    agregar_a_hoja(sheets, spreadsheet_id, [_prenda(i) for i in range(5)], agregados=agregados, tam_bloque=2)
+    filas = sheets.planillas[spreadsheet_id]["filas"]
+    # Encabezados, 2 + 5 prendas y los totales, sin restos de la fila "Total" vieja
+    assert len(filas) == 10
+    assert [f[0] for f in filas].count("Total") == 1
+    assert filas[-2] == ["Total por talle", 6, 14, 18]
+    assert filas[-1][:2] == ["Total", 38]
+    assert agregados.obtener(spreadsheet_id)["prendas"] == 7
+    agregados.cerrar()
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from idempotencia import ClaveReutilizada, ResultadosIdempotentes, clave_idempotencia, huella
+
+
+def _contador(resultado="ok", espera=0):
+    """Corrutina que cuenta sus ejecuciones y devuelve `resultado`."""
+    async def fn():
+        fn.ejecuciones += 1
+        await asyncio.sleep(espera)
+        return resultado(fn.ejecuciones) if callable(resultado) else resultado
+
+    fn.ejecuciones = 0
+    return fn
+
+
+def test_huella_no_depende_del_orden_de_los_campos():
+    assert huella({"a": 1, "b": [1, 2]}) == huella({"b": [1, 2], "a": 1})
+    assert huella({"a": 1}) != huella({"a": 2})
+
+
+def test_la_clave_separa_tokens_y_origenes():
+    assert clave_idempotencia("t1", "k", "h") != clave_idempotencia("t2", "k", "h")
+    assert clave_idempotencia("t1", "k", "h1") == clave_idempotencia("t1", "k", "h2")
+    assert clave_idempotencia("t1", None, "h1") != clave_idempotencia("t1", None, "h2")
+
+
+def test_requests_iguales_en_curso_comparten_una_ejecucion():
+    resultados = ResultadosIdempotentes()
+    fn = _contador(espera=0.05)
+
+    async def correr():
+        return await asyncio.gather(*(resultados.ejecutar("c", "h", fn, ttl=60) for _ in range(5)))
+
+    respuestas = asyncio.run(correr())
+    assert fn.ejecuciones == 1
+    assert [r for r, _ in respuestas] == ["ok"] * 5
+    assert [repetido for _, repetido in respuestas] == [False] + [True] * 4
+    assert resultados.estadisticas() == {"ejecutados": 1, "repetidos": 0, "unidos": 4, "guardados": 1, "en_curso": 0}
+
+
+def test_repite_el_resultado_dentro_del_ttl():
+    resultados = ResultadosIdempotentes()
+    fn = _contador(lambda n: f"resultado {n}")
+
+    async def correr():
+        primero = await resultados.ejecutar("c", "h", fn, ttl=0.1)
+        repetido = await resultados.ejecutar("c", "h", fn, ttl=0.1)
+        await asyncio.sleep(0.15)
+        vencido = await resultados.ejecutar("c", "h", fn, ttl=0.1)
+        return primero, repetido, vencido
+
+    assert asyncio.run(correr()) == (("resultado 1", False), ("resultado 1", True), ("resultado 2", False))
+    assert fn.ejecuciones == 2
+
+
+def test_no_guarda_los_errores():
+    resultados = ResultadosIdempotentes()
+    fn = _contador(lambda n: 500 if n == 1 else 200)
+
+    async def correr():
+        guardar_si = lambda status: status < 300
+        return [await resultados.ejecutar("c", "h", fn, ttl=60, guardar_si=guardar_si) for _ in range(3)]
+
+    assert asyncio.run(correr()) == [(500, False), (200, False), (200, True)]
+    assert fn.ejecuciones == 2
+
+
+def test_no_guarda_las_excepciones():
+    resultados = ResultadosIdempotentes()
+
+    async def falla():
+        raise RuntimeError("falla")
+
+    async def correr():
+        with pytest.raises(RuntimeError):
+            await resultados.ejecutar("c", "h", falla, ttl=60)
+        return await resultados.ejecutar("c", "h", _contador(), ttl=60)
+
+    assert asyncio.run(correr()) == ("ok", False)
+
+
+def test_misma_clave_con_otro_payload():
+    resultados = ResultadosIdempotentes()
+
+    async def correr():
+        # En curso
+        en_curso = asyncio.ensure_future(resultados.ejecutar("c", "h1", _contador(espera=0.05), ttl=60))
+        await asyncio.sleep(0)
+        with pytest.raises(ClaveReutilizada):
+            await resultados.ejecutar("c", "h2", _contador(), ttl=60)
+        await en_curso
+        # Ya guardado
+        with pytest.raises(ClaveReutilizada):
+            await resultados.ejecutar("c", "h2", _contador(), ttl=60)
+
+    asyncio.run(correr())
+
+
+def test_la_ejecucion_sigue_si_se_cancela_el_primer_request():
+    resultados = ResultadosIdempotentes()
+    fn = _contador(espera=0.05)
+
+    async def correr():
+        primero = asyncio.ensure_future(resultados.ejecutar("c", "h", fn, ttl=60))
+        await asyncio.sleep(0)
+        segundo = asyncio.ensure_future(resultados.ejecutar("c", "h", fn, ttl=60))
+        await asyncio.sleep(0)
+        primero.cancel()
+        return await segundo
+
+    assert asyncio.run(correr()) == ("ok", True)
+    assert fn.ejecuciones == 1
+
+
+def test_max_entradas_descarta_las_mas_viejas():
+    resultados = ResultadosIdempotentes(max_entradas=2)
+    fn = _contador(lambda n: n)
+
+    async def correr():
+        for clave in ("a", "b", "c"):
+            await resultados.ejecutar(clave, "h", fn, ttl=60)
+        return await resultados.ejecutar("a", "h", fn, ttl=60)
+
+    assert asyncio.run(correr()) == (4, False)
+
+
+def _pedido(n=2):
+    return {"prendas": [{"url_imagen": f"https://x/{i}.jpg", "cantidades": [1], "talles": ["S"]} for i in range(n)]}
+
+
+def test_endpoint_repite_con_la_misma_idempotency_key(entorno, cliente):
+    primera = cliente.post("/generar_google_sheet/", json=_pedido(), headers={"Idempotency-Key": "k1"})
+    repetida = cliente.post("/generar_google_sheet/", json=_pedido(), headers={"Idempotency-Key": "k1"})
+    assert primera.status_code == repetida.status_code == 200
+    assert repetida.json() == primera.json()
+    assert repetida.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in primera.headers
+    assert len(entorno.sheets.planillas) == 1
+    otra = cliente.post("/generar_google_sheet/", json=_pedido(3), headers={"Idempotency-Key": "k1"})
+    assert otra.status_code == 422
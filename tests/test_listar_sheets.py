@@ -0,0 +1,52 @@
+from fakes import _error_http
+
+
+def _planillas(entorno, n):
+    for i in range(n):
+        entorno.sheets._create({"properties": {"title": f"Pedido {i}"}})
+    # Está en Drive pero Sheets no la abre
+    return entorno.drive.crear("Pedido rota", file_id="rota")
+
+
+def _batches(entorno):
+    return entorno.sheets.llamadas.count("batch")
+
+
+def test_verifica_todas_las_planillas_por_defecto(entorno, cliente):
+    _planillas(entorno, 45)
+    respuesta = cliente.get("/listar_sheets/")
+    ids = {f["id"] for f in respuesta.json()}
+    assert len(ids) == 45 and "rota" not in ids
+    # De a TAM_LOTE_SHEETS (20) por batch
+    assert _batches(entorno) == 3
+    # Las verificadas no se vuelven a verificar; la rota sí
+    assert len(cliente.get("/listar_sheets/").json()) == 45
+    assert _batches(entorno) == 4
+
+
+def test_sin_verificar(entorno, cliente):
+    _planillas(entorno, 5)
+    assert len(cliente.get("/listar_sheets/?verificar=false").json()) == 6
+    assert _batches(entorno) == 0
+
+
+def test_sin_cuota_responde_retry_after_y_sigue_desde_lo_verificado(entorno, cliente, monkeypatch):
+    _planillas(entorno, 45)
+    monkeypatch.setattr(entorno.main.planificador, "max_reintentos", 0)
+    original = entorno.sheets._round_trip
+    llamadas = []
+
+    def round_trip(operacion):
+        llamadas.append(operacion)
+        if len(llamadas) == 2:
+            raise _error_http(429, retry_after=3, mensaje="Quota exceeded")
+        original(operacion)
+
+    monkeypatch.setattr(entorno.sheets, "_round_trip", round_trip)
+    respuesta = cliente.get("/listar_sheets/")
+    assert respuesta.status_code == 429
+    assert respuesta.headers["Retry-After"] == "3"
+    # El primer batch quedó verificado: el reintento verifica las 26 restantes
+    respuesta = cliente.get("/listar_sheets/")
+    assert len(respuesta.json()) == 45
+    assert len(llamadas) == 4
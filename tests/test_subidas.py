@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from fakes import subida_falsa
+from subidas import ColaLlena, SubidorImagenes, TiempoAgotado
+
+
+def _upload_bloqueado():
+    """Uploader que no termina hasta que se setea `liberar`."""
+    liberar = threading.Event()
+
+    def upload(archivo, **opciones):
+        liberar.wait(5)
+        return {"secure_url": "https://x/1.jpg", "bytes": len(archivo.read())}
+
+    return upload, liberar
+
+
+def _esperar(condicion, limite=2):
+    fin = time.monotonic() + limite
+    while not condicion():
+        assert time.monotonic() < fin
+        time.sleep(0.01)
+
+
+def test_sube_el_contenido_con_las_opciones():
+    upload = subida_falsa(latencia=0, cloud_name="demo")
+    subidor = SubidorImagenes(upload)
+    result = asyncio.run(subidor.subir(b"imagen", folder="pedidos"))
+    assert result["bytes"] == 6
+    assert result["public_id"].startswith("pedidos/")
+    assert subidor.pendientes == 0
+    subidor.cerrar()
+
+
+def test_rechaza_al_instante_con_la_cola_llena():
+    upload, liberar = _upload_bloqueado()
+    subidor = SubidorImagenes(upload, max_concurrencia=1, max_en_cola=1, retry_after=7)
+
+    async def correr():
+        tareas = [asyncio.create_task(subidor.subir(b"a")), asyncio.create_task(subidor.subir(b"b"))]
+        await asyncio.sleep(0)
+        assert subidor.pendientes == 2
+        with pytest.raises(ColaLlena) as error:
+            await subidor.subir(b"c")
+        assert error.value.retry_after == 7
+        liberar.set()
+        return await asyncio.gather(*tareas)
+
+    assert [r["bytes"] for r in asyncio.run(correr())] == [1, 1]
+    _esperar(lambda: subidor.pendientes == 0)
+    # Con lugar libre vuelve a aceptar
+    assert asyncio.run(subidor.subir(b"d"))["bytes"] == 1
+    subidor.cerrar()
+
+
+def test_el_timeout_no_libera_el_cupo_hasta_que_termina_el_hilo():
+    upload, liberar = _upload_bloqueado()
+    subidor = SubidorImagenes(upload, max_concurrencia=1, max_en_cola=0, timeout=0.05)
+    with pytest.raises(TiempoAgotado):
+        asyncio.run(subidor.subir(b"a"))
+    # La subida sigue en el hilo: el cupo sigue ocupado
+    assert subidor.pendientes == 1
+    with pytest.raises(ColaLlena):
+        asyncio.run(subidor.subir(b"b"))
+    liberar.set()
+    _esperar(lambda: subidor.pendientes == 0)
+    subidor.cerrar()
+
+
+def test_un_error_del_uploader_libera_el_cupo():
+    def upload(archivo, **opciones):
+        raise RuntimeError("falla")
+
+    subidor = SubidorImagenes(upload, max_concurrencia=1, max_en_cola=0)
+    with pytest.raises(RuntimeError):
+        asyncio.run(subidor.subir(b"a"))
+    _esperar(lambda: subidor.pendientes == 0)
+    subidor.cerrar()
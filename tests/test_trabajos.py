@@ -0,0 +1,104 @@
+import time
+
+from google_api import CuotaAgotada, EscrituraIncompleta
+from trabajos import ColaTrabajos
+
+
+def _esperar_estado(cola, job_id, estados=("completado", "error"), limite=5):
+    fin = time.monotonic() + limite
+    while True:
+        trabajo = cola.estado(job_id)
+        if trabajo["estado"] in estados:
+            return trabajo
+        assert time.monotonic() < fin
+        time.sleep(0.01)
+
+
+def _trabajo_sin_terminar(cola, job_id, actualizado):
+    cola._guardar({"id": job_id, "estado": "en_proceso", "progreso": 10, "mensaje": "Procesando",
+                   "resultado": None, "error": None, "intentos": 1, "creado": 0, "actualizado": actualizado})
+
+
+def test_el_estado_se_lee_desde_otro_proceso(tmp_path):
+    path = str(tmp_path / "trabajos.db")
+    cola, otra = ColaTrabajos(path=path), ColaTrabajos(path=path)
+
+    def generar(data, progreso):
+        progreso(50, "Mitad", filas_escritas=3)
+        return "https://x/hoja"
+
+    job_id = cola.encolar(generar, {})
+    trabajo = _esperar_estado(otra, job_id)
+    assert (trabajo["estado"], trabajo["resultado"], trabajo["filas_escritas"]) == ("completado", "https://x/hoja", 3)
+    assert otra.estado("inexistente") is None
+    cola.cerrar()
+    otra.cerrar()
+
+
+def test_reintenta_errores_transitorios_desde_lo_escrito(tmp_path):
+    cola = ColaTrabajos(path=str(tmp_path / "trabajos.db"), backoff=0)
+    llamadas = []
+
+    def generar(data, progreso):
+        llamadas.append(data)
+        if len(llamadas) == 1:
+            raise EscrituraIncompleta("hoja", 4, CuotaAgotada(429, 1, None))
+        return "https://x/hoja"
+
+    job_id = cola.encolar(generar, {"prendas": []})
+    trabajo = _esperar_estado(cola, job_id)
+    assert (trabajo["estado"], trabajo["intentos"]) == ("completado", 2)
+    assert llamadas[1] == {"prendas": [], "spreadsheetId": "hoja", "desde": 4}
+    cola.cerrar()
+
+
+def test_el_latido_mantiene_vigente_un_trabajo_largo(tmp_path):
+    cola = ColaTrabajos(path=str(tmp_path / "trabajos.db"), latido=0.02, vence_sin_latido=0.1)
+
+    def generar(data, progreso):
+        time.sleep(0.3)
+        return "https://x/hoja"
+
+    job_id = cola.encolar(generar, {})
+    time.sleep(0.2)
+    assert cola.estado(job_id)["estado"] == "en_proceso"
+    assert _esperar_estado(cola, job_id)["estado"] == "completado"
+    cola.cerrar()
+
+
+def test_los_trabajos_de_un_worker_muerto_vencen(tmp_path):
+    path = str(tmp_path / "trabajos.db")
+    muerto = ColaTrabajos(path=path)
+    # Un trabajo en proceso cuyo worker dejó de renovarlo
+    _trabajo_sin_terminar(muerto, "viejo", time.time() - 120)
+    muerto.cerrar()
+
+    cola = ColaTrabajos(path=path, ttl_resultados=0.05)
+    trabajo = cola.estado("viejo")
+    assert trabajo["estado"] == "error"
+    assert "dejó de responder" in trabajo["error"]
+    # Al encolar se marca como error en la tabla y, vencido el TTL, se borra
+    cola.encolar(lambda progreso: None)
+    assert cola._conn.execute("SELECT estado FROM trabajos WHERE id = 'viejo'").fetchone() == ("error",)
+    time.sleep(0.1)
+    cola.encolar(lambda progreso: None)
+    assert cola.estado("viejo") is None
+    cola.cerrar()
+
+
+def test_los_eventos_se_cortan_a_la_duracion_maxima(entorno, cliente, monkeypatch):
+    monkeypatch.setattr(entorno.main, "DURACION_EVENTOS", 0.2)
+    monkeypatch.setattr(entorno.main, "INTERVALO_EVENTOS", 0.01)
+    _trabajo_sin_terminar(entorno.main.cola_trabajos, "colgado", time.time())
+    inicio = time.monotonic()
+    respuesta = cliente.get("/jobs/colgado/eventos")
+    assert time.monotonic() - inicio < 2
+    assert respuesta.text.count("event: progreso") == 1
+
+
+def test_los_eventos_terminan_si_el_worker_murio(entorno, cliente, monkeypatch):
+    monkeypatch.setattr(entorno.main, "INTERVALO_EVENTOS", 0.01)
+    _trabajo_sin_terminar(entorno.main.cola_trabajos, "huerfano", time.time() - 3600)
+    respuesta = cliente.get("/jobs/huerfano/eventos")
+    assert "event: error" in respuesta.text
+    assert cliente.get("/jobs/huerfano").json()["estado"] == "error"
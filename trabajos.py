@@ -0,0 +1,156 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from google_api import es_error_transitorio
+
+
+class ColaTrabajosLlena(Exception):
+    def __init__(self, retry_after):
+        super().__init__("La cola de trabajos está llena, reintentar más tarde")
+        self.retry_after = retry_after
+
+
+class ColaTrabajos:
+    """Ejecuta trabajos largos en un pool de hilos y guarda su estado para
+    consultarlo después. Los errores transitorios se reintentan con backoff.
+
+    El estado va a SQLite para que cualquier worker de uvicorn conteste
+    /jobs/{id}; cada trabajo lo ejecuta y lo actualiza solo el proceso que lo
+    encoló, y el límite de la cola cuenta los pendientes de ese proceso.
+
+    Mientras un trabajo está pendiente, su proceso renueva `actualizado` cada
+    `latido` segundos. Si pasan `vence_sin_latido` segundos sin renovar (el
+    worker murió), el trabajo pasa a error y se borra como los terminados."""
+
+    def __init__(self, workers=2, max_en_cola=50, reintentos=3, backoff=2.0, ttl_resultados=3600, retry_after=10,
+                 path="trabajos.db", timeout=30, latido=10, vence_sin_latido=60):
+        self.workers = workers
+        self.max_en_cola = max_en_cola
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self.ttl_resultados = ttl_resultados
+        self.retry_after = retry_after
+        self.latido = latido
+        self.vence_sin_latido = vence_sin_latido
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="trabajo")
+        self._trabajos = {}  # trabajos pendientes de este proceso
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=timeout)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS trabajos ("
+            "id TEXT PRIMARY KEY, estado TEXT NOT NULL, datos TEXT NOT NULL, actualizado REAL NOT NULL)")
+        self._conn.commit()
+        self._parar = threading.Event()
+        self._hilo_latido = threading.Thread(target=self._latir, name="trabajos-latido", daemon=True)
+        self._hilo_latido.start()
+
+    def _pendientes(self):
+        return len(self._trabajos)
+
+    def _latir(self):
+        # Solo la columna `actualizado`: los datos del trabajo no cambian
+        while not self._parar.wait(self.latido):
+            with self._lock:
+                ahora = time.time()
+                self._conn.executemany("UPDATE trabajos SET actualizado = ? WHERE id = ?",
+                                       [(ahora, job_id) for job_id in self._trabajos])
+                self._conn.commit()
+
+    def _abandonado(self, trabajo):
+        return {**trabajo, "estado": "error", "mensaje": "Error", "actualizado": time.time(),
+                "error": "El worker que ejecutaba el trabajo dejó de responder"}
+
+    def _limpiar_viejos(self):
+        limite = time.time() - self.vence_sin_latido
+        for (datos,) in self._conn.execute(
+                "SELECT datos FROM trabajos WHERE estado IN ('en_cola', 'en_proceso') AND actualizado < ?",
+                (limite,)).fetchall():
+            self._guardar(self._abandonado(json.loads(datos)))
+        limite = time.time() - self.ttl_resultados
+        self._conn.execute(
+            "DELETE FROM trabajos WHERE estado IN ('completado', 'error') AND actualizado < ?", (limite,))
+
+    def _guardar(self, trabajo):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO trabajos (id, estado, datos, actualizado) VALUES (?, ?, ?, ?)",
+            (trabajo["id"], trabajo["estado"], json.dumps(trabajo), trabajo["actualizado"]))
+        self._conn.commit()
+
+    def encolar(self, fn, *args):
+        """Encola `fn(*args, progreso=...)` y devuelve el id del trabajo.
+        `progreso(porcentaje, mensaje, **datos)` permite informar el avance;
+        los `datos` extra quedan en el estado del trabajo."""
+        with self._lock:
+            self._limpiar_viejos()
+            if self._pendientes() >= self.workers + self.max_en_cola:
+                raise ColaTrabajosLlena(self.retry_after)
+            job_id = uuid.uuid4().hex
+            trabajo = self._trabajos[job_id] = {
+                "id": job_id,
+                "estado": "en_cola",
+                "progreso": 0,
+                "mensaje": "En cola",
+                "resultado": None,
+                "error": None,
+                "intentos": 0,
+                "creado": time.time(),
+                "actualizado": time.time(),
+            }
+            self._guardar(trabajo)
+        self._executor.submit(self._ejecutar, job_id, fn, args)
+        return job_id
+
+    def _actualizar(self, job_id, **campos):
+        with self._lock:
+            trabajo = self._trabajos[job_id]
+            trabajo.update(campos, actualizado=time.time())
+            self._guardar(trabajo)
+            if trabajo["estado"] in ("completado", "error"):
+                del self._trabajos[job_id]
+
+    def _ejecutar(self, job_id, fn, args):
+        def progreso(porcentaje, mensaje="", **datos):
+            self._actualizar(job_id, progreso=porcentaje, mensaje=mensaje, **datos)
+
+        for intento in range(1, self.reintentos + 2):
+            self._actualizar(job_id, estado="en_proceso", intentos=intento, mensaje="Procesando")
+            try:
+                resultado = fn(*args, progreso=progreso)
+            except Exception as e:
+                # Si lo hecho quedó guardado, el reintento sigue desde ahí
+                reanudar = getattr(e, "reanudar", None)
+                if reanudar and args and isinstance(args[0], dict):
+                    args = ({**args[0], **reanudar},) + tuple(args[1:])
+                if es_error_transitorio(e) and intento <= self.reintentos:
+                    espera = self.backoff * 2 ** (intento - 1)
+                    print(f"Trabajo {job_id}: error transitorio ({e}), reintento en {espera}s")
+                    self._actualizar(job_id, mensaje=f"Reintentando: {str(e)}")
+                    time.sleep(espera)
+                    continue
+                print(f"Error en trabajo {job_id}: {e}")
+                self._actualizar(job_id, estado="error", error=str(e), mensaje="Error", reanudar=reanudar)
+                return
+            self._actualizar(job_id, estado="completado", progreso=100, resultado=resultado, mensaje="Listo")
+            return
+
+    def estado(self, job_id):
+        with self._lock:
+            fila = self._conn.execute("SELECT datos, actualizado FROM trabajos WHERE id = ?", (job_id,)).fetchone()
+        if fila is None:
+            return None
+        trabajo = json.loads(fila[0])
+        if trabajo["estado"] in ("en_cola", "en_proceso") and fila[1] < time.time() - self.vence_sin_latido:
+            return self._abandonado(trabajo)
+        return trabajo
+
+    def cerrar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._parar.set()
+        self._hilo_latido.join()
+        with self._lock:
+            self._conn.close()